@@ -7,6 +7,9 @@ import { trackEvent } from "./log";
 /* Endpoint for creating new AI suggestions */
 const AI_ENDPOINT: string = "http://127.0.0.1:8001/suggestion";
 
+/* Endpoint for starting suggestions in the background */
+const PREFETCH_ENDPOINT: string = "http://127.0.0.1:8001/suggestion/prefetch";
+
 /* Endpoint for saving AI suggestions */
 const LOG_SUGGESTION_ENDPOINT: string = "https://ai.nickrucinski.com/logs/suggestion";
 
@@ -41,7 +44,7 @@ export async function fetchSuggestions(
             headers: {
                 "Content-Type": "application/json"
             },
-            body: JSON.stringify({ prompt, model, temperature, top_k, top_p, max_tokens }),
+            body: JSON.stringify({ prompt, model, temperature, top_k, top_p, max_tokens, paired: true }),
         });
 
         const endTime = Date.now(); 
@@ -82,6 +85,41 @@ export async function fetchSuggestions(
     }
 }
 
+/**
+ * Asks the server to start generating suggestions for the given prompt in the background,
+ * so they are ready when fetchSuggestions is called after the typing pause.
+ * Uses the same defaults as fetchSuggestions, the parameters must match for the result to be reused.
+ *
+ * @param {string} prompt - The input prompt the next suggestion will likely be requested for.
+ * @param {string} model - The LLM to be usded for generating suggestions.
+ * @param {string} temperature - The temperature value to use for generating the response. Defaulted to 0.2.
+ * @param {string} top_k - The Top K value to use for generating the response. Defaulted to 0.
+ * @param {string} top_p - The Top P value to use for generating the response. Defaulted to 0.
+ * @param {string} max_tokens - The max number of tokens allowed for response length.
+ */
+export async function prefetchSuggestions(
+    prompt: string,
+    model: string = "gemini",
+    temperature: number = 0.2,
+    top_k: number = 0,
+    top_p: number = 1,
+    max_tokens: number = 256,
+    endpoint = PREFETCH_ENDPOINT
+): Promise<void> {
+    try {
+        await fetch(endpoint, {
+            method: "POST",
+            headers: {
+                "Content-Type": "application/json"
+            },
+            body: JSON.stringify({ prompt, model, temperature, top_k, top_p, max_tokens }),
+        });
+    } catch (error: any) {
+        // Prefetching only saves time, the suggestion is still fetched normally
+        console.log(`Prefetch failed: ${error.message}`);
+    }
+}
+
 /**
  * Save AI-generated suggestion.
  *
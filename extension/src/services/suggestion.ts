@@ -1,5 +1,5 @@
 import * as vscode from 'vscode';
-import { fetchSuggestions } from '../api/suggestion';
+import { fetchSuggestions, prefetchSuggestions } from '../api/suggestion';
 import { createCodeComparisonWebview } from '../utils/views';
 import { logSuggestionEvent } from './log';
 
@@ -17,6 +17,9 @@ let suggestionContext = {
 /** Timeout handler for debouncing text changes */
 let debounceTimer: NodeJS.Timeout | null = null;
 const TYPING_PAUSE_THRESHOLD = 2000;
+/** Shorter pause after which the server starts generating in the background */
+let prefetchTimer: NodeJS.Timeout | null = null;
+const PREFETCH_PAUSE_THRESHOLD = 300;
 let lastRequest: { document: vscode.TextDocument; position: vscode.Position; context: vscode.InlineCompletionContext; token: vscode.CancellationToken } | null = null;
 
 /**
@@ -43,6 +46,13 @@ export async function provideInlineCompletionItems(
         // Store the latest request
         lastRequest = { document, position, context, token };
 
+        if (prefetchTimer) {
+            clearTimeout(prefetchTimer);
+        }
+        prefetchTimer = setTimeout(() => {
+            prefetchSuggestions(getPromptText(document, position));
+        }, PREFETCH_PAUSE_THRESHOLD);
+
         // Set a new timer
         debounceTimer = setTimeout(async () => {
             if (lastRequest) {
@@ -6,6 +6,10 @@ from flask_cors import CORS
 from flask_session import Session
 
 from app.routes import register_blueprints
+from app.commands import register_commands
+from app.controllers.ai import warm_up
+from app.controllers.residency import start_model_residency
+from app.services.suggestion_service import startCacheWarmup
 
 from flasgger import Swagger
 from gotrue import SyncSupportedStorage
@@ -32,6 +36,156 @@ def getEnvironmentVars(app):
     app.config["OPENAI_API_KEY"] = OPENAI_API_KEY
     app.config["GEMINI_API_KEY"] = GEMINI_API_KEY
 
+    # Create the vendor clients at startup instead of on the first request
+    app.config["VENDOR_WARMUP"] = os.getenv("VENDOR_WARMUP", "true").lower() == "true"
+
+    # Ollama connection pool, size it to at least the number of worker threads
+    app.config["OLLAMA_POOL_SIZE"] = int(os.getenv("OLLAMA_POOL_SIZE", 10))
+    app.config["OLLAMA_POOL_BLOCK"] = os.getenv("OLLAMA_POOL_BLOCK", "false").lower() == "true"
+    app.config["OLLAMA_KEEP_ALIVE"] = os.getenv("OLLAMA_KEEP_ALIVE", "true").lower() == "true"
+    app.config["OLLAMA_IDLE_TIMEOUT"] = float(os.getenv("OLLAMA_IDLE_TIMEOUT", 60))
+    app.config["OLLAMA_CONNECT_TIMEOUT"] = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", 3.05))
+    app.config["OLLAMA_READ_TIMEOUT"] = float(os.getenv("OLLAMA_READ_TIMEOUT", 120))
+
+    # Ollama models loaded at startup and kept loaded, and what happens to requests for a model that is not loaded
+    # (OLLAMA_COLD_MODEL_POLICY is queue, refuse or allow), off unless OLLAMA_RESIDENCY is set
+    app.config["OLLAMA_RESIDENCY"] = os.getenv("OLLAMA_RESIDENCY", "false").lower() == "true"
+    app.config["OLLAMA_PRELOAD_MODELS"] = [m.strip() for m in os.getenv("OLLAMA_PRELOAD_MODELS", "codellama").split(",") if m.strip()]
+    app.config["OLLAMA_MODEL_KEEP_ALIVE"] = os.getenv("OLLAMA_MODEL_KEEP_ALIVE", "1h")
+    app.config["OLLAMA_RESIDENCY_INTERVAL"] = float(os.getenv("OLLAMA_RESIDENCY_INTERVAL", 60))
+    app.config["OLLAMA_HOT_WINDOW"] = float(os.getenv("OLLAMA_HOT_WINDOW", 1800))
+    app.config["OLLAMA_COLD_MODEL_POLICY"] = os.getenv("OLLAMA_COLD_MODEL_POLICY", "queue")
+    app.config["OLLAMA_COLD_WAIT"] = float(os.getenv("OLLAMA_COLD_WAIT", 30))
+    app.config["OLLAMA_COLD_RETRY_AFTER"] = int(os.getenv("OLLAMA_COLD_RETRY_AFTER", 10))
+
+    # Ollama stops generating at any of these sequences (comma separated, \n for a newline), and once the
+    # completion closes the block the cursor is in if SUGGESTION_BLOCK_STOP is set
+    app.config["OLLAMA_STOP_SEQUENCES"] = [
+        sequence.replace("\\n", "\n") for sequence in os.getenv("OLLAMA_STOP_SEQUENCES", "\\n\\n\\n,```").split(",") if sequence
+    ]
+    app.config["SUGGESTION_BLOCK_STOP"] = os.getenv("SUGGESTION_BLOCK_STOP", "true").lower() == "true"
+
+    # Ollama contexts kept per (client, document, model) so a prompt that extends the previous one only sends the new text
+    app.config["OLLAMA_CONTEXT_REUSE"] = os.getenv("OLLAMA_CONTEXT_REUSE", "true").lower() == "true"
+    app.config["OLLAMA_CONTEXT_SESSIONS"] = int(os.getenv("OLLAMA_CONTEXT_SESSIONS", 256))
+    app.config["OLLAMA_CONTEXT_MAX_BYTES"] = int(os.getenv("OLLAMA_CONTEXT_MAX_BYTES", 64 * 1024 * 1024))
+    app.config["OLLAMA_CONTEXT_TTL"] = float(os.getenv("OLLAMA_CONTEXT_TTL", 600))
+    app.config["OLLAMA_CONTEXT_MAX_TOKENS"] = int(os.getenv("OLLAMA_CONTEXT_MAX_TOKENS", 4096))
+
+    # Documents opened with /document/open, kept per (client, document) so clients only send their edits.
+    # Prompts read at most DOCUMENT_CONTEXT_CHARS characters before the cursor
+    app.config["DOCUMENT_SESSIONS"] = int(os.getenv("DOCUMENT_SESSIONS", 256))
+    app.config["DOCUMENT_MAX_CHARS"] = int(os.getenv("DOCUMENT_MAX_CHARS", 64 * 1024 * 1024))
+    app.config["DOCUMENT_TTL"] = float(os.getenv("DOCUMENT_TTL", 1800))
+    app.config["DOCUMENT_CONTEXT_CHARS"] = int(os.getenv("DOCUMENT_CONTEXT_CHARS", 16000))
+
+    # WebSocket entry point (app/websocket.py), run by "flask --app app websocket", which run.py
+    # starts next to the Flask server when WEBSOCKET_PORT is set
+    app.config["WEBSOCKET_HOST"] = os.getenv("WEBSOCKET_HOST", "127.0.0.1")
+    app.config["WEBSOCKET_PORT"] = int(os.getenv("WEBSOCKET_PORT")) if os.getenv("WEBSOCKET_PORT") else None
+
+    # Open connections per upstream for the ASGI entry point (app/asgi.py), and the threads its
+    # suggestions run on, waiting for a model slot included
+    app.config["ASYNC_MAX_CONNECTIONS"] = int(os.getenv("ASYNC_MAX_CONNECTIONS", 500))
+    app.config["ASGI_WORKERS"] = int(os.getenv("ASGI_WORKERS", 64))
+
+    # Most alternative suggestions a client may ask for in one request
+    app.config["SUGGESTION_MAX_CANDIDATES"] = int(os.getenv("SUGGESTION_MAX_CANDIDATES", 5))
+
+    # Threads for generations that run in the background or in parallel
+    app.config["SUGGESTION_WORKERS"] = int(os.getenv("SUGGESTION_WORKERS", 16))
+
+    # Hedging: after HEDGE_DELAY seconds (or the latency percentile of the model if unset)
+    # the prompt is also sent to HEDGE_VENDOR and the first answer wins
+    app.config["SUGGESTION_HEDGING"] = os.getenv("SUGGESTION_HEDGING", "false").lower() == "true"
+    app.config["HEDGE_VENDOR"] = os.getenv("HEDGE_VENDOR", "openai")
+    app.config["HEDGE_MODEL"] = os.getenv("HEDGE_MODEL", "gpt-4o-mini")
+    app.config["HEDGE_DELAY"] = float(os.getenv("HEDGE_DELAY")) if os.getenv("HEDGE_DELAY") else None
+    app.config["HEDGE_PERCENTILE"] = float(os.getenv("HEDGE_PERCENTILE", 0.9))
+    app.config["HEDGE_DEFAULT_DELAY"] = float(os.getenv("HEDGE_DEFAULT_DELAY", 1.0))
+
+    # Cascade mode: "vendor:model" tiers from the cheapest up, a tier's answer is escalated when it fails cheap checks
+    app.config["SUGGESTION_CASCADE"] = os.getenv("SUGGESTION_CASCADE", "false").lower() == "true"
+    app.config["CASCADE_TIERS"] = [
+        t.strip() for t in os.getenv("CASCADE_TIERS", "ollama:qwen2.5-coder:1.5b,ollama:codellama,openai:gpt-4o-mini").split(",") if t.strip()
+    ]
+
+    # Routing: requests without a vendor go to the healthiest of ROUTING_CANDIDATES ("vendor" or "vendor:model"),
+    # a backend that keeps failing is skipped for ROUTING_COOLDOWN seconds
+    app.config["ROUTING_CANDIDATES"] = [c.strip() for c in os.getenv("ROUTING_CANDIDATES", "ollama,openai:gpt-4o-mini").split(",") if c.strip()]
+    app.config["ROUTING_EWMA_ALPHA"] = float(os.getenv("ROUTING_EWMA_ALPHA", 0.2))
+    app.config["ROUTING_FAILURE_THRESHOLD"] = int(os.getenv("ROUTING_FAILURE_THRESHOLD", 5))
+    app.config["ROUTING_ERROR_THRESHOLD"] = float(os.getenv("ROUTING_ERROR_THRESHOLD", 0.5))
+    app.config["ROUTING_COOLDOWN"] = float(os.getenv("ROUTING_COOLDOWN", 30))
+    app.config["ROUTING_SLOW_LATENCY"] = float(os.getenv("ROUTING_SLOW_LATENCY", 5.0))
+
+    # Speculative generations started by /suggestion/prefetch, kept for PREFETCH_TTL seconds
+    app.config["PREFETCH_VENDOR"] = os.getenv("PREFETCH_VENDOR", "ollama")
+    app.config["PREFETCH_TTL"] = float(os.getenv("PREFETCH_TTL", 30))
+    app.config["PREFETCH_CACHE_SIZE"] = int(os.getenv("PREFETCH_CACHE_SIZE", 256))
+    app.config["PREFETCH_MAX_IN_FLIGHT"] = int(os.getenv("PREFETCH_MAX_IN_FLIGHT", 4))
+
+    # Buggy suggestions: "local" injects a bug into the correct suggestion, "model" asks the model for a buggy one
+    app.config["BUG_INJECTION"] = os.getenv("BUG_INJECTION", "local")
+
+    # Concurrent generations per "vendor/model" or "vendor", for example "ollama=4,ollama/llama3.2=2".
+    # Requests over the limit wait in a queue shared fairly between clients
+    app.config["SCHEDULER_CONCURRENCY"] = {
+        name.strip(): int(limit)
+        for name, _, limit in (entry.partition("=") for entry in os.getenv("SCHEDULER_CONCURRENCY", "ollama=4").split(",") if entry.strip())
+    }
+    app.config["SCHEDULER_MAX_QUEUE"] = int(os.getenv("SCHEDULER_MAX_QUEUE", 32))
+    app.config["SCHEDULER_MAX_QUEUED_PER_CLIENT"] = int(os.getenv("SCHEDULER_MAX_QUEUED_PER_CLIENT", 4))
+    app.config["SCHEDULER_QUEUE_TIMEOUT"] = float(os.getenv("SCHEDULER_QUEUE_TIMEOUT", 10))
+    app.config["SCHEDULER_RETRY_AFTER"] = int(os.getenv("SCHEDULER_RETRY_AFTER", 2))
+
+    # Seconds a suggestion request may take when the client sends no X-Deadline-Ms header, unlimited if unset
+    app.config["REQUEST_DEADLINE"] = float(os.getenv("REQUEST_DEADLINE")) if os.getenv("REQUEST_DEADLINE") else None
+    app.config["REQUEST_MAX_DEADLINE"] = float(os.getenv("REQUEST_MAX_DEADLINE", 120))
+    app.config["DISCONNECT_POLL_INTERVAL"] = float(os.getenv("DISCONNECT_POLL_INTERVAL", 0.25))
+
+    # Prompts are trimmed to a token budget per model, PROMPT_TOKEN_BUDGETS looks like "codellama=2048,gpt-4o-mini=4096"
+    app.config["PROMPT_TOKEN_BUDGETS"] = {
+        name.strip(): int(budget)
+        for name, _, budget in (entry.partition("=") for entry in os.getenv("PROMPT_TOKEN_BUDGETS", "").split(",") if entry.strip())
+    }
+    app.config["PROMPT_DEFAULT_TOKEN_BUDGET"] = int(os.getenv("PROMPT_DEFAULT_TOKEN_BUDGET", 2048))
+    app.config["PROMPT_HEADER_LINES"] = int(os.getenv("PROMPT_HEADER_LINES", 30))
+
+    # In-memory cache of generated suggestions
+    app.config["SUGGESTION_CACHE_SIZE"] = int(os.getenv("SUGGESTION_CACHE_SIZE", 1024))
+    app.config["SUGGESTION_CACHE_MAX_BYTES"] = int(os.getenv("SUGGESTION_CACHE_MAX_BYTES", 8 * 1024 * 1024))
+    app.config["SUGGESTION_CACHE_TTL"] = float(os.getenv("SUGGESTION_CACHE_TTL", 300))
+    app.config["SUGGESTION_CACHE_MAX_TEMPERATURE"] = float(os.getenv("SUGGESTION_CACHE_MAX_TEMPERATURE", 0.5))
+    app.config["SUGGESTION_PREFIX_INDEX_SIZE"] = int(os.getenv("SUGGESTION_PREFIX_INDEX_SIZE", 256))
+    app.config["SUGGESTION_PREFIX_MAX_TYPED"] = int(os.getenv("SUGGESTION_PREFIX_MAX_TYPED", 128))
+
+    # Completion cache in a SQLite file shared by all workers and kept across restarts, off unless a path is set.
+    # Relative paths are inside the instance folder. "flask --app app cache compact" shrinks the file
+    app.config["SUGGESTION_DISK_CACHE_PATH"] = os.getenv("SUGGESTION_DISK_CACHE_PATH", "")
+    app.config["SUGGESTION_DISK_CACHE_MAX_BYTES"] = int(os.getenv("SUGGESTION_DISK_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+    app.config["SUGGESTION_DISK_CACHE_TTL"] = float(os.getenv("SUGGESTION_DISK_CACHE_TTL", 7 * 24 * 3600))
+
+    # Preload the suggestion cache at startup with CACHE_WARMUP_LIMIT completions from the CACHE_WARMUP_WINDOW newest
+    # rows of the suggestions table, preferring the "recent" or the most "frequent" prompts. They go to the disk cache
+    # when it is on, otherwise they stay in memory for CACHE_WARMUP_TTL seconds. "flask --app app cache warm" fills the disk cache
+    app.config["CACHE_WARMUP"] = os.getenv("CACHE_WARMUP", "false").lower() == "true"
+    app.config["CACHE_WARMUP_LIMIT"] = int(os.getenv("CACHE_WARMUP_LIMIT", 1000))
+    app.config["CACHE_WARMUP_WINDOW"] = int(os.getenv("CACHE_WARMUP_WINDOW", 10000))
+    app.config["CACHE_WARMUP_PAGE_SIZE"] = int(os.getenv("CACHE_WARMUP_PAGE_SIZE", 500))
+    app.config["CACHE_WARMUP_ORDER"] = os.getenv("CACHE_WARMUP_ORDER", "recent")
+    app.config["CACHE_WARMUP_TTL"] = float(os.getenv("CACHE_WARMUP_TTL", 24 * 3600))
+
+    # Near-duplicate prompts (other names, comments or whitespace) reuse the completion of a recent prompt whose
+    # estimated similarity reaches the threshold. Off unless SUGGESTION_SIMILARITY is set, and while it is on a share
+    # of the reused completions is always checked against a fresh one
+    app.config["SUGGESTION_SIMILARITY"] = os.getenv("SUGGESTION_SIMILARITY", "false").lower() == "true"
+    app.config["SUGGESTION_SIMILARITY_THRESHOLD"] = float(os.getenv("SUGGESTION_SIMILARITY_THRESHOLD", 0.9))
+    app.config["SUGGESTION_SIMILARITY_INDEX_SIZE"] = int(os.getenv("SUGGESTION_SIMILARITY_INDEX_SIZE", 512))
+    app.config["SUGGESTION_SIMILARITY_AUDIT_RATE"] = float(os.getenv("SUGGESTION_SIMILARITY_AUDIT_RATE", 0.05))
+    if app.config["SUGGESTION_SIMILARITY"] and not 0 < app.config["SUGGESTION_SIMILARITY_AUDIT_RATE"] <= 1:
+        raise ValueError("SUGGESTION_SIMILARITY_AUDIT_RATE must be above 0 and at most 1 while SUGGESTION_SIMILARITY is on.")
+
 def create_app(test_config=None):
 
     # create and configure the app
@@ -47,6 +201,7 @@ def create_app(test_config=None):
     getEnvironmentVars(app)
     CORS(app)
     register_blueprints(app)
+    register_commands(app)
     Session(app)
     Swagger(app)
 
@@ -63,6 +218,15 @@ def create_app(test_config=None):
     except OSError:
         pass
 
+    if app.config["VENDOR_WARMUP"]:
+        warm_up(app)
+
+    if app.config["OLLAMA_RESIDENCY"]:
+        start_model_residency(app)
+
+    if app.config["CACHE_WARMUP"]:
+        startCacheWarmup(app)
+
     return app
 
 if __name__ == '__main__':
@@ -0,0 +1,272 @@
+"""
+ASGI entry point for the suggestion and logging routes.
+
+Connections, request bodies and the Supabase calls of the logging routes are handled on a single
+event loop with httpx, so one process can keep hundreds of clients connected. Suggestions go
+through the same pipeline as the Flask route, run on ASGI_WORKERS threads: the admission
+scheduler with its concurrency limits, 429/503 and preemption, vendor routing and the circuit
+breaker, coalescing, the memory, disk, prefetch and similarity caches, and cancellation. A
+request waiting for a model therefore holds a worker thread, and the backpressure is the same as
+on the Flask route. Run it next to the Flask app with any ASGI server:
+
+    uvicorn app.asgi:application --port 8002
+
+Only POST /suggestion, POST /logs and POST /logs/suggestion are served here, and /suggestion
+answers a single suggestion: "paired" and "n" are only served by the Flask route. It shares the
+configuration and the caches of the Flask app it wraps. Suggestions honour the X-Deadline-Ms
+header and are cancelled when the client disconnects.
+"""
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from app import create_app
+from app.controllers.async_clients import AsyncClients
+from app.controllers.deadlines import request_deadline
+from app.models.cancellation import CancelToken
+from app.models.errors import BaseError, DeadlineExceededError
+from app.models.status_codes import StatusCodes
+from app.services.log_service import log_event_async, log_suggestion_async
+from app.services.suggestion_service import getBuggySuggestion, getSuggestion
+
+
+
+def _body(status: str, message: str, data=None):
+    return {
+        "status": status,
+        "message": message,
+        "data": data,
+    }
+
+
+class AsyncApplication:
+    """
+    Minimal ASGI application for the suggestion and logging routes.
+
+    Args:
+        flask_app (Flask): The app whose config and caches are used. Created with create_app if omitted.
+        clients (AsyncClients): The httpx clients to use. Created on the serving event loop if omitted.
+    """
+    def __init__(self, flask_app=None, clients: AsyncClients = None):
+        self.flask_app = flask_app or create_app()
+        self.clients = clients
+        self.executor = ThreadPoolExecutor(max_workers=self.flask_app.config["ASGI_WORKERS"], thread_name_prefix="asgi")
+        self.routes = {
+            ("POST", "/suggestion"): self.suggestion,
+            ("POST", "/logs"): self.log_event,
+            ("POST", "/logs/suggestion"): self.log_suggestion,
+        }
+        self.cancellable = {self.suggestion}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+
+        if scope["type"] != "http":
+            return
+
+        if scope["method"] == "OPTIONS":
+            await self.preflight(send)
+            return
+
+        handler = self.routes.get((scope["method"], scope["path"]))
+        if handler is None:
+            await self.respond(send, _body("Error", "Not found"), StatusCodes.NOT_FOUND)
+            return
+
+        try:
+            data = json.loads(await self.read_body(receive) or b"{}")
+        except ValueError:
+            await self.respond(send, _body("Error", "Invalid JSON body"), StatusCodes.BAD_REQUEST)
+            return
+
+        if self.clients is None:
+            self.clients = AsyncClients(self.flask_app.config)
+
+        # App contexts live in context variables, so each request task gets its own
+        with self.flask_app.app_context():
+            if handler in self.cancellable:
+                result = await self.run_cancellable(handler, data, scope, receive)
+            else:
+                result = await handler(data)
+
+        if result is None:
+            return  # The client is gone, there is nobody to answer
+        body, status_code, *headers = result
+        await self.respond(send, body, status_code, *headers)
+
+    async def run_cancellable(self, handler, data, scope, receive):
+        """
+        Runs a handler until it answers, its deadline passes (504) or the client disconnects (None).
+
+        The handler gets a cancel token with the deadline of the request. Cancelling it stops the
+        generation upstream, the worker thread counts the time it wasted.
+        """
+        header = dict(scope.get("headers", [])).get(b"x-deadline-ms")
+        cancel = CancelToken(timeout=request_deadline(header.decode("latin-1") if header else None))
+
+        task = asyncio.ensure_future(handler(data, scope, cancel))
+        disconnect = asyncio.ensure_future(self.wait_for_disconnect(receive))
+        try:
+            # The token answers at the deadline, the timeout only covers a worker that never started
+            done, _ = await asyncio.wait({task, disconnect}, timeout=cancel.remaining(), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            disconnect.cancel()
+
+        if task in done:
+            cancel.close()
+            return task.result()
+
+        task.cancel()
+        if disconnect in done:
+            cancel.cancel("Client disconnected")
+            return None
+        cancel.cancel("Deadline exceeded", DeadlineExceededError)
+        return _body("Error", "Deadline exceeded"), StatusCodes.GATEWAY_TIMEOUT
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                if self.clients is None:
+                    self.clients = AsyncClients(self.flask_app.config)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.clients is not None:
+                    await self.clients.aclose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def suggestion(self, data, scope, cancel: CancelToken):
+        prompt = data.get("prompt", "")
+        if not prompt:
+            return _body("Error", "No prompt provided"), StatusCodes.BAD_REQUEST
+        if data.get("paired") or data.get("n", 1) != 1:
+            return _body("Error", "paired and n are only served by the Flask route"), StatusCodes.BAD_REQUEST
+
+        headers = dict(scope.get("headers", []))
+        client = scope.get("client") or ("anonymous",)
+        trace = {}
+        params = dict(
+            prompt=prompt,
+            model_name=data.get("model", "codellama"),
+            temperature=data.get("temperature", 0.2),
+            top_p=data.get("top_p", 1),
+            top_k=data.get("top_k", 0),
+            max_tokens=data.get("max_tokens", 256),
+            hedge=data.get("hedge"),
+            client_id=str(data.get("userId") or headers.get(b"x-client-id", b"").decode("latin-1") or client[0]),
+            cancel=cancel,
+            document_id=data.get("documentId"),
+            cascade=data.get("cascade"),
+            quality=data.get("quality"),
+            trace=trace
+        )
+
+        try:
+            if data.get("isCorrect", True):
+                response, bug = await self.run_in_worker(getSuggestion, **params), None
+            else:
+                response, bug = await self.run_in_worker(getBuggySuggestion, language=data.get("language"), **params)
+
+            result = {"suggestions": [response]}
+            if "tier" in trace:
+                result["tier"] = trace["tier"]
+            if bug is not None:
+                result["bug"] = bug
+            return _body("Success", "AI Suggestions", result), StatusCodes.OK
+
+        except BaseError as e:
+            headers = {"retry-after": str(e.retry_after)} if e.retry_after else {}
+            return _body("Error", e.message), e.status_code, headers
+
+        except Exception as e:
+            return _body("Error", str(e)), StatusCodes.SERVER_ERROR
+
+    async def run_in_worker(self, fn, **kwargs):
+        """
+        Runs a blocking service function on a worker thread inside the app context.
+        """
+        def run():
+            with self.flask_app.app_context():
+                return fn(**kwargs)
+
+        return await asyncio.wrap_future(self.executor.submit(run))
+
+    async def log_event(self, data):
+        missing_fields = [field for field in ['event', 'metadata'] if field not in data]
+        if missing_fields:
+            return _body("Error", f"Missing required fields: {', '.join(missing_fields)}"), StatusCodes.BAD_REQUEST
+
+        try:
+            await log_event_async(self.clients.db, data)
+            return _body("Success", "Logged event"), StatusCodes.CREATED
+
+        except Exception as e:
+            return _body("Error", f"Error logging event: {e}"), StatusCodes.SERVER_ERROR
+
+    async def log_suggestion(self, data):
+        required_fields = ['prompt', 'suggestionText', 'hasBug', 'model']
+        missing_fields = [field for field in required_fields if field not in data]
+        if missing_fields:
+            return _body("Error", f"Missing required fields: {', '.join(missing_fields)}"), StatusCodes.BAD_REQUEST
+
+        suggestion = {
+            'prompt': data['prompt'],
+            'suggestion_text': data['suggestionText'],
+            'has_bug': data['hasBug'],
+            'model': data['model'],
+        }
+
+        try:
+            await log_suggestion_async(self.clients.db, suggestion)
+            return _body("Success", "Logged suggestion"), StatusCodes.CREATED
+
+        except Exception as e:
+            return _body("Error", f"Error logging event: {e}"), StatusCodes.SERVER_ERROR
+
+    @staticmethod
+    async def read_body(receive):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                return body
+
+    @staticmethod
+    async def wait_for_disconnect(receive):
+        # The body has been read, so the next message is the disconnect
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    @staticmethod
+    async def preflight(send):
+        await send({
+            "type": "http.response.start",
+            "status": 204,
+            "headers": [
+                (b"access-control-allow-origin", b"*"),
+                (b"access-control-allow-methods", b"POST, OPTIONS"),
+                (b"access-control-allow-headers", b"content-type, x-deadline-ms"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": b""})
+
+    @staticmethod
+    async def respond(send, body, status_code: StatusCodes, headers: dict = None):
+        payload = json.dumps(body).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status_code.value,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(payload)).encode()),
+                (b"access-control-allow-origin", b"*"),
+            ] + [(name.encode(), value.encode()) for name, value in (headers or {}).items()],
+        })
+        await send({"type": "http.response.body", "body": payload})
+
+
+application = AsyncApplication()
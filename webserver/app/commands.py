@@ -0,0 +1,62 @@
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from app.controllers.disk_cache import disk_cache
+from app.services.suggestion_service import warmSuggestionCache
+from app.websocket import SuggestionSocketServer
+import click
+
+cache_cli = AppGroup("cache", help="Manage the completion caches.")
+
+
+@cache_cli.command("compact")
+def compact_cache_command():
+    """
+    Drop expired completions from the disk cache, evict down to its size limit and shrink the file.
+    """
+    if not disk_cache:
+        raise click.ClickException("The disk cache is off, set SUGGESTION_DISK_CACHE_PATH")
+
+    result = disk_cache.compact()
+    click.echo(
+        f"Removed {result['expired']} expired and {result['evicted']} evicted completions, "
+        f"{result['file_bytes_before']} -> {result['file_bytes_after']} bytes"
+    )
+
+
+@cache_cli.command("warm")
+@click.option("--limit", type=int, default=None, help="Most completions stored.")
+@click.option("--window", type=int, default=None, help="Rows read from the suggestions table, newest first.")
+@click.option("--page-size", type=int, default=None, help="Rows fetched per request.")
+@click.option("--order", type=click.Choice(["recent", "frequent"]), default=None, help="Which prompts to prefer.")
+def warm_cache_command(limit, window, page_size, order):
+    """
+    Fill the disk cache with the prompt/completion pairs logged in the suggestions table.
+    """
+    if not disk_cache:
+        raise click.ClickException("The disk cache is off, set SUGGESTION_DISK_CACHE_PATH")
+
+    loaded = warmSuggestionCache(limit=limit, page_size=page_size, order=order, disk=True, window=window)
+    click.echo(f"Stored {loaded} completions in {disk_cache.path}")
+
+
+@click.command("websocket")
+@click.option("--host", default=None, help="Interface to listen on, defaults to WEBSOCKET_HOST.")
+@click.option("--port", type=int, default=None, help="Port to listen on, defaults to WEBSOCKET_PORT or 8003.")
+@with_appcontext
+def websocket_command(host, port):
+    """
+    Serve suggestions over WebSocket until interrupted.
+    """
+    app = current_app._get_current_object()
+    server = SuggestionSocketServer(
+        app,
+        host=host or app.config["WEBSOCKET_HOST"],
+        port=port or app.config["WEBSOCKET_PORT"] or 8003
+    )
+    click.echo(f"Serving suggestions on ws://{server.host}:{server.port}")
+    server.serve_forever()
+
+
+def register_commands(app):
+    app.cli.add_command(cache_cli)
+    app.cli.add_command(websocket_command)
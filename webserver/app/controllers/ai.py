@@ -1,12 +1,19 @@
 from openai import OpenAI
-from flask import current_app, g
+from flask import current_app
 from enum import Enum
+from requests.adapters import HTTPAdapter
 from werkzeug.local import LocalProxy
 import google.generativeai as genai
+import requests
+import threading
+import time
 
 
 
 OLLAMA_URL = "http://localhost:11434/api/generate"  
+OLLAMA_VERSION_URL = "http://localhost:11434/api/version"
+OLLAMA_PS_URL = "http://localhost:11434/api/ps"
+OLLAMA_TAGS_URL = "http://localhost:11434/api/tags"
 DEFAULT_MODEL_NAME = "codellama:latest"
 
 # system command to create a special AI model
@@ -41,13 +48,164 @@ class vendors(Enum):
     Ollama = "ollama"
     Google = "google"
 
-def get_ai():
-    if "ai" not in g:
-        g.ai = OpenAI(api_key=current_app.config["OPENAI_API_KEY"])
-        return g.ai
-def get_gemini():
-    if "gemini" not in g:
-        genai.configure(api_key=current_app.config["GEMINI_API_KEY"])
+class OllamaPool:
+    """
+    Process-wide HTTP client for Ollama that keeps connections open between requests.
+
+    Args:
+        pool_size (int): Maximum number of connections kept open to Ollama.
+        block (bool): Wait for a free connection instead of opening a throwaway one when the pool is exhausted.
+        keep_alive (bool): Reuse connections between requests. If False every request opens a new connection.
+        idle_timeout (float): Seconds a pooled connection may sit unused before it is dropped and reopened.
+        connect_timeout (float): Seconds to wait for the connection to Ollama to open.
+        read_timeout (float): Seconds to wait for Ollama to send data.
+    """
+    def __init__(
+        self,
+        pool_size: int = 10,
+        block: bool = False,
+        keep_alive: bool = True,
+        idle_timeout: float = 60,
+        connect_timeout: float = 3.05,
+        read_timeout: float = 120
+    ):
+        self.pool_size = pool_size
+        self.block = block
+        self.keep_alive = keep_alive
+        self.idle_timeout = idle_timeout
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=block)
+        self.session = requests.Session()
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+
+        self._lock = threading.Lock()
+        self._last_used = time.monotonic()
+        self._requests = 0
+        self._errors = 0
+        self._idle_resets = 0
+
+    def post(self, url: str, **kwargs):
+        """
+        Sends a POST request through the pool. Accepts the same arguments as requests.post.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+
+        with self._lock:
+            now = time.monotonic()
+            # Ollama closes idle sockets on its side, drop ours before reusing a dead one
+            if now - self._last_used > self.idle_timeout:
+                self.adapter.poolmanager.clear()
+                self._idle_resets += 1
+            self._last_used = now
+            self._requests += 1
+
+        try:
+            return self.session.post(url, **kwargs)
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+
+    def stats(self):
+        """
+        Returns usage statistics for sizing the pool against the worker count.
+        """
+        open_connections = 0
+        in_use = 0
+        connections_created = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            # Free slots hold either an idle connection or None
+            idle = [conn for conn in list(pool.pool.queue) if conn]
+            open_connections += len(idle)
+            in_use += pool.pool.maxsize - pool.pool.qsize()
+            connections_created += pool.num_connections
+
+        with self._lock:
+            return {
+                "pool_size": self.pool_size,
+                "block": self.block,
+                "keep_alive": self.keep_alive,
+                "connect_timeout": self.timeout[0],
+                "read_timeout": self.timeout[1],
+                "requests": self._requests,
+                "errors": self._errors,
+                "connections_in_use": in_use,
+                "idle_connections": open_connections,
+                "connections_created": connections_created,
+                "idle_resets": self._idle_resets,
+            }
+
+class VendorRegistry:
+    """
+    Long-lived vendor clients shared by every request and thread of the process.
+
+    Each client is created once, on first use or by warm_up, and keeps its connection pool
+    for the lifetime of the app instead of being rebuilt for every request.
+
+    Args:
+        config (dict): The Flask app config holding the API keys and Ollama pool settings.
+    """
+    def __init__(self, config):
+        self.config = config
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._factories = {
+            "openai": self._create_openai,
+            "gemini": self._create_gemini,
+            "ollama": self._create_ollama,
+        }
+        self._warm_up_seconds = None
+
+    def get(self, name: str):
+        """
+        Returns the client for a vendor, creating it the first time it is asked for.
+        """
+        client = self._clients.get(name)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    client = self._clients[name] = self._factories[name]()
+        return client
+
+    def warm_up(self):
+        """
+        Creates every client and opens a first connection to Ollama so that the first user request does not pay for it.
+        """
+        start = time.monotonic()
+        for name in self._factories:
+            try:
+                self.get(name)
+            except Exception as e:
+                print(f"Warning: could not initialize the {name} client: {e}")
+
+        try:
+            self.get("ollama").session.get(OLLAMA_VERSION_URL, timeout=self.get("ollama").timeout)
+        except Exception as e:
+            print(f"Warning: could not connect to Ollama: {e}")
+
+        self._warm_up_seconds = time.monotonic() - start
+
+    def stats(self):
+        with self._lock:
+            return {
+                "initialized": sorted(self._clients),
+                "warm_up_seconds": self._warm_up_seconds,
+            }
+
+    def _create_openai(self):
+        return OpenAI(api_key=self.config["OPENAI_API_KEY"])
+
+    def _create_gemini(self):
+        genai.configure(api_key=self.config["GEMINI_API_KEY"])
         # Create the model
         generation_config = {
         "temperature": 1,
@@ -56,14 +214,50 @@ def get_gemini():
         "max_output_tokens": 8192,
         "response_mime_type": "text/plain",
         }
-        g.gemini = genai.GenerativeModel(
+        return genai.GenerativeModel(
             model_name="learnlm-1.5-pro-experimental",
             generation_config=generation_config,
         )
-        g.gemini.chat_session = g.gemini.start_chat(
-            history=[]
+
+    def _create_ollama(self):
+        return OllamaPool(
+            pool_size=self.config["OLLAMA_POOL_SIZE"],
+            block=self.config["OLLAMA_POOL_BLOCK"],
+            keep_alive=self.config["OLLAMA_KEEP_ALIVE"],
+            idle_timeout=self.config["OLLAMA_IDLE_TIMEOUT"],
+            connect_timeout=self.config["OLLAMA_CONNECT_TIMEOUT"],
+            read_timeout=self.config["OLLAMA_READ_TIMEOUT"],
         )
-        return g.gemini
-    
+
+_registry_lock = threading.Lock()
+
+def get_registry() -> VendorRegistry:
+    if "vendors" not in current_app.extensions:
+        with _registry_lock:
+            if "vendors" not in current_app.extensions:
+                current_app.extensions["vendors"] = VendorRegistry(current_app.config)
+    return current_app.extensions["vendors"]
+
+def warm_up(app):
+    """
+    Initializes the vendor clients of app in the background so startup is not blocked on the network.
+    """
+    def run():
+        with app.app_context():
+            get_registry().warm_up()
+
+    threading.Thread(target=run, name="vendor-warm-up", daemon=True).start()
+
+def get_ai() -> OpenAI:
+    return get_registry().get("openai")
+
+def get_gemini():
+    return get_registry().get("gemini")
+
+def get_ollama() -> OllamaPool:
+    return get_registry().get("ollama")
+
+vendor_registry = LocalProxy(get_registry)
 client = LocalProxy(get_ai)
-gemini_client = LocalProxy(get_gemini)
\ No newline at end of file
+gemini_client = LocalProxy(get_gemini)
+ollama_client = LocalProxy(get_ollama)
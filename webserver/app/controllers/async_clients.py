@@ -0,0 +1,39 @@
+import httpx
+
+
+
+class AsyncClients:
+    """
+    Non-blocking HTTP clients used by the ASGI entry point.
+
+    httpx clients are bound to the event loop they are first used on, so an instance must be
+    created and closed on the loop that serves the requests. Model calls go through the shared
+    suggestion pipeline and its clients instead, see app/asgi.py.
+
+    Args:
+        config (dict): The Flask app config, used for the Supabase credentials and the pool settings.
+        transport (httpx.AsyncBaseTransport): Optional transport for every client, mainly for benchmarks and tests.
+    """
+    def __init__(self, config, transport: httpx.AsyncBaseTransport = None):
+        limits = httpx.Limits(
+            max_connections=config["ASYNC_MAX_CONNECTIONS"],
+            max_keepalive_connections=config["OLLAMA_POOL_SIZE"],
+            keepalive_expiry=config["OLLAMA_IDLE_TIMEOUT"]
+        )
+        timeout = httpx.Timeout(config["OLLAMA_READ_TIMEOUT"], connect=config["OLLAMA_CONNECT_TIMEOUT"])
+
+        # PostgREST is what the Supabase client talks to under the hood
+        self.db = httpx.AsyncClient(
+            base_url=f"{config['SUPABASE_URL']}/rest/v1",
+            headers={
+                "apikey": config["SUPABASE_KEY"],
+                "Authorization": f"Bearer {config['SUPABASE_KEY']}",
+                "Prefer": "return=representation",
+            },
+            limits=limits,
+            timeout=timeout,
+            transport=transport
+        )
+
+    async def aclose(self):
+        await self.db.aclose()
@@ -0,0 +1,415 @@
+from collections import OrderedDict
+from flask import current_app
+from werkzeug.local import LocalProxy
+import random
+import threading
+import time
+
+
+
+def completion_key(
+    prompt: str,
+    vendor: str,
+    model_name: str,
+    is_correct: bool,
+    temperature: float,
+    top_p: float,
+    top_k: int,
+    max_tokens: int
+):
+    """
+    Builds the cache key for a completion. Every argument that changes what the model returns must be part of it.
+    """
+    vendor = getattr(vendor, "value", vendor)
+    return (prompt, vendor, model_name, bool(is_correct), float(temperature), float(top_p), int(top_k), int(max_tokens))
+
+
+def entry_size(key: tuple, value) -> int:
+    """
+    Approximates the memory used by a cache entry as the encoded size of its strings.
+    """
+    values = value if isinstance(value, (list, tuple)) else [value]
+    return len(key[0].encode("utf-8")) + sum(len(str(v).encode("utf-8")) for v in values)
+
+
+class CompletionCache:
+    """
+    Thread-safe LRU cache for generated completions with a time to live and a size cap.
+
+    Args:
+        max_entries (int): Maximum number of completions kept.
+        max_bytes (int): Maximum total size of the cached prompts and completions.
+        ttl (float): Seconds a completion stays valid after it was stored.
+    """
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 8 * 1024 * 1024, ttl: float = 300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._entries = OrderedDict()  # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expired = 0
+
+    def get(self, key: tuple):
+        """
+        Returns the cached completion for key, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+
+            value, expires_at, size = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self._expired += 1
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def contains(self, key: tuple) -> bool:
+        """
+        Returns whether an unexpired completion is cached for key, without counting a lookup.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[1] > time.monotonic()
+
+    def put(self, key: tuple, value, ttl: float = None):
+        """
+        Stores a completion, evicting the least recently used entries until both caps are respected.
+        ttl overrides the time to live of the cache for this completion.
+        """
+        size = entry_size(key, value)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl), size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self._evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "expired": self._expired,
+            }
+
+    def _remove(self, key: tuple):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+
+class PrefixIndex:
+    """
+    Recent prompt/completion pairs indexed by prompt length, so a completion can be reused while the user types it out.
+
+    When a new prompt is a cached prompt followed by text that matches the start of that prompt's
+    completion, the rest of the completion is still a valid suggestion and no model call is needed.
+    Candidates are found by looking up the cached prompts that are 1 to max_typed characters shorter
+    than the new prompt, so a lookup never rehashes or copies the prompt itself.
+
+    Args:
+        max_entries (int): Maximum number of prompts kept in the index.
+        max_typed (int): Longest run of typed characters that is still matched against a completion.
+        ttl (float): Seconds a completion can be reused after it was generated.
+    """
+    def __init__(self, max_entries: int = 256, max_typed: int = 128, ttl: float = 300):
+        self.max_entries = max_entries
+        self.max_typed = max_typed
+        self.ttl = ttl
+
+        self._entries = OrderedDict()  # key -> (completion, expires_at)
+        self._by_length = {}  # (params, prompt length) -> set of prompts
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def lookup(self, key: tuple):
+        """
+        Returns the remaining part of a cached completion that the prompt in key has started to type, or None.
+        """
+        prompt, params = key[0], key[1:]
+        now = time.monotonic()
+
+        with self._lock:
+            # Shortest typed extension first, that is the most specific cached prompt
+            for typed in range(1, min(self.max_typed, len(prompt)) + 1):
+                bucket = self._by_length.get((params, len(prompt) - typed))
+                if not bucket:
+                    continue
+
+                for cached_prompt in bucket:
+                    if not prompt.startswith(cached_prompt):
+                        continue
+
+                    cached_key = (cached_prompt,) + params
+                    completion, expires_at = self._entries[cached_key]
+                    typed_text = prompt[len(cached_prompt):]
+                    remaining = completion[len(typed_text):]
+                    if expires_at > now and completion.startswith(typed_text) and remaining.strip():
+                        self._entries.move_to_end(cached_key)
+                        self._hits += 1
+                        return remaining
+
+            self._misses += 1
+            return None
+
+    def put(self, key: tuple, completion, ttl: float = None):
+        """
+        Indexes the completion generated for the prompt in key, for ttl seconds if given.
+        """
+        if not isinstance(completion, str) or self.max_entries <= 0:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (completion, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._by_length.setdefault((key[1:], len(key[0])), set()).add(key[0])
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_length.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+            }
+
+    def _remove(self, key: tuple):
+        self._entries.pop(key)
+        bucket_key = (key[1:], len(key[0]))
+        bucket = self._by_length[bucket_key]
+        bucket.discard(key[0])
+        if not bucket:
+            del self._by_length[bucket_key]
+
+
+class SimilarityIndex:
+    """
+    Recent prompt/completion pairs indexed by MinHash signatures, so a near-duplicate prompt can reuse a completion.
+
+    Prompts that only differ in whitespace, comments or identifier names are common when many
+    users write the same exercise. The caller turns a prompt into a set of hashed token shingles
+    and a tail, the part right before the cursor that has to match exactly. Each set is summarized
+    by a signature of num_perm minimum hashes, the share of equal positions in two signatures
+    estimates the Jaccard similarity of the sets. Signatures are split into bands and a prompt is
+    only compared to the entries that share at least one band with it (locality sensitive hashing),
+    so a lookup does not scan the whole index.
+
+    Args:
+        max_entries (int): Maximum number of prompts kept in the index.
+        threshold (float): Lowest estimated Jaccard similarity at which a completion is reused.
+        ttl (float): Seconds a completion can be reused after it was generated.
+        num_perm (int): Number of hash functions of a signature.
+        bands (int): Number of bands the signature is split into, must divide num_perm.
+    """
+    def __init__(self, max_entries: int = 512, threshold: float = 0.9, ttl: float = 300, num_perm: int = 64, bands: int = 8):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.bands = bands
+        self.rows = num_perm // bands
+
+        rng = random.Random(0)
+        self._masks = [rng.getrandbits(64) for _ in range(num_perm)]
+        self._entries = OrderedDict()  # key -> (params, signature, tail, payload, expires_at)
+        self._buckets = {}  # (params, band, rows of the signature) -> set of keys
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._rejected = 0
+        self._audited = 0
+        self._false_reuse = 0
+
+    def signature(self, shingles: set) -> tuple:
+        """
+        Returns the MinHash signature of a set of 64 bit shingle hashes.
+        """
+        if not shingles:
+            return ()
+        # XOR with a random mask permutes well mixed hashes, which is enough for MinHash
+        return tuple(min(map(mask.__xor__, shingles)) for mask in self._masks)
+
+    def lookup(self, params: tuple, signature: tuple, tail):
+        """
+        Returns the payload and similarity of the most similar unexpired entry with the same params
+        and tail, or None if no entry reaches the threshold.
+        """
+        if not signature:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            candidates = set()
+            for band_key in self._band_keys(params, signature):
+                candidates.update(self._buckets.get(band_key, ()))
+
+            best, best_similarity = None, self.threshold
+            for key in candidates:
+                _, cached, cached_tail, _, expires_at = self._entries[key]
+                if expires_at <= now or cached_tail != tail:
+                    continue
+                similarity = sum(a == b for a, b in zip(signature, cached)) / len(signature)
+                if similarity >= best_similarity:
+                    best, best_similarity = key, similarity
+
+            if best is None:
+                self._misses += 1
+                return None
+
+            self._entries.move_to_end(best)
+            self._hits += 1
+            return self._entries[best][3], best_similarity
+
+    def put(self, key: tuple, params: tuple, signature: tuple, tail, payload):
+        """
+        Indexes the payload, the completion and whatever the caller needs to adapt it, of a prompt.
+        """
+        if not signature or self.max_entries <= 0:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (params, signature, tail, payload, time.monotonic() + self.ttl)
+            for band_key in self._band_keys(params, signature):
+                self._buckets.setdefault(band_key, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def record_rejected(self):
+        """
+        Counts a hit whose completion the caller did not use, it is not counted as a hit any more.
+        """
+        with self._lock:
+            self._hits -= 1
+            self._misses += 1
+            self._rejected += 1
+
+    def record_audit(self, false_reuse: bool):
+        """
+        Counts a reused completion that was compared to a fresh generation for the same prompt.
+        """
+        with self._lock:
+            self._audited += 1
+            self._false_reuse += bool(false_reuse)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "rejected": self._rejected,
+                "audited": self._audited,
+                "false_reuse": self._false_reuse,
+                "false_reuse_rate": self._false_reuse / self._audited if self._audited else 0.0,
+            }
+
+    def _band_keys(self, params: tuple, signature: tuple):
+        return [(params, band, signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+    def _remove(self, key: tuple):
+        params, signature, _, _, _ = self._entries.pop(key)
+        for band_key in self._band_keys(params, signature):
+            bucket = self._buckets[band_key]
+            bucket.discard(key)
+            if not bucket:
+                del self._buckets[band_key]
+
+
+_cache_lock = threading.Lock()
+
+def get_suggestion_cache():
+    if "suggestion_cache" not in current_app.extensions:
+        with _cache_lock:
+            if "suggestion_cache" not in current_app.extensions:
+                config = current_app.config
+                current_app.extensions["suggestion_cache"] = CompletionCache(
+                    max_entries=config["SUGGESTION_CACHE_SIZE"],
+                    max_bytes=config["SUGGESTION_CACHE_MAX_BYTES"],
+                    ttl=config["SUGGESTION_CACHE_TTL"],
+                )
+    return current_app.extensions["suggestion_cache"]
+
+def get_prefix_index():
+    if "prefix_index" not in current_app.extensions:
+        with _cache_lock:
+            if "prefix_index" not in current_app.extensions:
+                config = current_app.config
+                current_app.extensions["prefix_index"] = PrefixIndex(
+                    max_entries=config["SUGGESTION_PREFIX_INDEX_SIZE"],
+                    max_typed=config["SUGGESTION_PREFIX_MAX_TYPED"],
+                    ttl=config["SUGGESTION_CACHE_TTL"],
+                )
+    return current_app.extensions["prefix_index"]
+
+def get_similarity_index():
+    if "similarity_index" not in current_app.extensions:
+        with _cache_lock:
+            if "similarity_index" not in current_app.extensions:
+                config = current_app.config
+                current_app.extensions["similarity_index"] = SimilarityIndex(
+                    max_entries=config["SUGGESTION_SIMILARITY_INDEX_SIZE"],
+                    threshold=config["SUGGESTION_SIMILARITY_THRESHOLD"],
+                    ttl=config["SUGGESTION_CACHE_TTL"],
+                )
+    return current_app.extensions["similarity_index"]
+
+suggestion_cache = LocalProxy(get_suggestion_cache)
+prefix_index = LocalProxy(get_prefix_index)
+similarity_index = LocalProxy(get_similarity_index)
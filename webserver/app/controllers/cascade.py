@@ -0,0 +1,53 @@
+from flask import current_app
+from werkzeug.local import LocalProxy
+import threading
+
+
+
+class CascadeTracker:
+    """
+    Counts which tier of the model cascade answered each request and why drafts were escalated.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._answered = {}  # tier -> requests it answered
+        self._escalations = {}  # tier -> reason -> drafts passed on to the next tier
+        self._seconds = {}  # tier -> seconds spent on the tier, including escalated attempts
+
+    def record_attempt(self, tier: str, seconds: float, escalated: str = None):
+        """
+        Counts one attempt of a tier, with the reason it was escalated or None if its answer was used.
+        """
+        with self._lock:
+            self._seconds[tier] = self._seconds.get(tier, 0.0) + seconds
+            if escalated is None:
+                self._requests += 1
+                self._answered[tier] = self._answered.get(tier, 0) + 1
+            else:
+                reasons = self._escalations.setdefault(tier, {})
+                reasons[escalated] = reasons.get(escalated, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "answered": dict(self._answered),
+                "answered_share": {
+                    tier: round(count / self._requests, 3) for tier, count in self._answered.items()
+                } if self._requests else {},
+                "escalations": {tier: dict(reasons) for tier, reasons in self._escalations.items()},
+                "seconds": {tier: round(seconds, 3) for tier, seconds in self._seconds.items()},
+            }
+
+
+_cascade_lock = threading.Lock()
+
+def get_cascade_tracker():
+    if "cascade" not in current_app.extensions:
+        with _cascade_lock:
+            if "cascade" not in current_app.extensions:
+                current_app.extensions["cascade"] = CascadeTracker()
+    return current_app.extensions["cascade"]
+
+cascade_tracker = LocalProxy(get_cascade_tracker)
@@ -0,0 +1,142 @@
+from collections import OrderedDict
+from flask import current_app
+from werkzeug.local import LocalProxy
+import threading
+import time
+
+
+
+# Rough memory of one token id in a Python list: the pointer and the int object
+BYTES_PER_TOKEN = 36
+
+
+class OllamaContextCache:
+    """
+    Keeps the Ollama context of the last prompt of each document, so the next prompt only sends what was typed since.
+
+    Ollama returns the token ids it evaluated as "context". Sent back with a raw prompt, the model
+    continues from those tokens instead of reading the whole prompt again. An entry stores the
+    context of one (client, document, model) session together with the exact text it encodes,
+    the prompt followed by the completion. A new prompt that starts with that text, for example
+    after the user accepted the completion and kept typing, only needs the rest of it, the delta.
+
+    Entries are dropped ttl seconds after they were last used, and the least recently used ones
+    once the estimated memory of all contexts passes max_bytes. Contexts longer than max_tokens
+    are not kept, Ollama would have to cut them to fit the model's context window anyway.
+
+    Args:
+        max_entries (int): Maximum number of sessions kept.
+        max_bytes (int): Maximum estimated memory of the stored contexts and prompts.
+        ttl (float): Seconds an unused session is kept.
+        max_tokens (int): Longest context kept.
+    """
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024, ttl: float = 600, max_tokens: int = 4096):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_tokens = max_tokens
+
+        self._entries = OrderedDict()  # session -> (text, context, used_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._tokens_reused = 0
+        self._chars_skipped = 0
+        self._evictions = 0
+        self._expired = 0
+
+    def lookup(self, session: tuple, prompt: str):
+        """
+        Returns the stored context of the session and the part of prompt it does not cover, or None
+        if the session is unknown, expired or the prompt does not start with the stored one.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(session)
+            if entry is not None and entry[2] + self.ttl <= now:
+                self._remove(session)
+                self._expired += 1
+                entry = None
+
+            # An empty prompt would make Ollama load the model instead of generating
+            if entry is None or len(prompt) <= len(entry[0]) or not prompt.startswith(entry[0]):
+                self._misses += 1
+                return None
+
+            covered, context, _, size = entry
+            self._entries[session] = (covered, context, now, size)
+            self._entries.move_to_end(session)
+            self._hits += 1
+            self._tokens_reused += len(context)
+            self._chars_skipped += len(covered)
+            return context, prompt[len(covered):]
+
+    def store(self, session: tuple, text: str, context: list):
+        """
+        Stores the context that encodes exactly text, replacing the session's previous one.
+        """
+        size = len(context) * BYTES_PER_TOKEN + len(text.encode("utf-8"))
+        if len(context) > self.max_tokens or size > self.max_bytes or self.max_entries <= 0:
+            self.discard(session)
+            return
+
+        with self._lock:
+            if session in self._entries:
+                self._remove(session)
+
+            self._entries[session] = (text, context, time.monotonic(), size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def discard(self, session: tuple):
+        with self._lock:
+            if session in self._entries:
+                self._remove(session)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "sessions": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "tokens_reused": self._tokens_reused,
+                "chars_skipped": self._chars_skipped,
+                "evictions": self._evictions,
+                "expired": self._expired,
+            }
+
+    def _remove(self, session: tuple):
+        _, _, _, size = self._entries.pop(session)
+        self._bytes -= size
+
+
+_contexts_lock = threading.Lock()
+
+def get_ollama_contexts() -> OllamaContextCache:
+    if "ollama_contexts" not in current_app.extensions:
+        with _contexts_lock:
+            if "ollama_contexts" not in current_app.extensions:
+                config = current_app.config
+                current_app.extensions["ollama_contexts"] = OllamaContextCache(
+                    max_entries=config["OLLAMA_CONTEXT_SESSIONS"],
+                    max_bytes=config["OLLAMA_CONTEXT_MAX_BYTES"],
+                    ttl=config["OLLAMA_CONTEXT_TTL"],
+                    max_tokens=config["OLLAMA_CONTEXT_MAX_TOKENS"],
+                )
+    return current_app.extensions["ollama_contexts"]
+
+ollama_contexts = LocalProxy(get_ollama_contexts)
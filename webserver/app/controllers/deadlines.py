@@ -0,0 +1,136 @@
+from app.models.cancellation import CancelToken
+from flask import current_app
+from werkzeug.local import LocalProxy
+import select
+import socket
+import threading
+import time
+
+
+
+class RequestMonitor:
+    """
+    Cancels the generations of clients that have disconnected and accounts for wasted generation time.
+
+    The sockets of watched requests are polled from a single daemon thread. A socket that becomes
+    readable but has no data left was closed by the client, so the request's token is cancelled,
+    which closes the upstream connection and stops the model.
+
+    The WSGI server must expose the client socket in the environ, as the Werkzeug development
+    server (werkzeug.socket) and Gunicorn's sync workers (gunicorn.socket) do. Other servers only
+    get deadlines.
+
+    Args:
+        poll_interval (float): Seconds between two checks of the watched sockets.
+    """
+    def __init__(self, poll_interval: float = 0.25):
+        self.poll_interval = poll_interval
+
+        self._watched = {}  # token -> client socket
+        self._lock = threading.Lock()
+        self._thread = None
+        self._disconnects = 0
+        self._cancelled = {}  # reason -> generations cancelled
+        self._wasted = {}  # reason -> seconds generated before the cancellation
+
+    def watch(self, environ: dict, token: CancelToken) -> bool:
+        """
+        Cancels token if the client of the request disconnects. Returns False if the socket is not available.
+        """
+        sock = environ.get("werkzeug.socket") or environ.get("gunicorn.socket")
+        if not isinstance(sock, socket.socket):
+            return False
+
+        with self._lock:
+            self._watched[token] = sock
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="disconnect-monitor", daemon=True)
+                self._thread.start()
+        return True
+
+    def unwatch(self, token: CancelToken):
+        with self._lock:
+            self._watched.pop(token, None)
+
+    def record_cancelled(self, reason: str, seconds: float):
+        """
+        Counts a generation that was stopped after running for seconds.
+        """
+        with self._lock:
+            self._cancelled[reason] = self._cancelled.get(reason, 0) + 1
+            self._wasted[reason] = self._wasted.get(reason, 0.0) + seconds
+
+    def stats(self):
+        with self._lock:
+            return {
+                "watched": len(self._watched),
+                "disconnects": self._disconnects,
+                "cancelled": dict(self._cancelled),
+                "wasted_seconds": {reason: round(seconds, 3) for reason, seconds in self._wasted.items()},
+            }
+
+    def _run(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                watched = [(token, sock) for token, sock in self._watched.items() if not token.cancelled]
+
+            for token, sock in watched:
+                if self._closed(sock):
+                    with self._lock:
+                        self._watched.pop(token, None)
+                        self._disconnects += 1
+                    token.cancel("Client disconnected")
+
+    @staticmethod
+    def _closed(sock: socket.socket) -> bool:
+        try:
+            if sock.fileno() < 0:
+                return True
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return False
+            # The request body has been read, so a readable socket without data has been closed
+            return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b""
+        except BlockingIOError:
+            return False
+        except (OSError, ValueError):
+            return True
+
+
+_monitor_lock = threading.Lock()
+
+def get_request_monitor() -> RequestMonitor:
+    if "request_monitor" not in current_app.extensions:
+        with _monitor_lock:
+            if "request_monitor" not in current_app.extensions:
+                current_app.extensions["request_monitor"] = RequestMonitor(
+                    poll_interval=current_app.config["DISCONNECT_POLL_INTERVAL"],
+                )
+    return current_app.extensions["request_monitor"]
+
+def request_deadline(header: str = None):
+    """
+    Returns the seconds a request may take, from the value of its X-Deadline-Ms header or
+    REQUEST_DEADLINE, capped at REQUEST_MAX_DEADLINE. None means no deadline.
+    """
+    config = current_app.config
+    timeout = config["REQUEST_DEADLINE"]
+    if header:
+        try:
+            timeout = max(0.0, float(header) / 1000)
+        except ValueError:
+            pass
+    if timeout is not None and config["REQUEST_MAX_DEADLINE"]:
+        timeout = min(timeout, config["REQUEST_MAX_DEADLINE"])
+    return timeout
+
+def request_token(environ: dict, headers) -> CancelToken:
+    """
+    Creates the cancel token of a request with its deadline, and starts watching the client for a disconnect.
+    """
+    token = CancelToken(timeout=request_deadline(headers.get("X-Deadline-Ms")))
+    get_request_monitor().watch(environ, token)
+    return token
+
+request_monitor = LocalProxy(get_request_monitor)
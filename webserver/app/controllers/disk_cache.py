@@ -0,0 +1,242 @@
+from flask import current_app
+from werkzeug.local import LocalProxy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS completions (
+    key BLOB PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS completions_used_at ON completions (used_at);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (name, value) VALUES ('bytes', 0);
+"""
+
+
+class DiskCompletionCache:
+    """
+    Completion cache in a local SQLite file, shared by the worker processes of a host and kept across restarts.
+
+    The database runs in WAL mode, so any number of processes read while one writes. Every thread
+    opens its own connection, and a forked worker does not reuse the connections of its parent.
+    Rows are keyed by a hash of the same key the in-memory cache uses, and the total size of the
+    stored completions is kept in the meta table in the same transaction as each write. Once it
+    passes max_bytes the least recently used rows are deleted until it is below 90% of it.
+
+    Deleted rows leave free pages in the file, compact() drops expired rows and gives the space
+    back to the filesystem. It is run by "flask --app app cache compact".
+
+    Args:
+        path (str): The database file, created if missing.
+        max_bytes (int): Maximum total size of the stored prompts and completions.
+        ttl (float): Seconds a completion stays valid after it was stored.
+        timeout (float): Seconds to wait for the write lock of another process.
+    """
+    # A hit only updates used_at if it is older than this, so reads rarely write
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024, ttl: float = 7 * 24 * 3600, timeout: float = 5):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.timeout = timeout
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        self._evictions = 0
+        self._errors = 0
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    def get(self, key: tuple):
+        """
+        Returns the stored completion for key, or None if it is missing or expired.
+        """
+        digest = self._digest(key)
+        now = time.time()
+        try:
+            row = self._connection().execute(
+                "SELECT value, created_at, used_at FROM completions WHERE key = ?", (digest,)
+            ).fetchone()
+            if row is not None and row[1] + self.ttl > now and row[2] + self.TOUCH_INTERVAL < now:
+                with self._connection() as connection:
+                    connection.execute("UPDATE completions SET used_at = ? WHERE key = ?", (now, digest))
+        except sqlite3.Error as e:
+            self._record_error(e)
+            return None
+
+        with self._lock:
+            if row is None or row[1] + self.ttl <= now:
+                self._misses += 1
+                return None
+            self._hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: tuple, value):
+        """
+        Stores a completion, evicting the least recently used ones if the file gets too large.
+        """
+        encoded = json.dumps(value)
+        size = len(key[0].encode("utf-8")) + len(encoded.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        digest = self._digest(key)
+        now = time.time()
+        try:
+            connection = self._connection()
+            with connection:
+                # Taking the write lock first keeps the size total consistent between processes
+                connection.execute("BEGIN IMMEDIATE")
+                row = connection.execute("SELECT size FROM completions WHERE key = ?", (digest,)).fetchone()
+                connection.execute(
+                    "INSERT OR REPLACE INTO completions (key, value, size, created_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                    (digest, encoded, size, now, now)
+                )
+                total = self._add_bytes(connection, size - (row[0] if row else 0))
+                evicted = self._evict(connection, total) if total > self.max_bytes else 0
+        except sqlite3.Error as e:
+            self._record_error(e)
+            return
+
+        with self._lock:
+            self._writes += 1
+            self._evictions += evicted
+
+    def compact(self):
+        """
+        Deletes the expired completions, evicts down to max_bytes, and shrinks the file.
+
+        Returns:
+            dict: The number of deleted rows and the file size before and after.
+        """
+        before = self._file_size()
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            expired = connection.execute("DELETE FROM completions WHERE created_at <= ?", (time.time() - self.ttl,)).rowcount
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM completions").fetchone()[0]
+            connection.execute("UPDATE meta SET value = ? WHERE name = 'bytes'", (total,))
+            evicted = self._evict(connection, total) if total > self.max_bytes else 0
+
+        connection.execute("VACUUM")
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        with self._lock:
+            self._evictions += evicted
+        return {"expired": expired, "evicted": evicted, "file_bytes_before": before, "file_bytes_after": self._file_size()}
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM completions")
+            connection.execute("UPDATE meta SET value = 0 WHERE name = 'bytes'")
+
+    def stats(self):
+        try:
+            connection = self._connection()
+            entries = connection.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+            stored = connection.execute("SELECT value FROM meta WHERE name = 'bytes'").fetchone()[0]
+        except sqlite3.Error as e:
+            self._record_error(e)
+            entries, stored = None, None
+
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "path": self.path,
+                "entries": entries,
+                "bytes": stored,
+                "max_bytes": self.max_bytes,
+                "file_bytes": self._file_size(),
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": self._hits / lookups if lookups else 0.0,
+                "writes": self._writes,
+                "evictions": self._evictions,
+                "errors": self._errors,
+            }
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not cross threads or forks
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _add_bytes(self, connection: sqlite3.Connection, delta: int) -> int:
+        connection.execute("UPDATE meta SET value = value + ? WHERE name = 'bytes'", (delta,))
+        return connection.execute("SELECT value FROM meta WHERE name = 'bytes'").fetchone()[0]
+
+    def _evict(self, connection: sqlite3.Connection, total: int) -> int:
+        # Least recently used first, down to 90% so the next writes do not evict again right away
+        evicted = 0
+        target = int(self.max_bytes * 0.9)
+        while total > target:
+            rows = connection.execute("SELECT key, size FROM completions ORDER BY used_at LIMIT 64").fetchall()
+            if not rows:
+                break
+            for digest, size in rows:
+                connection.execute("DELETE FROM completions WHERE key = ?", (digest,))
+                total = self._add_bytes(connection, -size)
+                evicted += 1
+                if total <= target:
+                    break
+        return evicted
+
+    def _digest(self, key: tuple) -> bytes:
+        return hashlib.blake2b(json.dumps(key).encode("utf-8"), digest_size=16).digest()
+
+    def _file_size(self) -> int:
+        return sum(os.path.getsize(self.path + suffix) for suffix in ("", "-wal") if os.path.exists(self.path + suffix))
+
+    def _record_error(self, error: Exception):
+        print(f"Error using the disk cache: {error}")
+        with self._lock:
+            self._errors += 1
+
+
+_disk_cache_lock = threading.Lock()
+
+def get_disk_cache() -> DiskCompletionCache:
+    """
+    Returns the disk cache of the app, or None if SUGGESTION_DISK_CACHE_PATH is not set.
+    """
+    path = current_app.config["SUGGESTION_DISK_CACHE_PATH"]
+    if not path:
+        return None
+
+    if "disk_cache" not in current_app.extensions:
+        with _disk_cache_lock:
+            if "disk_cache" not in current_app.extensions:
+                config = current_app.config
+                current_app.extensions["disk_cache"] = DiskCompletionCache(
+                    path=path if os.path.isabs(path) else os.path.join(current_app.instance_path, path),
+                    max_bytes=config["SUGGESTION_DISK_CACHE_MAX_BYTES"],
+                    ttl=config["SUGGESTION_DISK_CACHE_TTL"],
+                )
+    return current_app.extensions["disk_cache"]
+
+disk_cache = LocalProxy(get_disk_cache)
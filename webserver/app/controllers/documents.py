@@ -0,0 +1,189 @@
+from app.models.errors import BaseError, DocumentNotFoundError, DocumentVersionError
+from app.models.piece_table import PieceTable
+from collections import OrderedDict
+from contextlib import contextmanager
+from flask import current_app
+from werkzeug.local import LocalProxy
+import threading
+import time
+
+
+
+class _Document:
+    def __init__(self, text: str, language: str = None):
+        self.table = PieceTable(text)
+        self.language = language
+        self.version = 0
+        self.used_at = time.monotonic()
+        self.size = self.table.buffered
+        self.lock = threading.Lock()
+
+
+class DocumentStore:
+    """
+    Keeps the text of the documents clients are editing, so they send edits instead of whole prompts.
+
+    A client opens a (client, document) session with the full text once, then sends the edits it
+    makes. Each batch of edits moves the document to the next version. Edits are made on a version,
+    and a batch for any other version is refused, so a client that missed an answer opens the
+    document again instead of silently diverging from the server's copy.
+
+    Sessions are dropped ttl seconds after they were last used, and the least recently used ones
+    once the text held by all sessions passes max_chars.
+
+    Args:
+        max_documents (int): Maximum number of sessions kept.
+        max_chars (int): Maximum number of characters held by all sessions, deleted text included until compacted.
+        ttl (float): Seconds an unused session is kept.
+    """
+    def __init__(self, max_documents: int = 256, max_chars: int = 64 * 1024 * 1024, ttl: float = 1800):
+        self.max_documents = max_documents
+        self.max_chars = max_chars
+        self.ttl = ttl
+
+        self._documents = OrderedDict()  # session -> _Document
+        self._chars = 0
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._edits = 0
+        self._conflicts = 0
+        self._missing = 0
+        self._evictions = 0
+        self._expired = 0
+        self._chars_received = 0
+
+    def open(self, session: tuple, text: str, language: str = None) -> int:
+        """
+        Starts a session with the full text of the document, replacing any previous one. Returns its version, 0.
+        """
+        document = _Document(text, language)
+        with self._lock:
+            if session in self._documents:
+                self._remove(session)
+            self._documents[session] = document
+            self._chars += document.size
+            self._opened += 1
+            self._chars_received += len(text)
+            self._evict()
+        return document.version
+
+    def edit(self, session: tuple, edits: list, version: int = None) -> int:
+        """
+        Applies a batch of edits and returns the new version.
+
+        Each edit is a dict with the "start" and "end" offsets of the replaced range and the new
+        "text", applied in order, each to the result of the previous one. Offsets count UTF-16 code
+        units like editor positions do, and are converted to characters here. The batch is applied
+        to a copy of the text, so an invalid one leaves the document as it was.
+
+        Raises:
+            DocumentNotFoundError: If the session is not open.
+            DocumentVersionError: If version is not the current version of the document.
+            BaseError: If an edit is malformed or out of range.
+        """
+        with self.document(session) as document:
+            if version is not None and version != document.version:
+                with self._lock:
+                    self._conflicts += 1
+                raise DocumentVersionError(session[-1], document.version)
+
+            table = document.table.copy()
+            received = 0
+            for edit in edits:
+                if not isinstance(edit, dict):
+                    raise BaseError("Each edit needs integer start and end offsets and a text")
+                start, end, text = edit.get("start"), edit.get("end", edit.get("start")), edit.get("text", "")
+                if not isinstance(start, int) or not isinstance(end, int) or not isinstance(text, str):
+                    raise BaseError("Each edit needs integer start and end offsets and a text")
+                length = table.units()
+                if not 0 <= start <= end <= length:
+                    raise BaseError(f"Edit range {start}-{end} is outside of the document (length {length})")
+                try:
+                    table.replace(table.index(start), table.index(end), text)
+                except ValueError as e:
+                    raise BaseError(f"Edit range {start}-{end} is invalid: {e}")
+                received += len(text)
+
+            document.table = table
+            document.version += 1
+
+            size, document.size = document.size, document.table.buffered
+            with self._lock:
+                self._edits += len(edits)
+                self._chars_received += received
+                if self._documents.get(session) is document:
+                    self._chars += document.size - size
+                    self._evict()
+            return document.version
+
+    @contextmanager
+    def document(self, session: tuple):
+        """
+        Holds the lock of an open document for the duration of the with block and yields it.
+
+        Raises:
+            DocumentNotFoundError: If the session is not open or has expired.
+        """
+        now = time.monotonic()
+        with self._lock:
+            document = self._documents.get(session)
+            if document is not None and document.used_at + self.ttl <= now:
+                self._remove(session)
+                self._expired += 1
+                document = None
+            if document is None:
+                self._missing += 1
+                raise DocumentNotFoundError(session[-1])
+
+            document.used_at = now
+            self._documents.move_to_end(session)
+
+        with document.lock:
+            yield document
+
+    def close(self, session: tuple):
+        with self._lock:
+            if session in self._documents:
+                self._remove(session)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": len(self._documents),
+                "chars": self._chars,
+                "max_chars": self.max_chars,
+                "ttl": self.ttl,
+                "opened": self._opened,
+                "edits": self._edits,
+                "chars_received": self._chars_received,
+                "conflicts": self._conflicts,
+                "missing": self._missing,
+                "evictions": self._evictions,
+                "expired": self._expired,
+            }
+
+    def _evict(self):
+        while self._documents and (len(self._documents) > self.max_documents or self._chars > self.max_chars):
+            self._remove(next(iter(self._documents)))
+            self._evictions += 1
+
+    def _remove(self, session: tuple):
+        document = self._documents.pop(session)
+        self._chars -= document.size
+
+
+_documents_lock = threading.Lock()
+
+def get_document_store() -> DocumentStore:
+    if "documents" not in current_app.extensions:
+        with _documents_lock:
+            if "documents" not in current_app.extensions:
+                config = current_app.config
+                current_app.extensions["documents"] = DocumentStore(
+                    max_documents=config["DOCUMENT_SESSIONS"],
+                    max_chars=config["DOCUMENT_MAX_CHARS"],
+                    ttl=config["DOCUMENT_TTL"],
+                )
+    return current_app.extensions["documents"]
+
+document_store = LocalProxy(get_document_store)
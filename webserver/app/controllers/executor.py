@@ -0,0 +1,32 @@
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.local import LocalProxy
+import threading
+
+
+
+_executor_lock = threading.Lock()
+
+def get_executor() -> ThreadPoolExecutor:
+    if "suggestion_executor" not in current_app.extensions:
+        with _executor_lock:
+            if "suggestion_executor" not in current_app.extensions:
+                current_app.extensions["suggestion_executor"] = ThreadPoolExecutor(
+                    max_workers=current_app.config["SUGGESTION_WORKERS"],
+                    thread_name_prefix="suggestion"
+                )
+    return current_app.extensions["suggestion_executor"]
+
+executor: ThreadPoolExecutor = LocalProxy(get_executor)
+
+def submit(fn, *args, **kwargs):
+    """
+    Runs fn on the shared thread pool inside the current app context and returns its Future.
+    """
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            return fn(*args, **kwargs)
+
+    return executor.submit(run)
@@ -0,0 +1,95 @@
+from collections import deque
+from flask import current_app
+from werkzeug.local import LocalProxy
+import threading
+
+
+
+class HedgeTracker:
+    """
+    Keeps recent vendor latencies to pick the hedging delay and counts which backend wins.
+
+    Args:
+        delay (float): Fixed seconds to wait before hedging. If None the delay is the latency percentile of the primary model.
+        percentile (float): Latency percentile used as the delay, for example 0.9 for the p90.
+        default_delay (float): Delay used until enough latencies have been recorded.
+        window (int): Number of recent latencies kept per vendor and model.
+        min_samples (int): Latencies needed before the percentile is trusted.
+    """
+    def __init__(
+        self,
+        delay: float = None,
+        percentile: float = 0.9,
+        default_delay: float = 1.0,
+        window: int = 200,
+        min_samples: int = 20
+    ):
+        self.fixed_delay = delay
+        self.percentile = percentile
+        self.default_delay = default_delay
+        self.window = window
+        self.min_samples = min_samples
+
+        self._latencies = {}  # (vendor, model) -> recent latencies in seconds
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._hedged = 0
+        self._wins = {}
+
+    def record_latency(self, vendor, model_name: str, seconds: float):
+        key = (getattr(vendor, "value", vendor), model_name)
+        with self._lock:
+            self._latencies.setdefault(key, deque(maxlen=self.window)).append(seconds)
+
+    def delay(self, vendor, model_name: str) -> float:
+        """
+        Returns how long to wait for the primary call before sending the hedge.
+        """
+        if self.fixed_delay is not None:
+            return self.fixed_delay
+
+        key = (getattr(vendor, "value", vendor), model_name)
+        with self._lock:
+            samples = sorted(self._latencies.get(key, ()))
+
+        if len(samples) < self.min_samples:
+            return self.default_delay
+        return samples[min(len(samples) - 1, int(len(samples) * self.percentile))]
+
+    def record_result(self, winner, hedged: bool):
+        """
+        Counts a finished request, which backend answered it and whether a hedge was sent.
+        """
+        winner = getattr(winner, "value", winner)
+        with self._lock:
+            self._requests += 1
+            self._hedged += int(hedged)
+            self._wins[winner] = self._wins.get(winner, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            keys = list(self._latencies)
+            stats = {
+                "requests": self._requests,
+                "hedged": self._hedged,
+                "wins": dict(self._wins),
+            }
+        stats["delays"] = {f"{vendor}/{model}": self.delay(vendor, model) for vendor, model in keys}
+        return stats
+
+
+_hedging_lock = threading.Lock()
+
+def get_hedge_tracker():
+    if "hedging" not in current_app.extensions:
+        with _hedging_lock:
+            if "hedging" not in current_app.extensions:
+                config = current_app.config
+                current_app.extensions["hedging"] = HedgeTracker(
+                    delay=config["HEDGE_DELAY"],
+                    percentile=config["HEDGE_PERCENTILE"],
+                    default_delay=config["HEDGE_DEFAULT_DELAY"],
+                )
+    return current_app.extensions["hedging"]
+
+hedge_tracker = LocalProxy(get_hedge_tracker)
@@ -0,0 +1,138 @@
+from app.controllers.cache import CompletionCache
+from app.controllers.executor import submit
+from app.models.cancellation import CancelToken
+from app.models.errors import GenerationCancelledError, QueueFullError
+from flask import current_app
+from werkzeug.local import LocalProxy
+import threading
+
+
+
+class Prefetcher:
+    """
+    Runs speculative generations in the background and keeps their results for a short time.
+
+    Each client has at most one set of speculative generations, a newer prefetch from the same
+    client cancels the older ones because the user has moved on. Generations that cannot start
+    right away are skipped rather than queued.
+
+    Args:
+        ttl (float): Seconds a prefetched completion stays usable.
+        max_entries (int): Maximum number of prefetched completions kept.
+        max_in_flight (int): Maximum number of speculative generations running at once.
+    """
+    def __init__(self, ttl: float = 30, max_entries: int = 256, max_in_flight: int = 4):
+        self.cache = CompletionCache(max_entries=max_entries, ttl=ttl)
+        self.max_in_flight = max_in_flight
+
+        self._in_flight = {}  # key -> cancel token
+        self._by_client = {}  # client -> keys of its speculative generations
+        self._lock = threading.Lock()
+        self._started = 0
+        self._completed = 0
+        self._superseded = 0
+        self._skipped = 0
+        self._cancelled = 0
+        self._failed = 0
+
+    def get(self, key: tuple):
+        """
+        Returns the prefetched completion for key, or None.
+        """
+        return self.cache.get(key)
+
+    def prefetch(self, client_id: str, jobs: dict) -> int:
+        """
+        Starts the speculative generations of a client.
+
+        Args:
+            client_id (str): Who sent the prefetch.
+            jobs (dict): Cache key to a function that takes a CancelToken and returns the completion.
+
+        Returns:
+            int: The number of generations started.
+        """
+        with self._lock:
+            wanted = {key for key in jobs if not self.cache.contains(key)}
+            stale = [key for key in self._by_client.get(client_id, ()) if key not in wanted]
+            superseded = [self._in_flight.pop(key) for key in stale if key in self._in_flight]
+            self._superseded += len(superseded)
+
+            started = {}
+            for key in wanted:
+                if key in self._in_flight:
+                    continue
+                if len(self._in_flight) >= self.max_in_flight:
+                    self._skipped += 1
+                    continue
+                started[key] = self._in_flight[key] = CancelToken()
+            self._by_client[client_id] = wanted & set(self._in_flight)
+            self._started += len(started)
+
+        for token in superseded:
+            token.cancel("Superseded by a newer prefetch")
+        for key, token in started.items():
+            submit(self._run, client_id, key, jobs[key], token)
+        return len(started)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._in_flight),
+                "started": self._started,
+                "completed": self._completed,
+                "superseded": self._superseded,
+                "skipped": self._skipped,
+                "cancelled": self._cancelled,
+                "failed": self._failed,
+                "cache": self.cache.stats(),
+            }
+
+    def _run(self, client_id: str, key: tuple, job, token: CancelToken):
+        try:
+            value = job(token)
+        except GenerationCancelledError:
+            with self._lock:
+                self._cancelled += 1
+            return
+        except QueueFullError:
+            # The model is busy with real requests
+            with self._lock:
+                self._skipped += 1
+            return
+        except Exception as e:
+            print(f"Prefetch failed: {e}")
+            with self._lock:
+                self._failed += 1
+            return
+        finally:
+            with self._lock:
+                if self._in_flight.get(key) is token:
+                    del self._in_flight[key]
+                keys = self._by_client.get(client_id)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._by_client[client_id]
+
+        if not token.cancelled:
+            self.cache.put(key, value)
+            with self._lock:
+                self._completed += 1
+
+
+_prefetch_lock = threading.Lock()
+
+def get_prefetcher() -> Prefetcher:
+    if "prefetcher" not in current_app.extensions:
+        with _prefetch_lock:
+            if "prefetcher" not in current_app.extensions:
+                config = current_app.config
+                current_app.extensions["prefetcher"] = Prefetcher(
+                    ttl=config["PREFETCH_TTL"],
+                    max_entries=config["PREFETCH_CACHE_SIZE"],
+                    max_in_flight=config["PREFETCH_MAX_IN_FLIGHT"],
+                )
+    return current_app.extensions["prefetcher"]
+
+prefetcher = LocalProxy(get_prefetcher)
@@ -0,0 +1,271 @@
+from app.controllers.ai import get_ollama, OllamaPool, OLLAMA_URL, OLLAMA_PS_URL, OLLAMA_TAGS_URL
+from app.models.errors import ModelColdError
+from flask import current_app
+from werkzeug.local import LocalProxy
+import threading
+import time
+
+
+
+def model_tag(model_name: str) -> str:
+    """
+    Returns the name Ollama reports a model under, "codellama" is loaded as "codellama:latest".
+    """
+    return model_name if ":" in model_name else f"{model_name}:latest"
+
+
+class ModelResidency:
+    """
+    Keeps Ollama models loaded so that completions do not wait for a model to be read into memory.
+
+    The configured models are loaded when the app starts. Every refresh_interval seconds the models
+    Ollama has loaded are read from /api/ps and the installed ones from /api/tags, and the keep-alive
+    of the configured models and of the models requested within hot_window seconds is renewed,
+    loading them again if Ollama dropped them.
+
+    A request for an installed model that is not loaded is handled according to policy:
+
+    - "queue": the model is loaded in the background and the request waits up to queue_timeout seconds for it.
+    - "refuse": the model is loaded in the background and the request fails with a ModelColdError.
+    - "allow": the request is sent anyway and Ollama loads the model while the user waits.
+
+    Requests for models Ollama does not have installed are let through untouched and never kept
+    loaded, Ollama answers them with its own error. Until Ollama has answered once the loaded models
+    are unknown and every request is let through.
+
+    Args:
+        ollama (OllamaPool): The pool used to talk to Ollama.
+        models (list): Models loaded at startup and kept loaded.
+        keep_alive (str): How long Ollama keeps a model loaded after its last request, for example "1h".
+        refresh_interval (float): Seconds between two refreshes.
+        hot_window (float): Seconds since its last request during which a model is kept loaded.
+        policy (str): How requests for models that are not loaded are handled, "queue", "refuse" or "allow".
+        queue_timeout (float): Seconds a queued request waits for its model.
+        retry_after (int): Seconds a refused client is asked to wait before retrying.
+    """
+    POLICIES = ("queue", "refuse", "allow")
+
+    def __init__(
+        self,
+        ollama: OllamaPool,
+        models: list = None,
+        keep_alive: str = "1h",
+        refresh_interval: float = 60,
+        hot_window: float = 1800,
+        policy: str = "queue",
+        queue_timeout: float = 30,
+        retry_after: int = 10
+    ):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown cold model policy {policy}, expected one of {', '.join(self.POLICIES)}")
+
+        self.ollama = ollama
+        self.models = [model_tag(model) for model in models or []]
+        self.keep_alive = keep_alive
+        self.refresh_interval = refresh_interval
+        self.hot_window = hot_window
+        self.policy = policy
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self._resident = None  # models Ollama has loaded, None until it answered once
+        self._installed = None  # models Ollama has installed, None until it answered once
+        self._last_used = {}  # model -> time of its last request
+        self._loading = {}  # model -> event set once its load finished
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._synced_at = None
+        self._loads = 0
+        self._load_failures = 0
+        self._load_seconds = {}
+        self._refused = 0
+        self._queued = 0
+        self._cold_allowed = 0
+
+    def start(self):
+        """
+        Loads the configured models and keeps refreshing them on a daemon thread.
+        """
+        def run():
+            self.refresh()
+            while not self._stop.wait(self.refresh_interval):
+                self.refresh()
+
+        self._thread = threading.Thread(target=run, name="ollama-residency", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def refresh(self):
+        """
+        Reads the loaded models and renews the keep-alive of every configured or recently used model.
+        """
+        if not self.sync():
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            hot = set(self.models) | {model for model, used in self._last_used.items() if now - used <= self.hot_window}
+            if self._installed is not None:
+                hot &= self._installed
+
+        for model in sorted(hot):
+            self.load(model)
+
+    def sync(self) -> bool:
+        """
+        Reads the models Ollama has loaded and installed. Returns False if Ollama could not be reached.
+        """
+        try:
+            loaded, installed = (self._read_models(url) for url in (OLLAMA_PS_URL, OLLAMA_TAGS_URL))
+        except Exception as e:
+            print(f"Warning: could not read the loaded Ollama models: {e}")
+            return False
+
+        with self._lock:
+            self._resident = loaded
+            self._installed = installed
+            # Names Ollama does not know, such as another vendor's model, are not kept loaded
+            for model in [model for model in self._last_used if model not in installed]:
+                del self._last_used[model]
+            self._synced_at = time.monotonic()
+        return True
+
+    def _read_models(self, url: str) -> set:
+        response = self.ollama.session.get(url, timeout=self.ollama.timeout)
+        response.raise_for_status()
+        return {model["name"] for model in response.json().get("models", [])}
+
+    def load(self, model_name: str) -> bool:
+        """
+        Loads a model, or renews its keep-alive if it is already loaded. Returns whether Ollama accepted it.
+        """
+        model = model_tag(model_name)
+        start = time.monotonic()
+        try:
+            # A generate request without a prompt only loads the model
+            response = self.ollama.post(OLLAMA_URL, json={"model": model, "keep_alive": self.keep_alive})
+            response.raise_for_status()
+        except Exception as e:
+            print(f"Warning: could not load the Ollama model {model}: {e}")
+            with self._lock:
+                self._load_failures += 1
+            return False
+
+        with self._lock:
+            if self._resident is None:
+                self._resident = set()
+            self._resident.add(model)
+            self._loads += 1
+            self._load_seconds[model] = round(time.monotonic() - start, 3)
+        return True
+
+    def is_resident(self, model_name: str) -> bool:
+        with self._lock:
+            return self._resident is not None and model_tag(model_name) in self._resident
+
+    def ensure(self, model_name: str, wait: bool = True):
+        """
+        Applies the cold model policy before a request is sent to a model.
+
+        Args:
+            model_name (str): The requested model.
+            wait (bool): Whether the caller may block, the "queue" policy refuses instead if not.
+
+        Raises:
+            ModelColdError: If the model is not loaded and the request may not wait for it.
+        """
+        model = model_tag(model_name)
+        with self._lock:
+            if self._installed is not None and model not in self._installed:
+                return
+
+            self._last_used[model] = time.monotonic()
+            if self._resident is None or model in self._resident:
+                return
+
+            if self.policy == "allow":
+                self._cold_allowed += 1
+                self._resident.add(model)
+                return
+
+            loaded = self._load_in_background(model)
+
+        if self.policy == "queue" and wait:
+            with self._lock:
+                self._queued += 1
+            if loaded.wait(self.queue_timeout) and self.is_resident(model):
+                return
+
+        with self._lock:
+            self._refused += 1
+        raise ModelColdError(model, self.retry_after)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "policy": self.policy,
+                "configured": self.models,
+                "resident": None if self._resident is None else sorted(self._resident),
+                "installed": None if self._installed is None else sorted(self._installed),
+                "hot": sorted(model for model, used in self._last_used.items() if now - used <= self.hot_window),
+                "loading": sorted(self._loading),
+                "seconds_since_sync": None if self._synced_at is None else round(now - self._synced_at, 1),
+                "loads": self._loads,
+                "load_failures": self._load_failures,
+                "load_seconds": dict(self._load_seconds),
+                "refused": self._refused,
+                "queued": self._queued,
+                "cold_allowed": self._cold_allowed,
+            }
+
+    def _load_in_background(self, model: str) -> threading.Event:
+        # Called with the lock held, a model is only loaded once however many requests wait for it
+        loaded = self._loading.get(model)
+        if loaded is not None:
+            return loaded
+
+        loaded = self._loading[model] = threading.Event()
+
+        def run():
+            try:
+                self.load(model)
+            finally:
+                with self._lock:
+                    self._loading.pop(model, None)
+                loaded.set()
+
+        threading.Thread(target=run, name=f"ollama-load-{model}", daemon=True).start()
+        return loaded
+
+
+_residency_lock = threading.Lock()
+
+def get_model_residency() -> ModelResidency:
+    if "model_residency" not in current_app.extensions:
+        with _residency_lock:
+            if "model_residency" not in current_app.extensions:
+                config = current_app.config
+                current_app.extensions["model_residency"] = ModelResidency(
+                    get_ollama(),
+                    models=config["OLLAMA_PRELOAD_MODELS"],
+                    keep_alive=config["OLLAMA_MODEL_KEEP_ALIVE"],
+                    refresh_interval=config["OLLAMA_RESIDENCY_INTERVAL"],
+                    hot_window=config["OLLAMA_HOT_WINDOW"],
+                    policy=config["OLLAMA_COLD_MODEL_POLICY"],
+                    queue_timeout=config["OLLAMA_COLD_WAIT"],
+                    retry_after=config["OLLAMA_COLD_RETRY_AFTER"],
+                )
+    return current_app.extensions["model_residency"]
+
+def start_model_residency(app):
+    """
+    Preloads the configured Ollama models of app and keeps them loaded in the background.
+    """
+    with app.app_context():
+        get_model_residency().start()
+
+model_residency = LocalProxy(get_model_residency)
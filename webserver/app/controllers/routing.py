@@ -0,0 +1,197 @@
+from flask import current_app
+from werkzeug.local import LocalProxy
+import threading
+import time
+
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class BackendHealth:
+    """
+    Moving averages and circuit breaker state of one vendor and model.
+    """
+    def __init__(self):
+        self.latency = None  # exponentially weighted moving average, in seconds
+        self.error_rate = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = None
+        self.probing = False
+
+
+class VendorRouter:
+    """
+    Routes suggestions to the healthiest vendor and stops sending traffic to a failing one.
+
+    Backends are (vendor, model) pairs in priority order. The first healthy one is used, where
+    healthy means its circuit is closed, its average error rate is below error_threshold and its
+    average latency is below slow_latency. If none is healthy, the remaining ones are ordered by
+    latency weighted with their error rate.
+
+    A backend's circuit opens after failure_threshold consecutive failures, or once its error rate
+    passes error_threshold. While open it gets no traffic. After cooldown seconds a single probe
+    request is let through (half open), and its outcome closes or reopens the circuit.
+
+    Args:
+        alpha (float): Weight of the newest sample in the moving averages.
+        failure_threshold (int): Consecutive failures that open the circuit.
+        error_threshold (float): Average error rate that opens the circuit.
+        min_requests (int): Requests needed before the error rate can open the circuit.
+        cooldown (float): Seconds a circuit stays open before it is probed.
+        slow_latency (float): Average latency in seconds above which a backend is not considered healthy.
+    """
+    def __init__(
+        self,
+        alpha: float = 0.2,
+        failure_threshold: int = 5,
+        error_threshold: float = 0.5,
+        min_requests: int = 10,
+        cooldown: float = 30,
+        slow_latency: float = 5.0
+    ):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.error_threshold = error_threshold
+        self.min_requests = min_requests
+        self.cooldown = cooldown
+        self.slow_latency = slow_latency
+
+        self._backends = {}  # (vendor, model) -> BackendHealth
+        self._lock = threading.Lock()
+
+    def rank(self, backends: list) -> list:
+        """
+        Orders (vendor, model) pairs from the one that should be tried first to the last.
+        """
+        with self._lock:
+            healths = [self._health(backend) for backend in backends]
+            # A backend due for its probe keeps its priority, or it would never get the request that closes its circuit
+            healthy = [
+                backend for backend, health in zip(backends, healths)
+                if self._probe_due(health) or (
+                    health.state == CLOSED
+                    and health.error_rate < self.error_threshold
+                    and (health.latency is None or health.latency < self.slow_latency)
+                )
+            ]
+            rest = sorted(
+                (backend for backend in backends if backend not in healthy),
+                key=lambda backend: self._score(self._health(backend))
+            )
+        return healthy + rest
+
+    def allow(self, vendor, model_name: str) -> bool:
+        """
+        Returns whether a request may be sent to the backend right now.
+        """
+        with self._lock:
+            health = self._health((vendor, model_name))
+            if health.state == CLOSED:
+                return True
+
+            if health.state == OPEN and time.monotonic() - health.opened_at >= self.cooldown:
+                health.state = HALF_OPEN
+
+            if health.state == HALF_OPEN and not health.probing:
+                health.probing = True
+                return True
+            return False
+
+    def closed(self, vendor, model_name: str) -> bool:
+        """
+        Returns whether the backend's circuit is closed, without taking a half open probe.
+        """
+        with self._lock:
+            return self._health((vendor, model_name)).state == CLOSED
+
+    def release(self, vendor, model_name: str):
+        """
+        Frees a half open probe whose request ended without telling anything about the backend, for example when it was cancelled.
+        """
+        with self._lock:
+            self._health((vendor, model_name)).probing = False
+
+    def record(self, vendor, model_name: str, seconds: float, ok: bool):
+        """
+        Feeds the outcome of a request into the backend's averages and circuit breaker.
+        """
+        with self._lock:
+            health = self._health((vendor, model_name))
+            health.requests += 1
+            health.probing = False
+            health.error_rate += self.alpha * ((0.0 if ok else 1.0) - health.error_rate)
+
+            if ok:
+                health.latency = seconds if health.latency is None else health.latency + self.alpha * (seconds - health.latency)
+                health.consecutive_failures = 0
+                if health.state != CLOSED:
+                    health.state = CLOSED
+                    health.error_rate = 0.0
+                return
+
+            health.failures += 1
+            health.consecutive_failures += 1
+            too_many_errors = health.requests >= self.min_requests and health.error_rate >= self.error_threshold
+            if health.state == HALF_OPEN or health.consecutive_failures >= self.failure_threshold or too_many_errors:
+                if health.state != OPEN:
+                    print(f"Circuit opened for {getattr(vendor, 'value', vendor)}/{model_name}")
+                health.state = OPEN
+                health.opened_at = time.monotonic()
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                f"{vendor}/{model}": {
+                    "state": health.state,
+                    "latency_ms": None if health.latency is None else round(health.latency * 1000, 1),
+                    "error_rate": round(health.error_rate, 3),
+                    "requests": health.requests,
+                    "failures": health.failures,
+                    "consecutive_failures": health.consecutive_failures,
+                    "retry_in": max(0.0, round(self.cooldown - (now - health.opened_at), 1)) if health.state == OPEN else None,
+                }
+                for (vendor, model), health in self._backends.items()
+            }
+
+    def _health(self, backend) -> BackendHealth:
+        vendor, model = backend
+        key = (getattr(vendor, "value", vendor), model)
+        if key not in self._backends:
+            self._backends[key] = BackendHealth()
+        return self._backends[key]
+
+    def _probe_due(self, health: BackendHealth) -> bool:
+        if health.state == OPEN:
+            return time.monotonic() - health.opened_at >= self.cooldown
+        return health.state == HALF_OPEN and not health.probing
+
+    def _score(self, health: BackendHealth) -> float:
+        # Open circuits go last, unknown latency counts as fast so new backends get tried
+        penalty = 1000.0 if health.state == OPEN else 0.0
+        return penalty + (health.latency or 0.0) * (1 + 4 * health.error_rate) + health.error_rate
+
+
+_routing_lock = threading.Lock()
+
+def get_vendor_router():
+    if "routing" not in current_app.extensions:
+        with _routing_lock:
+            if "routing" not in current_app.extensions:
+                config = current_app.config
+                current_app.extensions["routing"] = VendorRouter(
+                    alpha=config["ROUTING_EWMA_ALPHA"],
+                    failure_threshold=config["ROUTING_FAILURE_THRESHOLD"],
+                    error_threshold=config["ROUTING_ERROR_THRESHOLD"],
+                    cooldown=config["ROUTING_COOLDOWN"],
+                    slow_latency=config["ROUTING_SLOW_LATENCY"],
+                )
+    return current_app.extensions["routing"]
+
+vendor_router = LocalProxy(get_vendor_router)
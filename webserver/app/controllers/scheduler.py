@@ -0,0 +1,262 @@
+from app.models.cancellation import CancelToken
+from app.models.errors import QueueFullError, QueueTimeoutError
+from app.models.status_codes import StatusCodes
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from flask import current_app
+from werkzeug.local import LocalProxy
+import math
+import threading
+import time
+
+
+
+class _Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+        self.enqueued_at = time.monotonic()
+
+
+class _ModelQueue:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.running = 0
+        self.waiters = OrderedDict()  # client -> deque of waiters, in round robin order
+        self.queued = 0
+        self.speculative = []  # cancel tokens of the speculative generations holding a slot
+        self.service_time = None  # moving average of the seconds a slot is held
+
+
+class AdmissionScheduler:
+    """
+    Limits how many generations run on each model at once and queues the rest fairly.
+
+    Each (vendor, model) pair has a concurrency limit. A request that finds all slots taken waits in a
+    bounded queue. Freed slots go to the waiting clients in turn, one request per client, so a client
+    with many queued requests cannot starve the others. Requests are refused right away with a
+    Retry-After estimate when the queue is full (503) or when the client already has too many requests
+    queued (429), and after waiting queue_timeout seconds without getting a slot (503).
+
+    Speculative generations only take a free slot and never queue. When a real request has to
+    queue, one speculative generation of the model is cancelled so the request gets its slot.
+
+    Args:
+        limits (dict): Concurrency limit per "vendor/model" or per "vendor". Pairs without a limit are not queued.
+        max_queue (int): Requests that may wait for one model.
+        max_queued_per_client (int): Requests one client may have waiting for one model.
+        queue_timeout (float): Seconds a request waits for a slot.
+        retry_after (int): Seconds suggested to refused clients until a service time has been measured.
+        window (int): Number of recent waiting times kept for the metrics.
+    """
+    def __init__(
+        self,
+        limits: dict = None,
+        max_queue: int = 32,
+        max_queued_per_client: int = 4,
+        queue_timeout: float = 10,
+        retry_after: int = 2,
+        window: int = 1000
+    ):
+        self.limits = limits or {}
+        self.max_queue = max_queue
+        self.max_queued_per_client = max_queued_per_client
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self._queues = {}  # "vendor/model" -> _ModelQueue
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=window)
+        self._admitted = 0
+        self._waited = 0
+        self._rejected_full = 0
+        self._rejected_client = 0
+        self._timeouts = 0
+        self._cancelled = 0
+        self._speculative_admitted = 0
+        self._speculative_skipped = 0
+        self._preempted = 0
+
+    @contextmanager
+    def slot(self, vendor, model_name: str, client_id: str = None, cancel: CancelToken = None, speculative: bool = False):
+        """
+        Holds a concurrency slot of the model for the duration of the with block.
+
+        Args:
+            vendor (vendors): The vendor of the model.
+            model_name (str): The model the generation runs on.
+            client_id (str): Who sent the request, used to share the queue fairly.
+            cancel (CancelToken): Stops waiting for a slot when cancelled. Required for speculative generations.
+            speculative (bool): Take a slot only if one is free, and give it up when a real request needs it.
+
+        Raises:
+            QueueFullError: If the request cannot be queued, or a speculative one finds no free slot.
+            QueueTimeoutError: If no slot became free in time.
+            GenerationCancelledError: If the token was cancelled while waiting.
+        """
+        key = f"{getattr(vendor, 'value', vendor)}/{model_name}"
+        queue = self._queue(key)
+        if queue is None:
+            yield
+            return
+
+        if speculative:
+            self._acquire_speculative(queue, cancel)
+        else:
+            self._acquire(queue, client_id or "anonymous", cancel)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(queue, time.monotonic() - start, cancel if speculative else None)
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "models": {
+                    key: {
+                        "limit": queue.limit,
+                        "running": queue.running,
+                        "queued": queue.queued,
+                        "speculative": len(queue.speculative),
+                        "clients_waiting": len(queue.waiters),
+                        "service_ms": None if queue.service_time is None else round(queue.service_time * 1000, 1),
+                    }
+                    for key, queue in self._queues.items()
+                },
+                "admitted": self._admitted,
+                "waited": self._waited,
+                "rejected_queue_full": self._rejected_full,
+                "rejected_client_limit": self._rejected_client,
+                "timeouts": self._timeouts,
+                "cancelled": self._cancelled,
+                "speculative_admitted": self._speculative_admitted,
+                "speculative_skipped": self._speculative_skipped,
+                "preempted": self._preempted,
+                "wait_ms_avg": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                "wait_ms_p95": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))] * 1000, 1) if waits else 0.0,
+            }
+
+    def _queue(self, key: str):
+        limit = self.limits.get(key, self.limits.get(key.split("/")[0]))
+        if not limit:
+            return None
+
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = _ModelQueue(limit)
+            return queue
+
+    def _acquire(self, queue: _ModelQueue, client_id: str, cancel: CancelToken):
+        with self._lock:
+            if queue.running < queue.limit and not queue.queued:
+                queue.running += 1
+                self._admitted += 1
+                self._waits.append(0.0)
+                return
+
+            client_waiters = queue.waiters.get(client_id)
+            if client_waiters is not None and len(client_waiters) >= self.max_queued_per_client:
+                self._rejected_client += 1
+                raise QueueFullError(self._retry_after(queue), StatusCodes.TOO_MANY_REQUESTS)
+
+            if queue.queued >= self.max_queue:
+                self._rejected_full += 1
+                raise QueueFullError(self._retry_after(queue), StatusCodes.SERVICE_UNAVAILABLE)
+
+            waiter = _Waiter()
+            queue.waiters.setdefault(client_id, deque()).append(waiter)
+            queue.queued += 1
+
+            # A speculative generation gives its slot to the real request
+            preempted = queue.speculative.pop(0) if queue.speculative else None
+            if preempted is not None:
+                self._preempted += 1
+
+        if preempted is not None:
+            preempted.cancel("Slot needed by a real request")
+        if cancel is not None:
+            cancel.on_cancel(waiter.event.set)
+        waiter.event.wait(self.queue_timeout)
+
+        with self._lock:
+            if waiter.granted:
+                waited = time.monotonic() - waiter.enqueued_at
+                self._admitted += 1
+                self._waited += 1
+                self._waits.append(waited)
+                return
+
+            client_waiters = queue.waiters[client_id]
+            client_waiters.remove(waiter)
+            if not client_waiters:
+                del queue.waiters[client_id]
+            queue.queued -= 1
+
+            if cancel is not None and cancel.cancelled:
+                self._cancelled += 1
+            else:
+                self._timeouts += 1
+                raise QueueTimeoutError(self._retry_after(queue))
+
+        cancel.raise_if_cancelled()
+
+    def _acquire_speculative(self, queue: _ModelQueue, cancel: CancelToken):
+        with self._lock:
+            if queue.running >= queue.limit or queue.queued:
+                self._speculative_skipped += 1
+                raise QueueFullError(self._retry_after(queue), StatusCodes.SERVICE_UNAVAILABLE)
+
+            queue.running += 1
+            queue.speculative.append(cancel)
+            self._speculative_admitted += 1
+
+    def _release(self, queue: _ModelQueue, seconds: float, speculative: CancelToken = None):
+        with self._lock:
+            if speculative is None:
+                queue.service_time = seconds if queue.service_time is None else queue.service_time + 0.2 * (seconds - queue.service_time)
+            elif speculative in queue.speculative:
+                queue.speculative.remove(speculative)
+
+            if not queue.waiters:
+                queue.running -= 1
+                return
+
+            # The slot passes straight to the next client in turn, so running stays the same
+            client_id, client_waiters = next(iter(queue.waiters.items()))
+            waiter = client_waiters.popleft()
+            if client_waiters:
+                queue.waiters.move_to_end(client_id)
+            else:
+                del queue.waiters[client_id]
+            queue.queued -= 1
+
+            waiter.granted = True
+            waiter.event.set()
+
+    def _retry_after(self, queue: _ModelQueue) -> int:
+        # Time until the queue ahead of a new request has drained
+        if queue.service_time is None:
+            return self.retry_after
+        return max(1, math.ceil(queue.service_time * (queue.queued + 1) / queue.limit))
+
+
+_scheduler_lock = threading.Lock()
+
+def get_admission_scheduler() -> AdmissionScheduler:
+    if "admission" not in current_app.extensions:
+        with _scheduler_lock:
+            if "admission" not in current_app.extensions:
+                config = current_app.config
+                current_app.extensions["admission"] = AdmissionScheduler(
+                    limits=config["SCHEDULER_CONCURRENCY"],
+                    max_queue=config["SCHEDULER_MAX_QUEUE"],
+                    max_queued_per_client=config["SCHEDULER_MAX_QUEUED_PER_CLIENT"],
+                    queue_timeout=config["SCHEDULER_QUEUE_TIMEOUT"],
+                    retry_after=config["SCHEDULER_RETRY_AFTER"],
+                )
+    return current_app.extensions["admission"]
+
+admission_scheduler = LocalProxy(get_admission_scheduler)
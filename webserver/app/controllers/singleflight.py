@@ -0,0 +1,107 @@
+from app.models.cancellation import CancelToken
+from app.models.errors import DeadlineExceededError
+from flask import current_app
+from werkzeug.local import LocalProxy
+import threading
+
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = set()  # Events of the callers waiting for the result
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key so that only one of them does the work.
+
+    The first caller for a key runs the function. Callers that arrive while it is still running
+    wait for it and receive the same result, or the same exception. A waiting caller stops
+    waiting when its own cancel token is cancelled or its deadline passes, the first caller
+    carries on for the others.
+    """
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._executed = 0
+        self._coalesced = 0
+        self._abandoned = 0
+
+    def do(self, key, fn, cancel: CancelToken = None):
+        """
+        Runs fn for key unless a call for the same key is already in flight, then returns its result.
+
+        Raises:
+            GenerationCancelledError: If cancel was cancelled while waiting for another caller.
+            DeadlineExceededError: If the deadline of cancel passed while waiting for another caller.
+        """
+        woken = threading.Event()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self._executed += 1
+            else:
+                call.followers.add(woken)
+                self._coalesced += 1
+
+        if not leader:
+            return self._follow(call, woken, cancel)
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                followers = list(call.followers)
+            call.done.set()
+            for woken in followers:
+                woken.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls),
+                "executed": self._executed,
+                "coalesced": self._coalesced,
+                "abandoned": self._abandoned,
+            }
+
+    def _follow(self, call: _Call, woken: threading.Event, cancel: CancelToken = None):
+        if cancel is not None:
+            cancel.on_cancel(woken.set)
+        woken.wait(None if cancel is None else cancel.remaining())
+
+        if not call.done.is_set():
+            # Our client gave up, the call goes on for the others
+            with self._lock:
+                call.followers.discard(woken)
+                self._abandoned += 1
+            if not cancel.cancelled:
+                cancel.cancel("Deadline exceeded", DeadlineExceededError)
+            cancel.raise_if_cancelled()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+_singleflight_lock = threading.Lock()
+
+def get_suggestion_flights():
+    if "suggestion_flights" not in current_app.extensions:
+        with _singleflight_lock:
+            if "suggestion_flights" not in current_app.extensions:
+                current_app.extensions["suggestion_flights"] = SingleFlight()
+    return current_app.extensions["suggestion_flights"]
+
+suggestion_flights = LocalProxy(get_suggestion_flights)
@@ -0,0 +1,87 @@
+import threading
+import time
+
+from app.models.errors import GenerationCancelledError, DeadlineExceededError
+
+
+
+class CancelToken:
+    """
+    Tells a running generation to stop.
+
+    Vendor calls register a callback that closes their HTTP connection, so cancelling also
+    stops the model on the other side instead of only discarding its answer.
+
+    Args:
+        parent (CancelToken): A token whose cancellation also cancels this one. Its deadline is inherited.
+        timeout (float): Seconds after which the token cancels itself with a DeadlineExceededError.
+    """
+    def __init__(self, parent: "CancelToken" = None, timeout: float = None):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._error = GenerationCancelledError
+        self.reason = None
+
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        if parent is not None and parent.deadline is not None:
+            self.deadline = parent.deadline if self.deadline is None else min(self.deadline, parent.deadline)
+
+        if parent is not None:
+            parent.on_cancel(lambda: self.cancel(parent.reason, parent._error))
+
+        self._timer = None
+        if timeout is not None:
+            self._timer = threading.Timer(max(0.0, timeout), self.cancel, args=("Deadline exceeded", DeadlineExceededError))
+            self._timer.daemon = True
+            self._timer.start()
+            self.on_cancel(self._timer.cancel)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "Generation cancelled", error: type = GenerationCancelledError):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self.reason = reason
+            self._error = error
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error while cancelling generation: {e}")
+
+    def on_cancel(self, callback):
+        """
+        Runs callback when the token is cancelled, or right away if it already is.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remaining(self, default: float = None):
+        """
+        Returns the seconds left until the deadline, capped at default. Returns default if there is no deadline.
+        """
+        if self.deadline is None:
+            return default
+        left = max(0.0, self.deadline - time.monotonic())
+        return left if default is None else min(default, left)
+
+    def close(self):
+        """
+        Stops the deadline timer once the work the token guarded has finished.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise self._error(self.reason)
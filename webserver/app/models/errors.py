@@ -4,6 +4,8 @@ from app.models.status_codes import StatusCodes
 
 class BaseError(Exception):
     """Base class for custom errors."""
+    retry_after = None  # seconds a client should wait before retrying, if set
+
     def __init__(self, message, status_code=StatusCodes.BAD_REQUEST):
         self.message = message
         self.status_code = status_code
@@ -36,4 +38,56 @@ class AuthenticationError(BaseError):
 
 class ModelError(BaseError):
     def __init__(self, message="Suggestion generation failed"):
-        super().__init__(message, StatusCodes.SERVER_ERROR)
\ No newline at end of file
+        super().__init__(message, StatusCodes.SERVER_ERROR)
+
+class GenerationCancelledError(BaseError):
+    """Raised when a generation is stopped before it finished."""
+    def __init__(self, message="Generation cancelled", status_code=StatusCodes.SERVER_ERROR):
+        super().__init__(message, status_code)
+
+
+class DeadlineExceededError(GenerationCancelledError):
+    """Raised when a generation is stopped because the client's deadline has passed."""
+    def __init__(self, message="Deadline exceeded"):
+        super().__init__(message, StatusCodes.GATEWAY_TIMEOUT)
+
+
+class VendorUnavailableError(BaseError):
+    """Raised when every vendor that could answer is failing."""
+    def __init__(self, message="No AI vendor is currently available"):
+        super().__init__(message, StatusCodes.SERVICE_UNAVAILABLE)
+
+
+class ModelColdError(BaseError):
+    """Raised when the requested Ollama model is not loaded yet."""
+    def __init__(self, model_name, retry_after=10):
+        self.retry_after = retry_after
+        super().__init__(f"The model {model_name} is loading, retry in {retry_after} seconds", StatusCodes.SERVICE_UNAVAILABLE)
+
+
+class QueueFullError(BaseError):
+    """Raised when a generation cannot be queued because too many are waiting."""
+    def __init__(self, retry_after, status_code=StatusCodes.SERVICE_UNAVAILABLE):
+        self.retry_after = retry_after
+        message = "Too many requests from this client" if status_code == StatusCodes.TOO_MANY_REQUESTS else "The server is busy"
+        super().__init__(f"{message}, retry in {retry_after} seconds", status_code)
+
+
+class QueueTimeoutError(BaseError):
+    """Raised when a queued generation did not get to run in time."""
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"Timed out waiting for the model, retry in {retry_after} seconds", StatusCodes.SERVICE_UNAVAILABLE)
+
+
+class DocumentNotFoundError(BaseError):
+    """Raised when a document session is unknown, closed or expired."""
+    def __init__(self, document_id):
+        super().__init__(f"Document {document_id} is not open, open it again with its full text", StatusCodes.NOT_FOUND)
+
+
+class DocumentVersionError(BaseError):
+    """Raised when edits were made on another version of a document than the server's."""
+    def __init__(self, document_id, version):
+        self.version = version
+        super().__init__(f"Document {document_id} is at version {version}, open it again with its full text", StatusCodes.CONFLICT)
@@ -0,0 +1,179 @@
+class PieceTable:
+    """
+    Text buffer that applies edits without copying the whole text.
+
+    The text is a list of pieces, each a slice of a read-only buffer: the original text, or the
+    text of one insertion. An edit only splits the pieces at its ends and replaces the ones in
+    between, so it costs O(pieces) instead of O(length) like editing a str would. Reading a range
+    joins the pieces it covers.
+
+    Deleted text stays in the buffers until the table is compacted into a single buffer again,
+    which happens once there are more than max_pieces pieces or the buffers hold more than twice
+    the current text.
+
+    Offsets count characters (code points). Editors such as VS Code count UTF-16 code units, in
+    which characters outside the Basic Multilingual Plane take two; index converts those. Only
+    buffers that hold such characters are scanned, in others a character is one code unit.
+
+    Args:
+        text (str): The initial text.
+        max_pieces (int): Number of pieces after which the table is compacted.
+    """
+    def __init__(self, text: str = "", max_pieces: int = 1024):
+        self.max_pieces = max_pieces
+        self._buffers = [text]
+        self._wide = [_has_surrogate_pairs(text)]  # whether a buffer has characters taking two UTF-16 code units
+        self._pieces = [(0, 0, len(text))] if text else []  # (buffer, start, length)
+        self._length = len(text)
+        self._buffered = len(text)
+
+    def __len__(self):
+        return self._length
+
+    def __str__(self):
+        return self.slice()
+
+    @property
+    def pieces(self) -> int:
+        return len(self._pieces)
+
+    @property
+    def buffered(self) -> int:
+        """
+        Characters held by the buffers, including deleted text that was not compacted yet.
+        """
+        return self._buffered
+
+    def replace(self, start: int, end: int, text: str = ""):
+        """
+        Replaces the characters from start to end with text. start == end inserts, an empty text deletes.
+
+        Raises:
+            ValueError: If the range is not inside the text.
+        """
+        if not 0 <= start <= end <= self._length:
+            raise ValueError(f"Edit range {start}-{end} is outside of the text (length {self._length})")
+
+        first = self._split(start)
+        last = self._split(end)
+        inserted = []
+        if text:
+            self._buffers.append(text)
+            self._wide.append(_has_surrogate_pairs(text))
+            self._buffered += len(text)
+            inserted.append((len(self._buffers) - 1, 0, len(text)))
+        self._pieces[first:last] = inserted
+        self._length += len(text) - (end - start)
+
+        if len(self._pieces) > self.max_pieces or self._buffered > 2 * self._length + 4096:
+            self.compact()
+
+    def insert(self, offset: int, text: str):
+        self.replace(offset, offset, text)
+
+    def delete(self, start: int, end: int):
+        self.replace(start, end)
+
+    def slice(self, start: int = 0, end: int = None) -> str:
+        """
+        Returns the text from start to end, like str slicing with non-negative bounds.
+        """
+        end = self._length if end is None else min(end, self._length)
+        start = max(0, start)
+        if start >= end:
+            return ""
+
+        parts = []
+        position = 0
+        for buffer, offset, length in self._pieces:
+            if position + length > start:
+                lo = max(start - position, 0)
+                hi = min(end - position, length)
+                parts.append(self._buffers[buffer][offset + lo:offset + hi])
+            position += length
+            if position >= end:
+                break
+        return "".join(parts)
+
+    def units(self) -> int:
+        """
+        Length of the text in UTF-16 code units.
+        """
+        return sum(self._piece_units(piece) for piece in self._pieces)
+
+    def index(self, units: int) -> int:
+        """
+        Converts an offset in UTF-16 code units to an offset in characters.
+
+        Raises:
+            ValueError: If the offset is outside of the text or between the two halves of a surrogate pair.
+        """
+        if units < 0:
+            raise ValueError(f"Offset {units} is outside of the text")
+
+        remaining = units
+        position = 0
+        for piece in self._pieces:
+            piece_units = self._piece_units(piece)
+            if remaining <= piece_units:
+                buffer, start, length = piece
+                if not self._wide[buffer]:
+                    return position + remaining
+                offset = start
+                while remaining > 0:
+                    remaining -= 2 if ord(self._buffers[buffer][offset]) > 0xFFFF else 1
+                    offset += 1
+                if remaining < 0:
+                    raise ValueError(f"Offset {units} splits a surrogate pair")
+                return position + offset - start
+            remaining -= piece_units
+            position += piece[2]
+
+        if remaining:
+            raise ValueError(f"Offset {units} is outside of the text")
+        return position
+
+    def copy(self) -> "PieceTable":
+        """
+        Returns a table with the same text, edits to either do not change the other. Costs O(pieces).
+        """
+        table = PieceTable(max_pieces=self.max_pieces)
+        table._buffers = list(self._buffers)
+        table._wide = list(self._wide)
+        table._pieces = list(self._pieces)
+        table._length = self._length
+        table._buffered = self._buffered
+        return table
+
+    def compact(self):
+        """
+        Copies the text into a single buffer and drops the deleted text.
+        """
+        text = self.slice()
+        self._buffers = [text]
+        self._wide = [_has_surrogate_pairs(text)]
+        self._pieces = [(0, 0, len(text))] if text else []
+        self._buffered = len(text)
+
+    def _piece_units(self, piece: tuple) -> int:
+        buffer, start, length = piece
+        if not self._wide[buffer]:
+            return length
+        return len(self._buffers[buffer][start:start + length].encode("utf-16-le")) // 2
+
+    def _split(self, offset: int) -> int:
+        # Returns the index of the first piece starting at offset, splitting the piece offset falls in
+        position = 0
+        for index, (buffer, start, length) in enumerate(self._pieces):
+            if position == offset:
+                return index
+            if offset < position + length:
+                head = offset - position
+                self._pieces[index:index + 1] = [(buffer, start, head), (buffer, start + head, length - head)]
+                return index + 1
+            position += length
+        return len(self._pieces)
+
+
+def _has_surrogate_pairs(text: str) -> bool:
+    return len(text.encode("utf-16-le")) != 2 * len(text)
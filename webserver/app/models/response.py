@@ -18,10 +18,14 @@ def success_response(
 def error_response(
         message: str,
         data=None,
-        status_code: StatusCodes = StatusCodes.NOT_FOUND
+        status_code: StatusCodes = StatusCodes.NOT_FOUND,
+        headers: dict = None
 ):
-    return jsonify({
+    body = jsonify({
         "status": "Error",
         "message": message,
         "data": data,
-    }), status_code.value
\ No newline at end of file
+    })
+    if headers:
+        return body, status_code.value, headers
+    return body, status_code.value
\ No newline at end of file
@@ -5,8 +5,13 @@ from enum import Enum
 class StatusCodes(Enum):
     OK = 200
     CREATED = 201
+    ACCEPTED = 202
     BAD_REQUEST = 400
     UNAUTHORIZED = 401
     NOT_FOUND = 404
+    CONFLICT = 409
+    TOO_MANY_REQUESTS = 429
     SERVER_ERROR = 500
-    NOT_IMPLEMENTED = 501
\ No newline at end of file
+    NOT_IMPLEMENTED = 501
+    SERVICE_UNAVAILABLE = 503
+    GATEWAY_TIMEOUT = 504
\ No newline at end of file
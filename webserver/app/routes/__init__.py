@@ -5,6 +5,8 @@ from .main_page import main_page_bp
 from .user import users_bp
 from .docs import docs_bp
 from .auth import auth_bp
+from .metrics import metrics_bp
+from .documents import documents_bp
 
 def register_blueprints(app):
     app.register_blueprint(suggestions_bp)
@@ -13,3 +15,5 @@ def register_blueprints(app):
     app.register_blueprint(users_bp)
     app.register_blueprint(docs_bp)
     app.register_blueprint(auth_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(documents_bp)
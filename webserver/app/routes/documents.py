@@ -0,0 +1,422 @@
+from flask import Blueprint, request
+from app.controllers.deadlines import request_monitor, request_token
+from app.routes.suggestions import get_client_id
+from app.services.document_service import openDocument, editDocument, closeDocument, getDocumentSuggestion
+from app.models.errors import BaseError, DocumentVersionError
+from app.models.response import *
+from app.models.status_codes import StatusCodes
+from flasgger import swag_from
+
+documents_bp = Blueprint('documents', __name__)
+
+
+def document_error_response(e: BaseError):
+    """
+    Error response for a failed document request. A version conflict carries the server's version.
+    """
+    return error_response(
+        e.message,
+        {"version": e.version} if isinstance(e, DocumentVersionError) else None,
+        e.status_code,
+        {"Retry-After": str(e.retry_after)} if e.retry_after else None
+    )
+
+
+@documents_bp.route('/document/open', methods=['POST'])
+@swag_from({
+    'tags': ['Documents'],
+    'summary': 'Open a document session',
+    'description': 'Sends the full text of a document once. Later requests send only the edits made to it and the cursor position, and the server builds the prompt from its copy of the document. Opening a document again replaces the server\'s copy.',
+    'consumes': ['application/json'],
+    'produces': ['application/json'],
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'documentId': {
+                        'type': 'string',
+                        'example': 'file:///home/user/project/main.py'
+                    },
+                    'text': {
+                        'type': 'string',
+                        'example': 'def add(a, b):\n'
+                    },
+                    'language': {
+                        'type': 'string',
+                        'example': 'python',
+                        'description': 'Language of the code, "python" or "javascript". Guessed from the prompt if omitted.'
+                    },
+                    'userId': {
+                        'type': 'string',
+                        'example': '12345',
+                        'description': 'Who opened the document. Falls back to the X-Client-Id header, then to the client address.'
+                    }
+                },
+                'required': ['documentId', 'text']
+            }
+        }
+    ],
+    'responses': {
+        '201': {
+            'description': 'Document opened',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'version': {
+                        'type': 'integer',
+                        'example': 0,
+                        'description': 'The version of the document, the next edits are sent against it.'
+                    }
+                }
+            }
+        },
+        '400': {
+            'description': 'Bad Request - No documentId or text provided',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': 'No documentId or text provided'}
+                }
+            }
+        }
+    }
+})
+def open_document_route():
+    """
+    Open a document session with the full text of the document.
+    See Swagger docs for more information.
+    """
+    data = request.json
+    document_id = data.get("documentId")
+    text = data.get("text")
+
+    if not document_id or not isinstance(text, str):
+        return error_response(
+            "No documentId or text provided",
+            None,
+            StatusCodes.BAD_REQUEST
+        )
+
+    version = openDocument(get_client_id(data), document_id, text, data.get("language"))
+
+    return success_response(
+        "Document opened",
+        {"version": version},
+        StatusCodes.CREATED
+    )
+
+
+@documents_bp.route('/document/edit', methods=['POST'])
+@swag_from({
+    'tags': ['Documents'],
+    'summary': 'Apply edits to an open document',
+    'description': 'Applies the edits in order, each to the result of the previous one. Offsets count UTF-16 code units, like VS Code positions, so a character outside the Basic Multilingual Plane such as an emoji counts twice. Either all edits of a request are applied or none.',
+    'consumes': ['application/json'],
+    'produces': ['application/json'],
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'documentId': {
+                        'type': 'string',
+                        'example': 'file:///home/user/project/main.py'
+                    },
+                    'version': {
+                        'type': 'integer',
+                        'example': 0,
+                        'description': 'The version the edits were made on. Not checked if omitted.'
+                    },
+                    'edits': {
+                        'type': 'array',
+                        'items': {
+                            'type': 'object',
+                            'properties': {
+                                'start': {'type': 'integer', 'example': 15},
+                                'end': {'type': 'integer', 'example': 15},
+                                'text': {'type': 'string', 'example': '    return a + b\n'}
+                            }
+                        }
+                    },
+                    'userId': {
+                        'type': 'string',
+                        'example': '12345',
+                        'description': 'Who opened the document.'
+                    }
+                },
+                'required': ['documentId', 'edits']
+            }
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Edits applied',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'version': {'type': 'integer', 'example': 1}
+                }
+            }
+        },
+        '400': {
+            'description': 'Bad Request - An edit is malformed or outside of the document',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': 'Edit range 15-40 is outside of the document (length 15)'}
+                }
+            }
+        },
+        '404': {
+            'description': 'Not Found - The document is not open or has expired, open it again',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': 'Document file:///home/user/project/main.py is not open, open it again with its full text'}
+                }
+            }
+        },
+        '409': {
+            'description': 'Conflict - The server has another version of the document, open it again',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'version': {'type': 'integer', 'example': 3}
+                }
+            }
+        }
+    }
+})
+def edit_document_route():
+    """
+    Apply edits to an open document.
+    See Swagger docs for more information.
+    """
+    data = request.json
+    document_id = data.get("documentId")
+    edits = data.get("edits")
+
+    if not document_id or not isinstance(edits, list):
+        return error_response(
+            "No documentId or edits provided",
+            None,
+            StatusCodes.BAD_REQUEST
+        )
+
+    try:
+        version = editDocument(get_client_id(data), document_id, edits, data.get("version"))
+    except BaseError as e:
+        return document_error_response(e)
+
+    return success_response(
+        "Document edited",
+        {"version": version},
+        StatusCodes.OK
+    )
+
+
+@documents_bp.route('/document/close', methods=['POST'])
+@swag_from({
+    'tags': ['Documents'],
+    'summary': 'Close a document session',
+    'description': 'Drops the server\'s copy of the document.',
+    'consumes': ['application/json'],
+    'produces': ['application/json'],
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'documentId': {
+                        'type': 'string',
+                        'example': 'file:///home/user/project/main.py'
+                    },
+                    'userId': {
+                        'type': 'string',
+                        'example': '12345',
+                        'description': 'Who opened the document.'
+                    }
+                },
+                'required': ['documentId']
+            }
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Document closed'
+        }
+    }
+})
+def close_document_route():
+    """
+    Close a document session.
+    See Swagger docs for more information.
+    """
+    data = request.json
+    closeDocument(get_client_id(data), data.get("documentId"))
+
+    return success_response(
+        "Document closed",
+        None,
+        StatusCodes.OK
+    )
+
+
+@documents_bp.route('/document/suggestion', methods=['POST'])
+@swag_from({
+    'tags': ['Documents'],
+    'summary': 'Generate a suggestion at the cursor of an open document',
+    'description': 'Applies the edits made since the last request, then builds the prompt from the server\'s copy of the document: the code before the cursor, or the comments and imports at the top and the lines nearest to the cursor in large documents.',
+    'consumes': ['application/json'],
+    'produces': ['application/json'],
+    'parameters': [
+        {
+            'name': 'X-Deadline-Ms',
+            'in': 'header',
+            'type': 'integer',
+            'required': False,
+            'description': 'Milliseconds the client will wait for the answer. The generation is stopped once they have passed. Defaults to the server setting.'
+        },
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'documentId': {
+                        'type': 'string',
+                        'example': 'file:///home/user/project/main.py'
+                    },
+                    'cursor': {
+                        'type': 'integer',
+                        'example': 15,
+                        'description': 'Offset of the cursor after the edits, in UTF-16 code units like the edit offsets.'
+                    },
+                    'edits': {
+                        'type': 'array',
+                        'items': {'type': 'object'},
+                        'description': 'Edits made since the last request, as for /document/edit.'
+                    },
+                    'version': {
+                        'type': 'integer',
+                        'example': 1,
+                        'description': 'The version the edits were made on. Not checked if omitted.'
+                    },
+                    'model': {
+                        'type': 'string',
+                        'example': 'codellama',
+                        'description': 'The AI model to use for generating the suggestion.'
+                    },
+                    'isCorrect': {
+                        'type': 'boolean',
+                        'example': True,
+                        'description': 'A flag indicating whether the suggestion should be correct.'
+                    },
+                    'userId': {
+                        'type': 'string',
+                        'example': '12345',
+                        'description': 'Who opened the document.'
+                    }
+                },
+                'required': ['documentId', 'cursor']
+            }
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Successfully generated suggestion',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'suggestions': {
+                        'type': 'array',
+                        'items': {'type': 'string'},
+                        'example': ["    return a + b"]
+                    },
+                    'version': {
+                        'type': 'integer',
+                        'example': 2,
+                        'description': 'The version of the document the suggestion was generated for.'
+                    }
+                }
+            }
+        },
+        '404': {
+            'description': 'Not Found - The document is not open or has expired, open it again'
+        },
+        '409': {
+            'description': 'Conflict - The server has another version of the document, open it again'
+        }
+    }
+})
+def document_suggestion_route():
+    """
+    Generate a suggestion at the cursor of an open document.
+    See Swagger docs for more information.
+    """
+    data = request.json
+    document_id = data.get("documentId")
+    cursor = data.get("cursor")
+
+    if not document_id or cursor is None:
+        return error_response(
+            "No documentId or cursor provided",
+            None,
+            StatusCodes.BAD_REQUEST
+        )
+
+    cancel = request_token(request.environ, request.headers)
+
+    try:
+        suggestion, bug, version = getDocumentSuggestion(
+            client_id=get_client_id(data),
+            document_id=document_id,
+            cursor=cursor,
+            edits=data.get("edits"),
+            version=data.get("version"),
+            is_correct=data.get("isCorrect", True),
+            model_name=data.get("model", "codellama"),
+            temperature=data.get("temperature", 0.2),
+            top_p=data.get("top_p", 1),
+            top_k=data.get("top_k", 0),
+            max_tokens=data.get("max_tokens", 256),
+            hedge=data.get("hedge"),
+            cascade=data.get("cascade"),
+            quality=data.get("quality"),
+            cancel=cancel
+        )
+
+        result = {"suggestions": [suggestion], "version": version}
+        if bug is not None:
+            result["bug"] = bug
+
+        return success_response(
+            "AI Suggestions",
+            result,
+            StatusCodes.OK
+        )
+
+    except BaseError as e:
+        return document_error_response(e)
+
+    except Exception as e:
+        return error_response(
+            str(e),
+            None,
+            StatusCodes.SERVER_ERROR
+        )
+
+    finally:
+        request_monitor.unwatch(cancel)
+        cancel.close()
@@ -0,0 +1,136 @@
+from flask import Blueprint, current_app
+from app.controllers.ai import ollama_client, vendor_registry
+from app.controllers.cache import suggestion_cache, prefix_index, similarity_index
+from app.controllers.cascade import cascade_tracker
+from app.controllers.contexts import ollama_contexts
+from app.controllers.deadlines import request_monitor
+from app.controllers.disk_cache import disk_cache
+from app.controllers.documents import document_store
+from app.controllers.hedging import hedge_tracker
+from app.controllers.prefetch import prefetcher
+from app.controllers.residency import model_residency
+from app.controllers.routing import vendor_router
+from app.controllers.scheduler import admission_scheduler
+from app.controllers.singleflight import suggestion_flights
+from app.models.response import *
+from app.models.status_codes import StatusCodes
+from flasgger import swag_from
+
+
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/metrics', methods=['GET'])
+@swag_from({
+    'tags': ['Metrics'],
+    'summary': 'Runtime statistics of the suggestion backend',
+    'description': 'Returns counters for the shared resources of this worker process, such as the Ollama connection pool and the suggestion cache.',
+    'responses': {
+        '200': {
+            'description': 'Current statistics',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'data': {
+                        'type': 'object',
+                        'properties': {
+                            'ollama_pool': {
+                                'type': 'object',
+                                'example': {
+                                    'pool_size': 10,
+                                    'requests': 42,
+                                    'connections_in_use': 2,
+                                    'idle_connections': 3
+                                }
+                            },
+                            'suggestion_cache': {
+                                'type': 'object',
+                                'example': {
+                                    'entries': 12,
+                                    'hits': 30,
+                                    'misses': 12,
+                                    'hit_rate': 0.71
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+})
+def get_metrics_route():
+    """
+    Returns runtime statistics for this worker process.
+    See Swagger docs for more information.
+    """
+    return success_response(
+        "Metrics",
+        {
+            "vendors": vendor_registry.stats(),
+            "ollama_pool": ollama_client.stats(),
+            "ollama_models": model_residency.stats(),
+            "ollama_contexts": ollama_contexts.stats(),
+            "suggestion_cache": suggestion_cache.stats(),
+            "prefix_index": prefix_index.stats(),
+            "similarity_index": similarity_index.stats(),
+            "disk_cache": disk_cache.stats() if disk_cache else None,
+            "cache_warmup": current_app.extensions.get("cache_warmup"),
+            "coalescing": suggestion_flights.stats(),
+            "hedging": hedge_tracker.stats(),
+            "cascade": cascade_tracker.stats(),
+            "admission": admission_scheduler.stats(),
+            "prefetch": prefetcher.stats(),
+            "cancellations": request_monitor.stats(),
+            "documents": document_store.stats(),
+        },
+        StatusCodes.OK
+    )
+
+
+@metrics_bp.route('/metrics/routing', methods=['GET'])
+@swag_from({
+    'tags': ['Metrics'],
+    'summary': 'Health of every vendor and model used for routing',
+    'description': 'Returns the moving average latency and error rate and the circuit breaker state of each vendor and model that has served a suggestion.',
+    'responses': {
+        '200': {
+            'description': 'Routing state per "vendor/model"',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'data': {
+                        'type': 'object',
+                        'example': {
+                            'ollama/codellama': {
+                                'state': 'open',
+                                'latency_ms': 850.2,
+                                'error_rate': 0.67,
+                                'requests': 12,
+                                'failures': 6,
+                                'consecutive_failures': 5,
+                                'retry_in': 21.4
+                            },
+                            'openai/gpt-4o-mini': {
+                                'state': 'closed',
+                                'latency_ms': 640.0,
+                                'error_rate': 0.0,
+                                'requests': 7,
+                                'failures': 0,
+                                'consecutive_failures': 0,
+                                'retry_in': None
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+})
+def get_routing_metrics_route():
+    """
+    Returns the routing health of each vendor and model.
+    See Swagger docs for more information.
+    """
+    return success_response("Routing metrics", vendor_router.stats(), StatusCodes.OK)
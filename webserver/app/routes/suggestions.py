@@ -1,11 +1,22 @@
-from flask import Blueprint, request
-from app.services.suggestion_service import getSuggestion
+from flask import Blueprint, Response, current_app, request, stream_with_context
+from app.controllers.deadlines import request_monitor, request_token
+from app.services.suggestion_service import getSuggestion, getSuggestions, getBuggySuggestion, getSuggestionPair, prefetchSuggestions, streamSuggestion
+from app.models.errors import BaseError
 from app.models.response import *
 from app.models.status_codes import StatusCodes
 from flasgger import swag_from
+import json
 
 suggestions_bp = Blueprint('suggestions', __name__)
 
+
+def get_client_id(data: dict) -> str:
+    """
+    Identifies who sent a request, so that busy models can share their queue fairly.
+    """
+    return str(data.get("userId") or request.headers.get("X-Client-Id") or request.remote_addr)
+
+
 @suggestions_bp.route('/suggestion', methods=['POST'])
 @swag_from({
     'tags': ['Suggestions'],
@@ -14,6 +25,13 @@ suggestions_bp = Blueprint('suggestions', __name__)
     'consumes': ['application/json'],
     'produces': ['application/json'],
     'parameters': [
+        {
+            'name': 'X-Deadline-Ms',
+            'in': 'header',
+            'type': 'integer',
+            'required': False,
+            'description': 'Milliseconds the client will wait for the answer. The generation is stopped once they have passed. Defaults to the server setting.'
+        },
         {
             'name': 'body',
             'in': 'body',
@@ -34,6 +52,46 @@ suggestions_bp = Blueprint('suggestions', __name__)
                         'type': 'boolean',
                         'example': False,
                         'description': 'A flag indicating whether the suggestion should be correct.'
+                    },
+                    'paired': {
+                        'type': 'boolean',
+                        'example': True,
+                        'description': 'Generate the correct and the buggy suggestion in parallel and return both, correct first. isCorrect is ignored.'
+                    },
+                    'n': {
+                        'type': 'integer',
+                        'example': 3,
+                        'description': 'Number of alternative correct suggestions to return, best first, generated with one upstream call. Duplicates are removed, so fewer may be returned. Ignored for paired and buggy suggestions.'
+                    },
+                    'hedge': {
+                        'type': 'boolean',
+                        'example': True,
+                        'description': 'Send the prompt to a backup vendor as well if the model is slower than usual. Defaults to the server setting.'
+                    },
+                    'language': {
+                        'type': 'string',
+                        'example': 'python',
+                        'description': 'Language of the code, "python" or "javascript". Guessed from the prompt if omitted.'
+                    },
+                    'userId': {
+                        'type': 'string',
+                        'example': '12345',
+                        'description': 'Who sent the request, busy models share their queue fairly between users. Falls back to the X-Client-Id header, then to the client address.'
+                    },
+                    'documentId': {
+                        'type': 'string',
+                        'example': 'file:///home/user/project/main.py',
+                        'description': 'The document the prompt comes from. Ollama continues from the context of the previous prompt of the same document instead of reading the whole prompt again.'
+                    },
+                    'cascade': {
+                        'type': 'boolean',
+                        'example': True,
+                        'description': 'Ignore model and let a small draft model answer first, escalating to larger models only when its answer is empty, does not parse or repeats the prompt. Defaults to the server setting.'
+                    },
+                    'quality': {
+                        'type': 'string',
+                        'example': 'high',
+                        'description': 'In cascade mode, "high" skips the draft model.'
                     }
                 },
                 'required': ['prompt']
@@ -50,12 +108,28 @@ suggestions_bp = Blueprint('suggestions', __name__)
                         'type': 'array',
                         'items': {'type': 'string'},
                         'example': ["return a + b"]
+                    },
+                    'tier': {
+                        'type': 'string',
+                        'example': 'ollama/qwen2.5-coder:1.5b',
+                        'description': 'In cascade mode, the "vendor/model" that answered, "cache" or "coalesced".'
+                    },
+                    'bug': {
+                        'type': 'object',
+                        'description': 'The bug injected into the buggy suggestion, if it was not written by the model.',
+                        'example': {
+                            'mutation': 'wrong_operator',
+                            'language': 'python',
+                            'line': 1,
+                            'original': '+',
+                            'replacement': '-'
+                        }
                     }
                 }
             }
         },
         '400': {
-            'description': 'Bad Request - No prompt provided',
+            'description': 'Bad Request - No prompt provided, or n is out of range',
             'schema': {
                 'type': 'object',
                 'properties': {
@@ -63,6 +137,15 @@ suggestions_bp = Blueprint('suggestions', __name__)
                 }
             }
         },
+        '429': {
+            'description': 'Too Many Requests - This user already has too many requests waiting, see the Retry-After header',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': 'Too many requests from this client, retry in 3 seconds'}
+                }
+            }
+        },
         '500': {
             'description': 'Internal Server Error - Failed to generate response',
             'schema': {
@@ -71,6 +154,24 @@ suggestions_bp = Blueprint('suggestions', __name__)
                     'error': {'type': 'string', 'example': 'Connection error'}
                 }
             }
+        },
+        '503': {
+            'description': 'Service Unavailable - The model is busy or still loading, see the Retry-After header',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': 'The server is busy, retry in 3 seconds'}
+                }
+            }
+        },
+        '504': {
+            'description': 'Gateway Timeout - The deadline passed before the suggestion was generated',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': 'Deadline exceeded'}
+                }
+            }
         }
     }
 })
@@ -87,6 +188,15 @@ def generate_suggestion_route():
     top_k = data.get("top_k", 0)
     max_tokens = data.get("max_tokens", 256)
     is_correct = data.get("isCorrect", True)
+    paired = data.get("paired", False)
+    hedge = data.get("hedge")
+    language = data.get("language")
+    document_id = data.get("documentId")
+    cascade = data.get("cascade")
+    quality = data.get("quality")
+    n = data.get("n", 1)
+    trace = {}
+    bug = None
 
     if not prompt:
         return error_response(
@@ -95,26 +205,348 @@ def generate_suggestion_route():
             StatusCodes.BAD_REQUEST
         )
 
-    try:
-        # Call getSuggestion with all parameters, it will decide which model to use
-        response = getSuggestion(
-            prompt=prompt,
-            model_name=model_name,
-            temperature=temperature,
-            top_p=top_p,
-            top_k=top_k,
-            max_tokens=max_tokens,
-            is_correct=is_correct
+    if not isinstance(n, int) or not 1 <= n <= current_app.config["SUGGESTION_MAX_CANDIDATES"]:
+        return error_response(
+            f"n must be between 1 and {current_app.config['SUGGESTION_MAX_CANDIDATES']}",
+            None,
+            StatusCodes.BAD_REQUEST
         )
+
+    # Stops the generation once the deadline passes or the client disconnects
+    cancel = request_token(request.environ, request.headers)
+
+    try:
+        if paired:
+            # suggestions[0] is the correct suggestion and suggestions[1] the buggy one
+            suggestions, bug = getSuggestionPair(
+                prompt=prompt,
+                model_name=model_name,
+                temperature=temperature,
+                top_p=top_p,
+                top_k=top_k,
+                max_tokens=max_tokens,
+                hedge=hedge,
+                client_id=get_client_id(data),
+                language=language,
+                cancel=cancel,
+                document_id=document_id,
+                cascade=cascade,
+                quality=quality,
+                trace=trace
+            )
+        elif not is_correct:
+            suggestion, bug = getBuggySuggestion(
+                prompt=prompt,
+                model_name=model_name,
+                temperature=temperature,
+                top_p=top_p,
+                top_k=top_k,
+                max_tokens=max_tokens,
+                hedge=hedge,
+                client_id=get_client_id(data),
+                language=language,
+                cancel=cancel,
+                document_id=document_id,
+                cascade=cascade,
+                quality=quality,
+                trace=trace
+            )
+            suggestions = [suggestion]
+        elif n > 1:
+            suggestions = getSuggestions(
+                prompt=prompt,
+                n=n,
+                model_name=model_name,
+                temperature=temperature,
+                top_p=top_p,
+                top_k=top_k,
+                max_tokens=max_tokens,
+                client_id=get_client_id(data),
+                cancel=cancel
+            )
+        else:
+            # Call getSuggestion with all parameters, it will decide which model to use
+            suggestions = [getSuggestion(
+                prompt=prompt,
+                model_name=model_name,
+                temperature=temperature,
+                top_p=top_p,
+                top_k=top_k,
+                max_tokens=max_tokens,
+                is_correct=is_correct,
+                hedge=hedge,
+                client_id=get_client_id(data),
+                cancel=cancel,
+                document_id=document_id,
+                cascade=cascade,
+                quality=quality,
+                trace=trace
+            )]
+
+        result = { "suggestions": suggestions}
+        if "tier" in trace:
+            result["tier"] = trace["tier"]
+        if bug is not None:
+            result["bug"] = bug
+
         return success_response(
             "AI Suggestions",
-            { "suggestions": [response]},
+            result,
             StatusCodes.OK
         )
-    
+
+    except BaseError as e:
+        return error_response(
+            e.message,
+            None,
+            e.status_code,
+            {"Retry-After": str(e.retry_after)} if e.retry_after else None
+        )
+
     except Exception as e:
         return error_response(
             str(e),
             None,
             StatusCodes.SERVER_ERROR
-        )
\ No newline at end of file
+        )
+
+    finally:
+        request_monitor.unwatch(cancel)
+        cancel.close()
+
+
+@suggestions_bp.route('/suggestion/prefetch', methods=['POST'])
+@swag_from({
+    'tags': ['Suggestions'],
+    'summary': 'Prefetch the suggestions the client is likely to ask for next',
+    'description': 'Starts low priority generations in the background for the current prompt and for the start of the next line, and returns right away. A later /suggestion request with the same prompt and parameters is answered from their results. Speculative generations are cancelled when real requests need the model.',
+    'consumes': ['application/json'],
+    'produces': ['application/json'],
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'prompt': {
+                        'type': 'string',
+                        'example': 'def add(a, b):'
+                    },
+                    'model': {
+                        'type': 'string',
+                        'example': 'codellama',
+                        'description': 'The AI model the later /suggestion request will use.'
+                    },
+                    'userId': {
+                        'type': 'string',
+                        'example': '12345',
+                        'description': 'Who sent the request, a new prefetch cancels the previous one of the same user.'
+                    }
+                },
+                'required': ['prompt']
+            }
+        }
+    ],
+    'responses': {
+        '202': {
+            'description': 'Prefetching started',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'started': {
+                        'type': 'integer',
+                        'example': 2,
+                        'description': 'Number of speculative generations started.'
+                    }
+                }
+            }
+        },
+        '400': {
+            'description': 'Bad Request - No prompt provided',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': 'No prompt provided'}
+                }
+            }
+        }
+    }
+})
+def prefetch_suggestion_route():
+    """
+    Start speculative generations for the likely next prompts.
+    See Swagger docs for more information.
+    """
+    data = request.json
+    prompt = data.get("prompt", "")
+
+    if not prompt:
+        return error_response(
+            "No prompt provided",
+            None,
+            StatusCodes.BAD_REQUEST
+        )
+
+    started = prefetchSuggestions(
+        prompt=prompt,
+        model_name=data.get("model", "codellama"),
+        temperature=data.get("temperature", 0.2),
+        top_p=data.get("top_p", 1),
+        top_k=data.get("top_k", 0),
+        max_tokens=data.get("max_tokens", 256),
+        client_id=get_client_id(data)
+    )
+
+    return success_response(
+        "Prefetching",
+        {"started": started},
+        StatusCodes.ACCEPTED
+    )
+
+
+@suggestions_bp.route('/suggestion/stream', methods=['POST'])
+@swag_from({
+    'tags': ['Suggestions'],
+    'summary': 'Stream a suggestion as it is generated',
+    'description': 'Same request body as /suggestion, but the response is newline delimited JSON (NDJSON). '
+                   'Each line is either {"token": "..."} with the next piece of the suggestion, '
+                   '{"done": true} once generation has finished, or {"error": "..."} if the model failed mid-stream.',
+    'consumes': ['application/json'],
+    'produces': ['application/x-ndjson'],
+    'parameters': [
+        {
+            'name': 'X-Deadline-Ms',
+            'in': 'header',
+            'type': 'integer',
+            'required': False,
+            'description': 'Milliseconds the client will wait for the answer. The generation is stopped once they have passed. Defaults to the server setting.'
+        },
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'prompt': {
+                        'type': 'string',
+                        'example': 'def add(a, b):'
+                    },
+                    'model': {
+                        'type': 'string',
+                        'example': 'llama3.2:latest',
+                        'description': 'The AI model to use for generating the suggestion.'
+                    },
+                    'isCorrect': {
+                        'type': 'boolean',
+                        'example': False,
+                        'description': 'A flag indicating whether the suggestion should be correct.'
+                    },
+                    'documentId': {
+                        'type': 'string',
+                        'example': 'file:///home/user/project/main.py',
+                        'description': 'The document the prompt comes from, see /suggestion.'
+                    }
+                },
+                'required': ['prompt']
+            }
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Stream of generated tokens',
+            'schema': {
+                'type': 'string',
+                'example': '{"token": "return"}\n{"token": " a + b"}\n{"done": true}\n'
+            }
+        },
+        '400': {
+            'description': 'Bad Request - No prompt provided',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'error': {'type': 'string', 'example': 'No prompt provided'}
+                }
+            }
+        },
+        '429': {
+            'description': 'Too Many Requests - This user already has too many requests waiting, see the Retry-After header'
+        },
+        '503': {
+            'description': 'Service Unavailable - The model is busy, see the Retry-After header'
+        }
+    }
+})
+def stream_suggestion_route():
+    """
+    Stream a suggestion based on the provided prompt, token by token.
+    See Swagger docs for more information.
+    """
+    data = request.json
+    prompt = data.get("prompt", "")
+    model_name = data.get("model", "codellama")
+    temperature = data.get("temperature", 0.2)
+    top_p = data.get("top_p", 1)
+    top_k = data.get("top_k", 0)
+    max_tokens = data.get("max_tokens", 256)
+    is_correct = data.get("isCorrect", True)
+
+    if not prompt:
+        return error_response(
+            "No prompt provided",
+            None,
+            StatusCodes.BAD_REQUEST
+        )
+
+    cancel = request_token(request.environ, request.headers)
+    try:
+        # Waits for admission here, so a full queue still gets its status code and Retry-After
+        tokens = streamSuggestion(
+            prompt=prompt,
+            model_name=model_name,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            max_tokens=max_tokens,
+            is_correct=is_correct,
+            client_id=get_client_id(data),
+            cancel=cancel,
+            document_id=data.get("documentId")
+        )
+    except BaseError as e:
+        request_monitor.unwatch(cancel)
+        cancel.close()
+        return error_response(
+            e.message,
+            None,
+            e.status_code,
+            {"Retry-After": str(e.retry_after)} if e.retry_after else None
+        )
+
+    def generate():
+        # Headers are already sent once streaming starts, so errors are reported in-band
+        try:
+            for token in tokens:
+                yield json.dumps({"token": token}) + "\n"
+            yield json.dumps({"done": True}) + "\n"
+        except GeneratorExit:
+            # The server closes the response when the client goes away
+            cancel.cancel("Client disconnected")
+            raise
+        except Exception as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+        finally:
+            request_monitor.unwatch(cancel)
+            cancel.close()
+            tokens.close()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"  # Stop nginx from buffering the stream
+        }
+    )
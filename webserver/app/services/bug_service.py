@@ -0,0 +1,214 @@
+import io
+import random
+import re
+import tokenize
+import zlib
+
+
+
+LANGUAGES = ("python", "javascript")
+MUTATIONS = ("off_by_one", "flipped_comparison", "wrong_operator", "swapped_arguments")
+
+COMPARISON_FLIPS = {
+    "==": "!=", "!=": "==", "===": "!==", "!==": "===",
+    "<": ">", ">": "<", "<=": ">=", ">=": "<=",
+}
+BOUNDARY_SHIFTS = {"<": "<=", "<=": "<", ">": ">=", ">=": ">"}
+OPERATOR_SWAPS = {
+    "+": "-", "-": "+", "*": "/", "/": "*", "%": "*",
+    "+=": "-=", "-=": "+=", "*=": "/=", "/=": "*=",
+    "and": "or", "or": "and", "&&": "||", "||": "&&",
+}
+
+# Tokens after which + - * start an operand instead of combining two (unary minus, *args, import *)
+OPERAND_STARTS = {"(", "[", "{", ",", "=", ":", "return", "import", "lambda", "=>", "?"}
+DEFINITION_KEYWORDS = {"def", "function", "class"}
+
+JS_TOKEN = re.compile(r"""
+    (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<string>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'|`(?:\\.|[^`\\])*`)
+  | (?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<name>[A-Za-z_$][\w$]*)
+  | (?P<op>===|!==|\*\*=|=>|==|!=|<=|>=|&&|\|\||\?\?|\+\+|--|\+=|-=|\*=|/=|%=|\*\*|[-+*/%<>=!&|^~?:;,.()\[\]{}])
+""", re.VERBOSE | re.DOTALL)
+
+# A / where an operand is expected starts a regular expression literal, not a division
+JS_REGEX = re.compile(r"/(?:\\.|\[(?:\\.|[^\]\\\n])*\]|[^/\\\[\n])+/[A-Za-z]*")
+JS_OPERAND_ENDS = {")", "]", "}", "++", "--"}
+JS_KEYWORDS_BEFORE_OPERAND = {"return", "typeof", "instanceof", "in", "of", "new", "delete", "void", "throw", "case", "do", "else", "yield", "await"}
+
+PY_TOKEN = re.compile(r"""
+    (?P<comment>\#[^\n]*)
+  | (?P<string>[rRbBuUfF]{0,2}(?:\"\"\".*?\"\"\"|'''.*?'''|"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'))
+  | (?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?j?)
+  | (?P<name>[A-Za-z_]\w*)
+  | (?P<op>\*\*=|//=|->|==|!=|<=|>=|\+=|-=|\*=|/=|%=|\*\*|//|:=|[-+*/%<>=!&|^~@:;,.()\[\]{}])
+""", re.VERBOSE | re.DOTALL)
+
+
+
+def detectLanguage(code: str) -> str:
+    """
+    Guesses whether a piece of code is Python or JavaScript.
+    """
+    python = len(re.findall(r"^\s*(def|elif|except|import|from)\b|:\s*$|\bself\b|\bNone\b|\bTrue\b|\bFalse\b", code, re.MULTILINE))
+    javascript = len(re.findall(r"\b(function|const|let|var|null|undefined|===|!==)\b|=>|;\s*$|[{}]\s*$", code, re.MULTILINE))
+    return "javascript" if javascript > python else "python"
+
+def tokenizeCode(code: str, language: str):
+    """
+    Splits code into (kind, text, start, end) tuples, where kind is "name", "number", "op", "string" or "comment".
+
+    Python is read with the standard tokenizer so nothing inside strings or f-strings is mutated. Code
+    it rejects, such as a completion that starts indented, falls back to a regular expression lexer.
+    """
+    if language == "python":
+        try:
+            return _tokenizePython(code)
+        except (tokenize.TokenError, IndentationError, SyntaxError):
+            pass
+
+    if language == "python":
+        return [(match.lastgroup, match.group(), match.start(), match.end()) for match in PY_TOKEN.finditer(code)]
+    return _tokenizeJavaScript(code)
+
+def _tokenizeJavaScript(code: str):
+    # Regular expression literals are read as strings, so nothing inside them is mutated
+    tokens = []
+    position = 0
+    while True:
+        match = JS_TOKEN.search(code, position)
+        if match is None:
+            return tokens
+
+        previous = next((token for token in reversed(tokens) if token[0] != "comment"), None)
+        operand_expected = previous is None or (
+            previous[1] in JS_KEYWORDS_BEFORE_OPERAND if previous[0] == "name"
+            else previous[0] == "op" and previous[1] not in JS_OPERAND_ENDS
+        )
+        regex = JS_REGEX.match(code, match.start()) if match.group() in ("/", "/=") and operand_expected else None
+
+        if regex is not None:
+            tokens.append(("string", regex.group(), regex.start(), regex.end()))
+            position = regex.end()
+        else:
+            tokens.append((match.lastgroup, match.group(), match.start(), match.end()))
+            position = match.end()
+
+def _tokenizePython(code: str):
+    line_starts = [0]
+    for line in io.StringIO(code):
+        line_starts.append(line_starts[-1] + len(line))
+
+    kinds = {tokenize.NAME: "name", tokenize.NUMBER: "number", tokenize.OP: "op", tokenize.STRING: "string", tokenize.COMMENT: "comment"}
+    tokens = []
+    for token in tokenize.generate_tokens(io.StringIO(code).readline):
+        if token.type == tokenize.ENDMARKER:
+            break
+        start = line_starts[token.start[0] - 1] + token.start[1]
+        end = line_starts[token.end[0] - 1] + token.end[1]
+        # f-strings are split into several tokens on Python 3.12, none of them should be mutated
+        tokens.append((kinds.get(token.type, "string" if "FSTRING" in tokenize.tok_name[token.type] else "other"), token.string, start, end))
+    return tokens
+
+def findMutationSites(code: str, language: str) -> dict:
+    """
+    Lists every place a mutation could be applied.
+
+    Returns:
+        dict: Mutation name to a list of (start, end, replacement) edits of code.
+    """
+    tokens = [token for token in tokenizeCode(code, language) if token[0] in ("name", "number", "op", "string")]
+    sites = {mutation: [] for mutation in MUTATIONS}
+
+    for index, (kind, text, start, end) in enumerate(tokens):
+        previous = tokens[index - 1][1] if index else None
+
+        if kind == "number" and text.isdigit():
+            value = int(text)
+            sites["off_by_one"].append((start, end, str(value + 1 if value == 0 else value - 1)))
+        elif kind == "op" and text in BOUNDARY_SHIFTS:
+            sites["off_by_one"].append((start, end, BOUNDARY_SHIFTS[text]))
+
+        if kind == "op" and text in COMPARISON_FLIPS:
+            sites["flipped_comparison"].append((start, end, COMPARISON_FLIPS[text]))
+
+        if text in OPERATOR_SWAPS and (kind == "op" or language == "python"):
+            if previous is not None and previous not in OPERAND_STARTS and previous not in OPERATOR_SWAPS and previous not in COMPARISON_FLIPS:
+                sites["wrong_operator"].append((start, end, OPERATOR_SWAPS[text]))
+
+        if text == "(" and previous is not None and tokens[index - 1][0] == "name":
+            defining = index >= 2 and tokens[index - 2][1] in DEFINITION_KEYWORDS
+            arguments = _callArguments(tokens, index)
+            if not defining and arguments and len(arguments) >= 2:
+                (first_start, first_end), (second_start, second_end) = arguments[0], arguments[1]
+                first, second = code[first_start:first_end], code[second_start:second_end]
+                if first != second and not any(re.match(r"^\s*(\*|\w+\s*=[^=])", arg) for arg in (first, second)):
+                    sites["swapped_arguments"].append((first_start, second_end, second + code[first_end:second_start] + first))
+
+    return sites
+
+def _callArguments(tokens: list, open_index: int):
+    # (start, end) of each top level argument of the call opened by tokens[open_index], None if it is not closed
+    depth = 1
+    arguments = []
+    current = None
+    for kind, text, start, end in tokens[open_index + 1:]:
+        if text in (")", "]", "}"):
+            depth -= 1
+            if depth == 0:
+                if current:
+                    arguments.append(current)
+                return arguments
+        elif text == "," and depth == 1:
+            if current:
+                arguments.append(current)
+            current = None
+            continue
+        elif text in ("(", "[", "{"):
+            depth += 1
+        current = (current[0] if current else start, end)
+    return None
+
+def injectBug(code: str, language: str = None, mutation: str = None, seed: int = None):
+    """
+    Introduces a small bug into correct code without calling a model.
+
+    The same code, language, mutation and seed always produce the same bug. Without a seed it is
+    derived from the code, so a cached correct suggestion always turns into the same buggy one.
+
+    Args:
+        code (str): The correct code, usually a completion.
+        language (str): "python" or "javascript". Guessed from the code if omitted.
+        mutation (str): One of MUTATIONS. A random applicable one is picked if omitted.
+        seed (int): Seed for choosing the mutation and the place it is applied.
+
+    Returns:
+        tuple: The buggy code and a dict describing the bug, or the unchanged code and None if no mutation applies.
+
+    Raises:
+        ValueError: If the language or mutation is unknown.
+    """
+    language = language or detectLanguage(code)
+    if language not in LANGUAGES:
+        raise ValueError(f"Unsupported language {language}, expected one of {', '.join(LANGUAGES)}")
+    if mutation is not None and mutation not in MUTATIONS:
+        raise ValueError(f"Unknown mutation {mutation}, expected one of {', '.join(MUTATIONS)}")
+
+    rng = random.Random(zlib.crc32(code.encode("utf-8")) if seed is None else seed)
+    sites = findMutationSites(code, language)
+    candidates = [mutation] if mutation else [name for name in MUTATIONS if sites[name]]
+    candidates = [name for name in candidates if sites[name]]
+    if not candidates:
+        return code, None
+
+    chosen = rng.choice(candidates)
+    start, end, replacement = rng.choice(sites[chosen])
+    bug = {
+        "mutation": chosen,
+        "language": language,
+        "line": code.count("\n", 0, start) + 1,
+        "original": code[start:end],
+        "replacement": replacement,
+    }
+    return code[:start] + replacement + code[end:], bug
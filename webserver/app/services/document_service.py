@@ -0,0 +1,120 @@
+from app.controllers.documents import document_store
+from app.models.errors import BaseError, DocumentVersionError
+from app.models.piece_table import PieceTable
+from app.services.suggestion_service import HEADER_LINE, getBuggySuggestion, getSuggestion
+from flask import current_app
+
+
+
+def openDocument(client_id: str, document_id: str, text: str, language: str = None) -> int:
+    """
+    Starts a document session with the full text of the document.
+
+    Returns:
+        int: The version of the document, edits are sent against it.
+    """
+    return document_store.open((client_id, document_id), text, language)
+
+def editDocument(client_id: str, document_id: str, edits: list, version: int = None) -> int:
+    """
+    Applies edits to an open document, see DocumentStore.edit.
+
+    Returns:
+        int: The new version of the document.
+    """
+    return document_store.edit((client_id, document_id), edits, version)
+
+def closeDocument(client_id: str, document_id: str):
+    document_store.close((client_id, document_id))
+
+def documentPrompt(table: PieceTable, cursor: int, max_chars: int = None) -> str:
+    """
+    Builds the prompt for a cursor position from the text of a document.
+
+    The prompt is the text before the cursor. In documents longer than max_chars only the
+    comments and imports at the top of the file and the lines closest to the cursor are read,
+    so a request costs the same in a large file as in a small one. shapePrompt then trims the
+    prompt to the token budget of the model.
+
+    Args:
+        table (PieceTable): The text of the document.
+        cursor (int): Offset of the cursor, in UTF-16 code units like editor positions.
+        max_chars (int): Most characters read before the cursor. Defaults to DOCUMENT_CONTEXT_CHARS.
+
+    Raises:
+        BaseError: If the cursor is outside of the document or inside a character.
+    """
+    if not isinstance(cursor, int) or not 0 <= cursor <= table.units():
+        raise BaseError(f"Cursor {cursor} is outside of the document (length {table.units()})")
+    try:
+        cursor = table.index(cursor)
+    except ValueError as e:
+        raise BaseError(f"Cursor {cursor} is invalid: {e}")
+
+    max_chars = current_app.config["DOCUMENT_CONTEXT_CHARS"] if max_chars is None else max_chars
+    if cursor <= max_chars:
+        return table.slice(0, cursor)
+
+    header = []
+    header_chars = 0
+    for line in table.slice(0, max_chars // 4).splitlines(keepends=True)[:current_app.config["PROMPT_HEADER_LINES"]]:
+        if not HEADER_LINE.match(line) or not line.endswith("\n"):
+            break
+        header.append(line)
+        header_chars += len(line)
+
+    # The window starts at a line boundary, unless the cursor's line is longer than the window
+    window = table.slice(cursor - (max_chars - header_chars), cursor)
+    newline = window.find("\n")
+    if 0 <= newline < len(window) - 1:
+        window = window[newline + 1:]
+    return "".join(header) + window
+
+def getDocumentSuggestion(
+    client_id: str,
+    document_id: str,
+    cursor: int,
+    edits: list = None,
+    version: int = None,
+    is_correct: bool = True,
+    **kwargs
+):
+    """
+    Applies the client's latest edits to a document and generates a suggestion at the cursor.
+
+    The document lock is only held while the edits are applied and the prompt is read, so the
+    next edits of the document do not wait for the model.
+
+    Args:
+        client_id (str): Who opened the document.
+        document_id (str): The open document.
+        cursor (int): Offset of the cursor in the document after the edits, in UTF-16 code units.
+        edits (list): Edits made since the last request, applied before the prompt is built.
+        version (int): The version the edits were made on.
+        is_correct (bool): Whether to generate a correct suggestion or one with a small error.
+
+    The other arguments are the same as for getSuggestion. Ollama reuses the context of the
+    previous prompt of the document, so only the text typed since is evaluated again.
+
+    Returns:
+        tuple: The suggestion, the injected bug or None, and the version of the document.
+    """
+    session = (client_id, document_id)
+    if edits:
+        version = document_store.edit(session, edits, version)
+
+    with document_store.document(session) as document:
+        if version is not None and not edits and version != document.version:
+            raise DocumentVersionError(document_id, document.version)
+        prompt = documentPrompt(document.table, cursor)
+        language = document.language
+        version = document.version
+
+    if not prompt:
+        raise BaseError("There is no code before the cursor")
+
+    if is_correct:
+        suggestion, bug = getSuggestion(prompt, client_id=client_id, document_id=document_id, **kwargs), None
+    else:
+        suggestion, bug = getBuggySuggestion(prompt, language, client_id=client_id, document_id=document_id, **kwargs)
+    return suggestion, bug, version
@@ -38,6 +38,81 @@ def log_suggestion(suggestion):
         print(f"Error logging suggestion: {e}")
         raise e
 
+def iter_suggestions(page_size=500, limit=None):
+    """
+    Streams the logged suggestions from the 'suggestions' table, newest first, one page at a time.
+
+    Args:
+        page_size (int): Rows fetched per request.
+        limit (int): Most rows returned, all of them if None.
+
+    Yields:
+        dict: The prompt, suggestion_text, has_bug, model and created_at of a suggestion.
+
+    Raises:
+        Exception: If there is an error fetching a page from the database.
+    """
+    start = 0
+    while limit is None or start < limit:
+        end = start + page_size if limit is None else min(start + page_size, limit)
+        try:
+            response = (
+                client.table("suggestions")
+                .select("prompt, suggestion_text, has_bug, model, created_at")
+                .order("created_at", desc=True)
+                .range(start, end - 1)
+                .execute()
+            )
+        except Exception as e:
+            print(f"Error fetching suggestions {start}-{end - 1}: {e}")
+            raise e
+
+        yield from response.data
+        if len(response.data) < end - start:
+            return
+        start = end
+
+async def log_event_async(db, event):
+    """
+    Non-blocking version of log_event used by the ASGI entry point.
+
+    Args:
+        db (httpx.AsyncClient): Client pointed at the Supabase REST API.
+        event (dict): The event to insert into the 'logs' table.
+    """
+    try:
+        response = await db.post("/logs", json=event)
+        response.raise_for_status()
+
+    except Exception as e:
+        print(f"Error logging event: {e}")
+        raise e
+
+
+async def log_suggestion_async(db, suggestion):
+    """
+    Non-blocking version of log_suggestion used by the ASGI entry point.
+
+    Args:
+        db (httpx.AsyncClient): Client pointed at the Supabase REST API.
+        suggestion (dict): The suggestion to insert into the 'suggestions' table.
+
+    Returns:
+        dict: The suggestion with the id assigned by the database.
+    """
+    try:
+        response = await db.post("/suggestions", json=suggestion)
+        response.raise_for_status()
+        rows = response.json()
+        if rows:
+            suggestion['id'] = rows[0]['id']
+            return suggestion
+        else:
+            raise Exception("No data returned from insert operation")
+    except Exception as e:
+        print(f"Error logging suggestion: {e}")
+        raise e
+
 def get_all_logs():
     """
     Retrieves all logs stored in the 'Logs' table.
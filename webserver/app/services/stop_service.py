@@ -0,0 +1,229 @@
+from app.services.bug_service import detectLanguage
+
+
+
+OPEN_BRACKETS = "(["
+CLOSE_BRACKETS = ")]"
+
+
+class BlockStopDetector:
+    """
+    Ends a streamed completion once it closes the block the cursor is in.
+
+    The prompt is scanned first to learn where the cursor is: inside which strings, brackets and
+    braces, and at which indentation. The completion is then fed in as it arrives, and the text
+    that may be shown is returned. Once stopped is set the rest of the generation is not needed.
+
+    - Python: the block ends at the first line indented less than the cursor's line, or not more
+      than the line that opened the block when the prompt ends with a colon. At the top level a
+      completion ends when a line at indentation 0 follows an indented body.
+    - JavaScript and other brace languages: the block ends with the line of the brace that closes
+      the block around the cursor. At the top level a completion ends with the line of the brace
+      that closes the block it opened.
+
+    Lines inside strings, comments and brackets are not counted, and nothing is cut before the
+    completion has produced some code.
+
+    Args:
+        prompt (str): The code before the cursor, as sent to the model.
+        language (str): Language of the code, guessed from the prompt if omitted.
+    """
+    def __init__(self, prompt: str, language: str = None):
+        self.language = language or detectLanguage(prompt)
+        self.python = self.language == "python"
+        self.stopped = False
+
+        self._quote = None  # the quote of the string being read, three characters for Python's long strings
+        self._quote_run = 0  # closing quotes of a long string seen in a row
+        self._comment = None  # "line" or "block"
+        self._escape = False
+        self._continued = False  # a Python line ended with a backslash
+        self._closed_empty = None  # a quote that just closed an empty string, the start of a long string
+        self._previous = ""
+        self._brackets = 0
+        self._braces = 0
+
+        for char in prompt:
+            self._scan(char)
+
+        self._content = False
+        self._held = ""
+        if self.python:
+            self._init_python(prompt)
+        else:
+            self._base_braces = self._braces
+            self._opened = False
+            self._closing = False
+
+    def feed(self, text: str) -> str:
+        """
+        Reads the next piece of the completion and returns the part of it that belongs to the block.
+        """
+        emitted = []
+        for char in text:
+            if self.stopped:
+                break
+            emitted.append(self._feed_python(char) if self.python else self._feed_braces(char))
+        return "".join(emitted)
+
+    def flush(self) -> str:
+        """
+        Returns the text held back at the end of the completion, once the model has finished.
+        """
+        held, self._held = self._held, ""
+        return "" if self.stopped else held
+
+    def _init_python(self, prompt: str):
+        lines = prompt.split("\n")
+        cursor_line = lines[-1]
+        code_lines = [line for line in lines if line.split("#")[0].strip()]
+        last_code = code_lines[-1] if code_lines else ""
+
+        if last_code.split("#")[0].rstrip().endswith(":"):
+            self._base = _indent(last_code)
+        elif cursor_line:
+            self._base = _indent(cursor_line) - 1
+        else:
+            self._base = _indent(last_code) - 1 if last_code else -1
+
+        self._top_level = self._base < 0
+        self._seen_body = False
+        # The completion starts a new line when the cursor is at the start of one
+        self._at_line_start = not cursor_line.strip() and self._in_code() and self._brackets <= 0
+        self._indent = _indent(cursor_line)
+
+    def _feed_python(self, char: str) -> str:
+        if self._at_line_start:
+            if char in " \t":
+                self._indent = self._indent + 4 - self._indent % 4 if char == "\t" else self._indent + 1
+                self._held += char
+                return ""
+            if char in "\r\n":
+                self._indent = 0
+                self._held += char
+                return ""
+
+            self._at_line_start = False
+            if char != "#":
+                dedented = self._indent <= self._base or (self._top_level and self._seen_body and self._indent == 0)
+                if dedented and self._content:
+                    self.stopped = True
+                    self._held = ""
+                    return ""
+                if self._indent > 0:
+                    self._seen_body = True
+
+        # A comment ends with its line, strings and brackets carry on to the next one
+        at_line_end = char == "\n" and self._quote is None and self._brackets <= 0 and not self._continued
+        self._scan(char)
+        if at_line_end:
+            self._at_line_start = True
+            self._indent = 0
+            self._held += char
+            return ""
+
+        if not char.isspace():
+            self._content = True
+        held, self._held = self._held, ""
+        return held + char
+
+    def _feed_braces(self, char: str) -> str:
+        if char == "\n" and self._closing:
+            # "} else {" reopens the block on the same line
+            if self._block_closed() and self._content:
+                self.stopped = True
+                return ""
+            self._closing = False
+
+        in_code = self._in_code()
+        self._scan(char)
+        if in_code and char == "}" and self._block_closed():
+            self._closing = True
+        elif in_code and char == "{":
+            self._opened = True
+
+        if not char.isspace():
+            self._content = True
+        return char
+
+    def _block_closed(self) -> bool:
+        return self._braces < self._base_braces or (self._base_braces == 0 and self._opened and self._braces == 0)
+
+    def _in_code(self) -> bool:
+        return self._quote is None and self._comment is None
+
+    def _scan(self, char: str):
+        # Tracks strings, comments and brackets one character at a time
+        previous, self._previous = self._previous, char
+        closed_empty, self._closed_empty = self._closed_empty, None
+
+        if self._comment == "line":
+            if char == "\n":
+                self._comment = None
+            return
+        if self._comment == "block":
+            if previous == "*" and char == "/":
+                self._comment = None
+                self._previous = ""
+            return
+
+        if self._quote is not None:
+            if self._escape:
+                self._escape = False
+                self._quote_run = 0
+            elif char == "\\":
+                self._escape = True
+                self._quote_run = 0
+            elif len(self._quote) == 3:
+                self._quote_run = self._quote_run + 1 if char == self._quote[0] else 0
+                if self._quote_run == 3:
+                    self._quote = None
+                    self._quote_run = 0
+            elif char == self._quote:
+                self._quote = None
+                self._closed_empty = char if previous == char else None
+            elif char == "\n" and self._quote != "`":
+                self._quote = None  # unterminated string
+            return
+
+        if self.python:
+            if char == "\\":
+                self._continued = True
+                return
+            if char != "\n":
+                self._continued = False
+            elif self._continued:
+                self._continued = False
+                return
+
+        if char in "'\"" or (char == "`" and not self.python):
+            if self.python and closed_empty == char:
+                self._quote = char * 3
+            else:
+                self._quote = char
+        elif self.python and char == "#":
+            self._comment = "line"
+        elif not self.python and previous == "/" and char == "/":
+            self._comment = "line"
+        elif not self.python and previous == "/" and char == "*":
+            self._comment = "block"
+            self._previous = ""
+        elif char in OPEN_BRACKETS or (self.python and char == "{"):
+            self._brackets += 1
+        elif char in CLOSE_BRACKETS or (self.python and char == "}"):
+            self._brackets -= 1
+        elif char == "{":
+            self._braces += 1
+        elif char == "}":
+            self._braces -= 1
+
+
+def _indent(line: str) -> int:
+    return len(line.expandtabs(4)) - len(line.expandtabs(4).lstrip())
+
+def trimCompletion(prompt: str, completion: str, language: str = None) -> str:
+    """
+    Cuts a finished completion after the block the cursor is in, see BlockStopDetector.
+    """
+    detector = BlockStopDetector(prompt, language)
+    return detector.feed(completion) + detector.flush()
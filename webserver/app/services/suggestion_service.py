@@ -1,30 +1,72 @@
-from app.controllers.ai import client, gemini_client, vendors, good_command, bad_command, OLLAMA_URL
-from app.models.errors import ModelError
-import requests
+from app.controllers.ai import client, gemini_client, ollama_client, vendors, good_command, bad_command, OLLAMA_URL
+from app.controllers.cache import suggestion_cache, prefix_index, similarity_index, completion_key
+from app.controllers.cascade import cascade_tracker
+from app.controllers.contexts import ollama_contexts
+from app.controllers.deadlines import request_monitor
+from app.controllers.disk_cache import disk_cache
+from app.controllers.executor import submit
+from app.controllers.hedging import hedge_tracker
+from app.controllers.prefetch import prefetcher
+from app.controllers.residency import model_residency
+from app.controllers.routing import vendor_router
+from app.controllers.scheduler import admission_scheduler
+from app.controllers.singleflight import suggestion_flights
+from app.services.log_service import iter_suggestions
+from app.services.bug_service import DEFINITION_KEYWORDS, LANGUAGES, detectLanguage, injectBug, tokenizeCode
+from app.services.stop_service import BlockStopDetector
+from app.models.cancellation import CancelToken
+from app.models.errors import ModelError, GenerationCancelledError, ModelColdError, QueueFullError, QueueTimeoutError, VendorUnavailableError
+from contextlib import closing
+from flask import current_app
+import codeop
+import difflib
+import json
+import keyword
+import math
+import random
+import re
+import threading
+import time
+import warnings
 
 
 
 def getSuggestion(
     prompt: str,
-    vendor: str = vendors.Ollama,
+    vendor: str = None,
     model_name: str = "codellama",
     temperature: float = 0.2,
     top_p: float = 1,
     top_k: int = 0,
     max_tokens: int = 256,
-    is_correct: bool = True
+    is_correct: bool = True,
+    hedge: bool = None,
+    client_id: str = None,
+    cancel: CancelToken = None,
+    document_id: str = None,
+    cascade: bool = None,
+    quality: str = None,
+    trace: dict = None
 ):
     """
     Handles suggestions from different models (OpenAI or Ollama) based on the provided model name.
     
     Args:
         prompt (str): The prompt (or piece of code) to generate suggestions from.
+        vendor (vendors): The vendor to use. If None the healthiest vendor in ROUTING_CANDIDATES is chosen.
         model_name (str): The model to use (either "openai" or "ollama").
         temperature (float): The temperature value to control randomness.
         top_p (float): The top_p value for sampling.
         top_k (int): The top_k value for sampling.
         max_tokens (int): The maximum number of tokens to generate.
         is_correct (bool): Whether to generate a correct suggestion or one with a small error.
+        hedge (bool): Send the prompt to a second vendor if the first one is slow. Defaults to SUGGESTION_HEDGING.
+        client_id (str): Who sent the request, models with a concurrency limit share their queue fairly between clients.
+        cancel (CancelToken): Stops the generation when cancelled. Its deadline bounds the vendor calls.
+        document_id (str): The document the prompt comes from. Ollama reuses the context of the client's previous prompt in it.
+        cascade (bool): Ignore vendor and model_name and try the CASCADE_TIERS from the cheapest up. Defaults to SUGGESTION_CASCADE.
+        quality (str): "high" skips the draft tier of the cascade.
+        trace (dict): In cascade mode its "tier" is set to the tier that answered, or to "cache".
         
     Returns:
         dict: A dictionary containing the suggestion response.
@@ -32,6 +74,1034 @@ def getSuggestion(
     Raises:
         Exception: If there is an error with the model API.
     """
+    if cascade is None:
+        cascade = current_app.config["SUGGESTION_CASCADE"]
+    if trace is None:
+        trace = {}
+
+    # Sampling at a high temperature is meant to vary, so those requests skip the cache
+    use_cache = temperature <= current_app.config["SUGGESTION_CACHE_MAX_TEMPERATURE"]
+    if cascade:
+        key = completion_key(normalizePrompt(prompt), "cascade", quality or "draft", is_correct, temperature, top_p, top_k, max_tokens)
+    else:
+        key = completion_key(normalizePrompt(prompt), vendor, model_name, is_correct, temperature, top_p, top_k, max_tokens)
+
+    if use_cache and cascade:
+        trace["tier"] = "cache"
+
+    if use_cache:
+        prefetched = prefetcher.get(key)
+        if prefetched is not None:
+            suggestion_cache.put(key, prefetched)
+            prefix_index.put(key, prefetched)
+            return prefetched
+
+        cached = suggestion_cache.get(key)
+        if cached is None:
+            cached = readDiskCache(key)
+        if cached is not None:
+            return cached
+
+        # The user may have typed the start of a completion we already generated
+        remaining = prefix_index.lookup(key)
+        if remaining is not None:
+            suggestion_cache.put(key, remaining)
+            return remaining
+
+    if hedge is None:
+        hedge = current_app.config["SUGGESTION_HEDGING"]
+
+    # Prompts that only differ from a recent one in names, comments or whitespace can reuse its completion
+    similar = use_cache and current_app.config["SUGGESTION_SIMILARITY"]
+    if similar:
+        shingles, tail, tokens = promptFeatures(prompt)
+        signature = similarity_index.signature(shingles)
+
+    def generate(cancel=cancel):
+        params = dict(
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            max_tokens=max_tokens,
+            is_correct=is_correct,
+            client_id=client_id,
+            cancel=cancel,
+            session=(client_id, document_id) if document_id else None
+        )
+        if cascade:
+            response = cascadeSuggestion(prompt, quality=quality, trace=trace, **params)
+        else:
+            response = routeSuggestion(prompt, vendor=vendor, model_name=model_name, hedge=hedge, **params)
+
+        if use_cache:
+            suggestion_cache.put(key, response)
+            prefix_index.put(key, response)
+            writeDiskCache(key, response)
+        if similar and isinstance(response, str):
+            similarity_index.put(key, key[1:], signature, tail, (tokens, response))
+
+        return response
+
+    if not use_cache:
+        return generate()
+
+    if similar:
+        reused = reuseSimilarSuggestion(prompt, key[1:], signature, tail, tokens, check_syntax=is_correct)
+        if reused is not None:
+            suggestion_cache.put(key, reused)
+            if random.random() < current_app.config["SUGGESTION_SIMILARITY_AUDIT_RATE"]:
+                submit(auditSimilarSuggestion, reused, generate, detectLanguage(prompt))
+            if cascade:
+                trace["tier"] = "similar"
+            return reused
+
+    # Identical requests that arrive while this one is generating wait for its result
+    led = []
+
+    def lead():
+        led.append(True)
+        return generate()
+
+    try:
+        response = suggestion_flights.do(key, lead, cancel=cancel)
+        if cascade and not led:
+            trace["tier"] = "coalesced"
+        return response
+    except GenerationCancelledError:
+        # The request we waited for was cancelled by its own client, ours still wants an answer
+        if not led and (cancel is None or not cancel.cancelled):
+            return generate()
+        raise
+
+def routingCandidates(model_name: str):
+    """
+    Returns the (vendor, model) pairs that may answer a request, in the configured priority order.
+
+    Entries of ROUTING_CANDIDATES look like "openai:gpt-4o-mini". Without a model the requested
+    model_name is used. Vendors without an API key are skipped.
+    """
+    return parseBackends(current_app.config["ROUTING_CANDIDATES"], model_name)
+
+def parseBackends(entries: list, model_name: str = None):
+    """
+    Turns "vendor:model" entries into (vendor, model) pairs, skipping vendors without an API key.
+    """
+    config = current_app.config
+    backends = []
+    for entry in entries:
+        name, _, model = entry.partition(":")
+        vendor = vendors(name)
+        if vendor == vendors.OpenAI and not config["OPENAI_API_KEY"]:
+            continue
+        if vendor == vendors.Google and not config["GEMINI_API_KEY"]:
+            continue
+        backends.append((vendor, model or model_name))
+    return backends
+
+def routeSuggestion(prompt: str, vendor: str = None, model_name: str = "codellama", hedge: bool = False, **kwargs):
+    """
+    Sends the prompt to the given vendor, or to the healthiest routing candidate if vendor is None.
+
+    If the chosen backend fails, the next one whose circuit breaker allows it is tried.
+
+    Raises:
+        VendorUnavailableError: If every candidate's circuit is open.
+    """
+    if vendor is not None:
+        backends = [(vendor, model_name)]
+    else:
+        backends = vendor_router.rank(routingCandidates(model_name))
+
+    last_error = None
+    for backend_vendor, backend_model in backends:
+        # Asked right before the attempt, since a half open backend's single probe is taken by allow()
+        if vendor is None and not vendor_router.allow(backend_vendor, backend_model):
+            continue
+        try:
+            return (hedgeSuggestion if hedge else timedDispatchSuggestion)(
+                prompt, vendor=backend_vendor, model_name=backend_model, **kwargs
+            )
+        except GenerationCancelledError:
+            raise
+        except Exception as e:
+            last_error = e
+            print(f"{getattr(backend_vendor, 'value', backend_vendor)}/{backend_model} failed: {e}")
+
+    if last_error is not None:
+        raise last_error
+    raise VendorUnavailableError()
+
+def cascadeSuggestion(prompt: str, quality: str = None, is_correct: bool = True, trace: dict = None, **kwargs):
+    """
+    Asks the CASCADE_TIERS in order, from the cheapest model up, until one gives a usable answer.
+
+    A tier's answer is passed on to the next tier when the cheap checks of draftProblem reject it or
+    the tier fails. The last tier's answer is always used. With quality "high" the first tier is skipped.
+
+    Args:
+        prompt (str): The prompt (or piece of code) to generate suggestions from.
+        quality (str): "high" to start at the second tier.
+        is_correct (bool): Whether to generate a correct suggestion or one with a small error.
+        trace (dict): Its "tier" is set to the "vendor/model" that answered.
+
+    The other arguments are passed on to routeSuggestion.
+
+    Raises:
+        VendorUnavailableError: If no tier is configured.
+        Exception: The error of the last tier, if it failed.
+    """
+    tiers = parseBackends(current_app.config["CASCADE_TIERS"])
+    if quality == "high" and len(tiers) > 1:
+        tiers = tiers[1:]
+    if not tiers:
+        raise VendorUnavailableError()
+
+    language = detectLanguage(prompt)
+    for index, (vendor, model_name) in enumerate(tiers):
+        tier = f"{vendor.value}/{model_name}"
+        last = index == len(tiers) - 1
+        start = time.monotonic()
+        try:
+            response = routeSuggestion(prompt, vendor=vendor, model_name=model_name, is_correct=is_correct, **kwargs)
+        except GenerationCancelledError:
+            raise
+        except Exception as e:
+            cascade_tracker.record_attempt(tier, time.monotonic() - start, "error")
+            if last:
+                raise
+            print(f"Cascade tier {tier} failed, escalating: {e}")
+            continue
+
+        problem = None if last else draftProblem(prompt, response, language, check_syntax=is_correct)
+        cascade_tracker.record_attempt(tier, time.monotonic() - start, problem)
+        if problem is None:
+            if trace is not None:
+                trace["tier"] = tier
+            return response
+        print(f"Cascade tier {tier} escalated: {problem}")
+
+def draftProblem(prompt: str, completion: str, language: str = None, check_syntax: bool = True):
+    """
+    Runs the cheap checks on a draft completion.
+
+    Returns:
+        str: "empty", "repetition" or "syntax" for the first check that fails, or None if the draft looks usable.
+    """
+    if not completion or not completion.strip():
+        return "empty"
+    if repeatsPrompt(prompt, completion):
+        return "repetition"
+    if check_syntax and not completionParses(prompt, completion, language or detectLanguage(prompt)):
+        return "syntax"
+    return None
+
+def repeatsPrompt(prompt: str, completion: str) -> bool:
+    """
+    Returns whether at least half of the completion's lines copy lines from the end of the prompt.
+    """
+    return promptOverlap(prompt, completion) >= 0.5
+
+def promptOverlap(prompt: str, completion: str, window: int = 50) -> float:
+    """
+    Returns the share of the completion's lines that copy one of the last window lines of the prompt.
+    """
+    lines = [line.strip() for line in completion.splitlines() if len(line.strip()) > 3]
+    if not lines:
+        return 0.0
+    recent = {line.strip() for line in prompt.splitlines()[-window:]}
+    return sum(line in recent for line in lines) / len(lines)
+
+def completionParses(prompt: str, completion: str, language: str) -> bool:
+    """
+    Returns whether the prompt followed by the completion is valid or incomplete code.
+
+    Prompts that are invalid by themselves, for example because they were trimmed in the middle
+    of a block, are not held against the completion.
+    """
+    check = _pythonParses if language == "python" else _bracketsMatch
+    return check(prompt + completion) or not check(prompt)
+
+def _pythonParses(code: str) -> bool:
+    # compile_command returns None for code that is valid so far but incomplete
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            codeop.compile_command(code, symbol="exec")
+        return True
+    except (SyntaxError, ValueError, OverflowError):
+        return False
+
+def _bracketsMatch(code: str) -> bool:
+    # Every closing bracket closes the most recent open one, open ones may be left for later
+    pairs = {")": "(", "]": "[", "}": "{"}
+    stack = []
+    for kind, text, _, _ in tokenizeCode(code, "javascript"):
+        if kind != "op":
+            continue
+        if text in "([{":
+            stack.append(text)
+        elif text in pairs:
+            if not stack or stack.pop() != pairs[text]:
+                return False
+    return True
+
+def timedDispatchSuggestion(
+    prompt: str,
+    vendor: str = vendors.Ollama,
+    model_name: str = "codellama",
+    client_id: str = None,
+    speculative: bool = False,
+    **kwargs
+):
+    """
+    Waits for a concurrency slot of the model, then calls dispatchSuggestion and records how long
+    the vendor took and whether it failed.
+
+    The latency feeds the hedging delay and, with the outcome, the vendor router. Speculative calls
+    only run on a free slot and must pass a cancel token, which is cancelled when a real request needs the slot.
+    Their outcomes are left out of the router and the hedging delay, which describe what real requests see.
+    The time a cancelled generation ran before it was stopped is counted as wasted.
+    """
+    cancel = kwargs.get("cancel")
+    start = time.monotonic()
+    running = False
+    try:
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        with admission_scheduler.slot(vendor, model_name, client_id, cancel=cancel, speculative=speculative):
+            start = time.monotonic()
+            running = True
+            response = dispatchSuggestion(prompt, vendor=vendor, model_name=model_name, **kwargs)
+    except GenerationCancelledError as e:
+        if not speculative:
+            vendor_router.release(vendor, model_name)
+        if running:
+            request_monitor.record_cancelled(e.message, time.monotonic() - start)
+        raise
+    except (ModelColdError, QueueFullError, QueueTimeoutError):
+        # None of these says anything about the health of the backend
+        if not speculative:
+            vendor_router.release(vendor, model_name)
+        raise
+    except Exception:
+        if not speculative:
+            vendor_router.record(vendor, model_name, time.monotonic() - start, ok=False)
+        raise
+
+    elapsed = time.monotonic() - start
+    if not speculative:
+        vendor_router.record(vendor, model_name, elapsed, ok=True)
+        hedge_tracker.record_latency(vendor, model_name, elapsed)
+    return response
+
+def hedgeSuggestion(
+    prompt: str,
+    vendor: str = vendors.Ollama,
+    model_name: str = "codellama",
+    temperature: float = 0.2,
+    top_p: float = 1,
+    top_k: int = 0,
+    max_tokens: int = 256,
+    is_correct: bool = True,
+    client_id: str = None,
+    cancel: CancelToken = None,
+    session: tuple = None
+):
+    """
+    Sends the prompt to a backup vendor if the primary one has not answered within the hedging delay.
+
+    The primary call runs on the current thread. Once the delay (a fixed HEDGE_DELAY or the recent
+    latency percentile of the primary model) has passed, the same prompt goes to HEDGE_VENDOR. Whichever
+    answers first is returned and the other generation is cancelled. If the primary call fails, the
+    backup answer is used. Cancelling cancel stops both generations.
+
+    Takes the same arguments as getSuggestion.
+    """
+    config = current_app.config
+    backup_vendor = vendors(config["HEDGE_VENDOR"])
+    backup_model = config["HEDGE_MODEL"]
+    params = dict(
+        temperature=temperature,
+        top_p=top_p,
+        top_k=top_k,
+        max_tokens=max_tokens,
+        is_correct=is_correct,
+        client_id=client_id,
+        session=session
+    )
+
+    primary_cancel = CancelToken(parent=cancel)
+    backup_cancel = CancelToken(parent=cancel)
+    backup = {}
+    lock = threading.Lock()
+
+    def backup_done(future):
+        # The backup answered first, stop waiting for the primary
+        if not future.cancelled() and future.exception() is None:
+            primary_cancel.cancel("Backup vendor answered first")
+
+    app = current_app._get_current_object()
+
+    def start_backup():
+        # Runs on the timer thread, which has no app context of its own
+        with app.app_context(), lock:
+            if "future" in backup or backup_cancel.cancelled:
+                return
+            backup["future"] = submit(
+                timedDispatchSuggestion, prompt, vendor=backup_vendor, model_name=backup_model, cancel=backup_cancel, **params
+            )
+        backup["future"].add_done_callback(backup_done)
+
+    timer = threading.Timer(hedge_tracker.delay(vendor, model_name), start_backup)
+    timer.daemon = True
+    timer.start()
+
+    try:
+        response = timedDispatchSuggestion(prompt, vendor=vendor, model_name=model_name, cancel=primary_cancel, **params)
+
+    except Exception as e:
+        timer.cancel()
+        # The request itself was cancelled, there is nobody to answer with a backup
+        if cancel is not None and cancel.cancelled:
+            raise
+        if not isinstance(e, GenerationCancelledError):
+            print(f"Primary vendor failed, waiting for the backup: {e}")
+        start_backup()
+        if "future" not in backup:
+            raise
+        response = backup["future"].result()
+        hedge_tracker.record_result(backup_vendor, hedged=True)
+        return response
+
+    timer.cancel()
+    with lock:
+        hedged = "future" in backup
+        backup_cancel.cancel("Primary vendor answered first")
+    hedge_tracker.record_result(vendor, hedged=hedged)
+    return response
+
+def getSuggestions(
+    prompt: str,
+    n: int = 3,
+    vendor: str = None,
+    model_name: str = "codellama",
+    temperature: float = 0.2,
+    top_p: float = 1,
+    top_k: int = 0,
+    max_tokens: int = 256,
+    client_id: str = None,
+    cancel: CancelToken = None
+):
+    """
+    Generates n alternative suggestions with a single upstream call, deduplicated and best first.
+
+    OpenAI returns the candidates as choices of one request. Ollama has no such option, so n
+    requests with different seeds run at the same time and share one concurrency slot.
+
+    Args:
+        n (int): Number of candidates to generate.
+
+    The other arguments are the same as for getSuggestion.
+
+    Returns:
+        list[str]: Up to n distinct suggestions, ranked by rankCandidates.
+    """
+    use_cache = temperature <= current_app.config["SUGGESTION_CACHE_MAX_TEMPERATURE"]
+    key = completion_key(normalizePrompt(prompt), vendor, model_name, True, temperature, top_p, top_k, max_tokens) + (n,)
+
+    if use_cache:
+        cached = suggestion_cache.get(key)
+        if cached is None:
+            cached = readDiskCache(key)
+        if cached is not None:
+            return cached
+
+    def generate():
+        candidates = routeSuggestion(
+            prompt,
+            vendor=vendor,
+            model_name=model_name,
+            temperature=temperature,
+            top_p=top_p,
+            top_k=top_k,
+            max_tokens=max_tokens,
+            client_id=client_id,
+            cancel=cancel,
+            n=n
+        )
+        ranked = rankCandidates(prompt, candidates)
+        if use_cache:
+            suggestion_cache.put(key, ranked)
+            writeDiskCache(key, ranked)
+        return ranked
+
+    if not use_cache:
+        return generate()
+    return suggestion_flights.do(key, generate, cancel=cancel)
+
+def rankCandidates(prompt: str, candidates: list, language: str = None):
+    """
+    Removes duplicate and empty candidates and orders the rest from best to worst.
+
+    Candidates that parse after the prompt come first, then the ones that copy the fewest lines of
+    the prompt, then the shorter ones. Duplicates only differ in trailing whitespace.
+    """
+    language = language or detectLanguage(prompt)
+    seen = set()
+    unique = []
+    for candidate in candidates:
+        normalized = "\n".join(line.rstrip() for line in candidate.strip("\n").splitlines())
+        if normalized.strip() and normalized not in seen:
+            seen.add(normalized)
+            unique.append(candidate)
+
+    if not unique:
+        return candidates[:1]
+
+    return sorted(unique, key=lambda candidate: (
+        not completionParses(prompt, candidate, language),
+        round(promptOverlap(prompt, candidate), 1),
+        len(candidate.strip()),
+    ))
+
+def getSuggestionPair(
+    prompt: str,
+    vendor: str = None,
+    model_name: str = "codellama",
+    temperature: float = 0.2,
+    top_p: float = 1,
+    top_k: int = 0,
+    max_tokens: int = 256,
+    hedge: bool = None,
+    client_id: str = None,
+    language: str = None,
+    cancel: CancelToken = None,
+    document_id: str = None,
+    cascade: bool = None,
+    quality: str = None,
+    trace: dict = None
+):
+    """
+    Generates the correct and the buggy suggestion for a prompt.
+
+    With BUG_INJECTION set to "local" only the correct suggestion is generated and the bug is
+    injected into a copy of it. Otherwise both generations run in parallel on the shared thread
+    pool, so the call takes as long as the slower of the two instead of their sum.
+
+    Args:
+        language (str): Language of the code, guessed from the prompt if omitted.
+
+    The other arguments are the same as for getSuggestion.
+
+    Returns:
+        tuple: The correct and the buggy suggestion as a list, and the injected bug or None if the model wrote it.
+
+    Raises:
+        Exception: If either generation fails.
+    """
+    params = dict(
+        vendor=vendor,
+        model_name=model_name,
+        temperature=temperature,
+        top_p=top_p,
+        top_k=top_k,
+        max_tokens=max_tokens,
+        hedge=hedge,
+        client_id=client_id,
+        cancel=cancel,
+        document_id=document_id,
+        cascade=cascade,
+        quality=quality,
+        trace=trace
+    )
+
+    if current_app.config["BUG_INJECTION"] == "local":
+        correct = getSuggestion(prompt, is_correct=True, **params)
+        buggy, bug = injectBugIntoSuggestion(prompt, correct, language)
+        if bug is None:
+            buggy = getSuggestion(prompt, is_correct=False, **params)
+        return [correct, buggy], bug
+
+    futures = [submit(getSuggestion, prompt, is_correct=is_correct, **params) for is_correct in (True, False)]
+    return [future.result() for future in futures], None
+
+def getBuggySuggestion(prompt: str, language: str = None, **kwargs):
+    """
+    Generates a suggestion with a small bug in it.
+
+    With BUG_INJECTION set to "local" a correct suggestion is generated, or taken from the cache,
+    and the bug is injected locally. Otherwise, or if no mutation applies to the suggestion, the
+    model is asked for a buggy one.
+
+    Args:
+        prompt (str): The prompt (or piece of code) to generate suggestions from.
+        language (str): Language of the code, guessed from the prompt if omitted.
+
+    The other arguments are the same as for getSuggestion, except is_correct.
+
+    Returns:
+        tuple: The buggy suggestion and the injected bug, or None if the model wrote it.
+    """
+    if current_app.config["BUG_INJECTION"] == "local":
+        correct = getSuggestion(prompt, is_correct=True, **kwargs)
+        buggy, bug = injectBugIntoSuggestion(prompt, correct, language)
+        if bug is not None:
+            return buggy, bug
+
+    return getSuggestion(prompt, is_correct=False, **kwargs), None
+
+def injectBugIntoSuggestion(prompt: str, suggestion: str, language: str = None):
+    """
+    Injects a bug into a correct suggestion. The same suggestion always gets the same bug.
+
+    Returns:
+        tuple: The buggy suggestion and a description of the bug, or the suggestion and None if
+        the language is not supported or nothing in the suggestion can be mutated.
+    """
+    language = language or detectLanguage(prompt + suggestion)
+    if language not in LANGUAGES:
+        return suggestion, None
+
+    buggy, bug = injectBug(suggestion, language=language)
+    if bug is not None:
+        print(f"Injected {bug['mutation']} into line {bug['line']}: {bug['original']} -> {bug['replacement']}")
+    return buggy, bug
+
+def prefetchSuggestions(
+    prompt: str,
+    model_name: str = "codellama",
+    temperature: float = 0.2,
+    top_p: float = 1,
+    top_k: int = 0,
+    max_tokens: int = 256,
+    client_id: str = None
+):
+    """
+    Starts speculative generations for the prompts the client is likely to send next.
+
+    They run on PREFETCH_VENDOR only when the model has a free slot, and their results are kept for
+    PREFETCH_TTL seconds, where getSuggestion looks first. Takes the same arguments as getSuggestion.
+
+    Returns:
+        int: The number of generations started.
+    """
+    # Requests above this temperature skip the caches, so their prefetches would never be used
+    if temperature > current_app.config["SUGGESTION_CACHE_MAX_TEMPERATURE"]:
+        return 0
+
+    # A backend that is failing or being probed gets no speculative traffic
+    vendor = vendors(current_app.config["PREFETCH_VENDOR"])
+    if not vendor_router.closed(vendor, model_name):
+        return 0
+
+    params = dict(temperature=temperature, top_p=top_p, top_k=top_k, max_tokens=max_tokens, is_correct=True)
+
+    jobs = {}
+    for candidate in prefetchPrompts(prompt):
+        # Keyed like a /suggestion request, which leaves the vendor to the router
+        key = completion_key(normalizePrompt(candidate), None, model_name, True, temperature, top_p, top_k, max_tokens)
+        if suggestion_cache.contains(key):
+            continue
+
+        jobs[key] = lambda cancel, candidate=candidate: timedDispatchSuggestion(
+            candidate, vendor=vendor, model_name=model_name, client_id=client_id, speculative=True, cancel=cancel, **params
+        )
+
+    return prefetcher.prefetch(client_id, jobs)
+
+# Names kept as they are when a prompt is normalized for the similarity index, every other name becomes "ID"
+JS_KEYWORDS = {
+    "async", "await", "break", "case", "catch", "class", "const", "continue", "default", "delete", "do",
+    "else", "export", "extends", "false", "finally", "for", "function", "if", "import", "in", "instanceof",
+    "let", "new", "null", "of", "return", "super", "switch", "this", "throw", "true", "try", "typeof",
+    "undefined", "var", "void", "while", "yield",
+}
+SIMILARITY_KEYWORDS = {"python": set(keyword.kwlist), "javascript": JS_KEYWORDS}
+SHINGLE_SIZE = 3
+HASH_MASK = (1 << 64) - 1
+
+def promptFeatures(prompt: str, language: str = None, max_tokens: int = 512):
+    """
+    Normalizes a prompt for the similarity index.
+
+    Comments and whitespace are dropped, strings become "STR" and names other than keywords
+    become "ID". The last max_tokens tokens, the ones nearest to the cursor, are split into
+    overlapping shingles of SHINGLE_SIZE tokens. The tail is what has to match exactly for a
+    completion to fit: the normalized tokens of the last line with code, and whether the cursor is
+    still on that line or on a new line with the same indentation. Other names on that line are
+    renamed by adaptCompletion ("for n in nums:" and "for n in values:" share a body), but the
+    names of defined functions and classes are kept, since they say what the body does
+    ("def add(a, b):" and "def sub(a, b):" need different bodies).
+
+    Returns:
+        tuple: The set of shingle hashes, the tail and the (normalized, original) tokens.
+    """
+    language = language or detectLanguage(prompt)
+    keywords = SIMILARITY_KEYWORDS.get(language, JS_KEYWORDS)
+
+    # Only the lines that can hold the last max_tokens tokens are read, tokenizing is the slow part
+    if len(prompt) > max_tokens * 6:
+        start = prompt.find("\n", len(prompt) - max_tokens * 6)
+        prompt = prompt[start + 1:] if 0 <= start < len(prompt) - 1 else prompt[-max_tokens * 6:]
+
+    tokens = []
+    line_start, last_end = 0, 0
+    for kind, text, start, end in tokenizeCode(prompt, language):
+        if kind not in ("name", "number", "op", "string"):
+            continue
+        if kind == "name":
+            normalized = text if text in keywords else "ID"
+        else:
+            normalized = "STR" if kind == "string" else text
+        if prompt.rfind("\n", last_end, start) >= 0:
+            line_start = len(tokens)
+        tokens.append((normalized, text))
+        last_end = end
+
+    after = prompt[last_end:] if tokens else prompt
+    cursor = ("next line", after[after.rfind("\n") + 1:]) if "\n" in after else ("same line", after)
+    line = tokens[line_start:]
+    tail = (tuple(
+        text if index and line[index - 1][1] in DEFINITION_KEYWORDS else normalized
+        for index, (normalized, text) in enumerate(line)
+    ), cursor)
+
+    tokens = tokens[-max_tokens:]
+    normalized = [token for token, _ in tokens]
+    shingles = {
+        hash(tuple(normalized[i:i + SHINGLE_SIZE])) & HASH_MASK
+        for i in range(max(1, len(normalized) - SHINGLE_SIZE + 1))
+    } if normalized else set()
+    return shingles, tail, tokens
+
+def adaptCompletion(cached_tokens: list, tokens: list, completion: str, language: str) -> str:
+    """
+    Renames the identifiers of a completion reused from a similar prompt to the names the new prompt uses.
+
+    The normalized tokens of both prompts are aligned, and every name that lines up with a
+    different name in all matching places is renamed in the completion. Names that line up with
+    more than one name are left as they are.
+    """
+    matcher = difflib.SequenceMatcher(None, [t for t, _ in cached_tokens], [t for t, _ in tokens], autojunk=False)
+    renames, conflicts = {}, set()
+    for block in matcher.get_matching_blocks():
+        for i in range(block.size):
+            normalized, old = cached_tokens[block.a + i]
+            new = tokens[block.b + i][1]
+            if normalized != "ID":
+                continue
+            if renames.setdefault(old, new) != new:
+                conflicts.add(old)
+
+    renames = {old: new for old, new in renames.items() if old != new and old not in conflicts}
+    if not renames:
+        return completion
+
+    parts, position = [], 0
+    for kind, text, start, end in tokenizeCode(completion, language):
+        if kind == "name" and text in renames:
+            parts.append(completion[position:start])
+            parts.append(renames[text])
+            position = end
+    parts.append(completion[position:])
+    return "".join(parts)
+
+def reuseSimilarSuggestion(prompt: str, params: tuple, signature: tuple, tail: tuple, tokens: list, check_syntax: bool = True):
+    """
+    Returns the completion of the most similar recent prompt, adapted to this prompt, or None.
+
+    A completion that fails the cheap draft checks once adapted, for example because it no
+    longer parses after the new prompt, is not reused.
+    """
+    match = similarity_index.lookup(params, signature, tail)
+    if match is None:
+        return None
+
+    (cached_tokens, completion), similarity = match
+    language = detectLanguage(prompt)
+    adapted = adaptCompletion(cached_tokens, tokens, completion, language)
+    problem = draftProblem(prompt, adapted, language, check_syntax)
+    if problem is not None:
+        print(f"Not reusing the completion of a similar prompt: {problem}")
+        similarity_index.record_rejected()
+        return None
+
+    print(f"Reusing the completion of a prompt with similarity {similarity:.2f}")
+    return adapted
+
+def auditSimilarSuggestion(reused: str, generate, language: str):
+    """
+    Generates the completion of a prompt that was answered from the similarity index and counts a
+    false reuse if it differs from the reused one. The fresh completion replaces the reused one in the caches.
+    """
+    try:
+        fresh = generate(None)
+    except Exception as e:
+        print(f"Could not audit a reused completion: {e}")
+        return
+
+    matcher = difflib.SequenceMatcher(
+        None,
+        [text for kind, text, _, _ in tokenizeCode(reused, language) if kind != "comment"],
+        [text for kind, text, _, _ in tokenizeCode(fresh, language) if kind != "comment"],
+        autojunk=False
+    )
+    similarity_index.record_audit(matcher.ratio() < current_app.config["SUGGESTION_SIMILARITY_THRESHOLD"])
+
+def prefetchPrompts(prompt: str):
+    """
+    Guesses the next prompts of a client: the current one, for when the user pauses at the end of
+    the line, and the start of the next line, for when they press enter.
+    """
+    prompts = [prompt]
+    line = prompt.rsplit("\n", 1)[-1]
+    if line.strip():
+        indent = line[:len(line) - len(line.lstrip())]
+        if line.rstrip().endswith((":", "{", "(", "[")):
+            indent += "\t" if indent.startswith("\t") else "    "
+        prompts.append(prompt.rstrip() + "\n" + indent)
+    return prompts
+
+def warmSuggestionCache(limit: int = None, page_size: int = None, order: str = None, disk: bool = None, window: int = None) -> int:
+    """
+    Preloads the suggestion cache with the prompt/completion pairs logged in the suggestions table.
+
+    The table does not store the sampling parameters, so the pairs are cached under the defaults
+    of /suggestion, which almost every request uses, with the vendor left to routing. Buggy
+    suggestions are cached for requests with isCorrect set to false.
+
+    With order "recent" the newest pairs are preferred, with "frequent" the prompts logged most
+    often among all the rows of the window. Pairs are stored from the least to the most preferred,
+    so the preferred ones are the last to be evicted when there are more pairs than the cache holds.
+
+    Pairs go to the disk cache when it is on. Otherwise they are kept in the in-memory caches for
+    CACHE_WARMUP_TTL seconds instead of the few minutes generated completions are.
+
+    Args:
+        limit (int): Most completions stored. Defaults to CACHE_WARMUP_LIMIT.
+        page_size (int): Rows fetched per request. Defaults to CACHE_WARMUP_PAGE_SIZE.
+        order (str): "recent" or "frequent". Defaults to CACHE_WARMUP_ORDER.
+        disk (bool): Store the pairs in the disk cache, shared by all workers, instead of the in-memory caches.
+            Defaults to whether the disk cache is on.
+        window (int): Rows read from the table, newest first. Defaults to CACHE_WARMUP_WINDOW.
+
+    Returns:
+        int: Number of completions stored.
+    """
+    config = current_app.config
+    limit = config["CACHE_WARMUP_LIMIT"] if limit is None else limit
+    page_size = config["CACHE_WARMUP_PAGE_SIZE"] if page_size is None else page_size
+    order = config["CACHE_WARMUP_ORDER"] if order is None else order
+    window = config["CACHE_WARMUP_WINDOW"] if window is None else window
+    disk = bool(disk_cache) if disk is None else disk
+    start = time.monotonic()
+
+    pairs = {}  # key -> [times logged, newest completion, position of the newest row]
+    rows = 0
+    for rows, row in enumerate(iter_suggestions(page_size, window), start=1):
+        # The newest pairs are known once limit of them were read, frequencies need the whole window
+        if order != "frequent" and len(pairs) >= limit:
+            break
+        prompt, completion = row.get("prompt"), row.get("suggestion_text")
+        if not prompt or not isinstance(completion, str) or not completion.strip():
+            continue
+
+        key = completion_key(normalizePrompt(prompt), None, row.get("model") or "codellama", not row.get("has_bug"), 0.2, 1, 0, 256)
+        pair = pairs.get(key)
+        if pair is None:
+            pairs[key] = [1, completion, rows]
+        else:
+            pair[0] += 1
+
+    if order == "frequent":
+        ranked = sorted(pairs.items(), key=lambda item: (item[1][0], -item[1][2]))
+    else:
+        ranked = sorted(pairs.items(), key=lambda item: -item[1][2])
+    ranked = ranked[len(ranked) - limit:] if limit > 0 else []
+
+    for key, (_, completion, _) in ranked:
+        if disk:
+            disk_cache.put(key, completion)
+        else:
+            suggestion_cache.put(key, completion, ttl=config["CACHE_WARMUP_TTL"])
+            prefix_index.put(key, completion, ttl=config["CACHE_WARMUP_TTL"])
+
+    seconds = time.monotonic() - start
+    current_app.extensions["cache_warmup"] = {"rows": rows, "loaded": len(ranked), "order": order, "disk": disk, "seconds": round(seconds, 3)}
+    print(f"Warmed the {'disk' if disk else 'suggestion'} cache with {len(ranked)} completions from {rows} logged suggestions in {seconds:.1f}s")
+    return len(ranked)
+
+def startCacheWarmup(app):
+    """
+    Warms the suggestion cache of app in the background so startup is not blocked on the database.
+    """
+    def run():
+        with app.app_context():
+            try:
+                warmSuggestionCache()
+            except Exception as e:
+                print(f"Warning: could not warm the suggestion cache: {e}")
+
+    threading.Thread(target=run, name="cache-warm-up", daemon=True).start()
+
+def readDiskCache(key: tuple):
+    """
+    Returns the completion stored for key in the disk cache, or None if it is missing or the disk cache is off.
+    A completion found on disk is copied to the in-memory caches.
+    """
+    if not disk_cache:
+        return None
+
+    value = disk_cache.get(key)
+    if value is not None:
+        suggestion_cache.put(key, value)
+        prefix_index.put(key, value)
+    return value
+
+def writeDiskCache(key: tuple, value):
+    """
+    Stores a completion in the disk cache, if it is on, so other workers and later runs can reuse it.
+    """
+    if disk_cache:
+        disk_cache.put(key, value)
+
+def normalizePrompt(prompt: str):
+    """
+    Normalizes a prompt for cache lookups.
+
+    Line endings are unified and trailing whitespace is removed from every line except the
+    last one, since only the text right before the cursor changes what should come next.
+    """
+    lines = prompt.replace("\r\n", "\n").split("\n")
+    return "\n".join([line.rstrip() for line in lines[:-1]] + lines[-1:])
+
+# Approximate characters per token of each model family's tokenizer on source code
+CHARS_PER_TOKEN = {
+    "gpt-4o": 4.0,
+    "gpt-4": 3.7,
+    "gpt-3.5": 3.7,
+    "codellama": 3.2,
+    "llama": 3.5,
+    "starcoder": 3.4,
+    "gemini": 4.0,
+    "learnlm": 4.0,
+}
+
+# Comments, imports and blank lines at the top of a file
+HEADER_LINE = re.compile(r"^\s*($|#|//|/\*|\*|\"\"\"|\'\'\'|import\b|from\b|using\b|package\b|require\b|use\b)")
+
+def charsPerToken(model_name: str) -> float:
+    # Longest matching prefix, so "gpt-4o-mini" is not estimated as "gpt-4"
+    for prefix in sorted(CHARS_PER_TOKEN, key=len, reverse=True):
+        if model_name.startswith(prefix):
+            return CHARS_PER_TOKEN[prefix]
+    return 3.3
+
+def estimateTokens(text: str, model_name: str) -> int:
+    """
+    Estimates how many tokens the model's tokenizer splits text into.
+    """
+    return math.ceil(len(text) / charsPerToken(model_name))
+
+def promptBudget(model_name: str) -> int:
+    """
+    Returns the prompt token budget of a model from PROMPT_TOKEN_BUDGETS, or PROMPT_DEFAULT_TOKEN_BUDGET.
+    """
+    budgets = current_app.config["PROMPT_TOKEN_BUDGETS"]
+    default = current_app.config["PROMPT_DEFAULT_TOKEN_BUDGET"]
+    return budgets.get(model_name, budgets.get(model_name.split(":")[0], default))
+
+def shapePrompt(prompt: str, model_name: str, budget: int = None):
+    """
+    Trims a prompt to the token budget of the model.
+
+    The cursor is at the end of the prompt, so the lines nearest to it are kept. The comments and
+    imports at the top of the file are kept too, as long as they fit in a quarter of the budget.
+    Lines in between are dropped, starting with the ones furthest from the cursor.
+
+    Args:
+        prompt (str): The code before the cursor.
+        model_name (str): The model the prompt is sent to.
+        budget (int): Maximum number of prompt tokens. Defaults to the budget of the model.
+
+    Returns:
+        str: The prompt, trimmed if it was over the budget.
+    """
+    budget = promptBudget(model_name) if budget is None else budget
+    before = estimateTokens(prompt, model_name)
+    if before <= budget:
+        return prompt
+
+    lines = prompt.splitlines(keepends=True)
+
+    header = []
+    header_tokens = 0
+    for line in lines[:min(current_app.config["PROMPT_HEADER_LINES"], len(lines) - 1)]:
+        tokens = estimateTokens(line, model_name)
+        if not HEADER_LINE.match(line) or header_tokens + tokens > budget // 4:
+            break
+        header.append(line)
+        header_tokens += tokens
+
+    # The line with the cursor is always kept, cut from the left if it is too long by itself
+    cursor_line = lines[-1]
+    if estimateTokens(cursor_line, model_name) > budget - header_tokens:
+        cursor_line = cursor_line[-int((budget - header_tokens) * charsPerToken(model_name)):]
+    window = [cursor_line]
+    window_tokens = estimateTokens(cursor_line, model_name)
+
+    for line in reversed(lines[len(header):-1]):
+        tokens = estimateTokens(line, model_name)
+        if header_tokens + window_tokens + tokens > budget:
+            break
+        window.append(line)
+        window_tokens += tokens
+
+    shaped = "".join(header + window[::-1])
+    print(f"Prompt for {model_name}: {before} tokens trimmed to {estimateTokens(shaped, model_name)}, budget {budget}")
+    return shaped
+
+def dispatchSuggestion(
+    prompt: str,
+    vendor: str = vendors.Ollama,
+    model_name: str = "codellama",
+    temperature: float = 0.2,
+    top_p: float = 1,
+    top_k: int = 0,
+    max_tokens: int = 256,
+    is_correct: bool = True,
+    cancel: CancelToken = None,
+    session: tuple = None,
+    n: int = 1
+):
+    """
+    Sends the prompt to the vendor's model without consulting any cache.
+
+    Takes the same arguments as getSuggestion, plus a token that can cancel the generation and
+    the (client, document) session whose Ollama context may be reused. With n above 1 a list of
+    n candidates is returned instead of one suggestion.
+    """
+    prompt = shapePrompt(prompt, model_name)
+
+    if n > 1:
+        match vendor:
+            case vendors.OpenAI:
+                return getCandidatesFromOpenAI(prompt, model_name, n, temperature, top_p, max_tokens, cancel, is_correct)
+            case vendors.Google:
+                return [getSuggestionFromGoogle(prompt, cancel=cancel)[0 if is_correct else 1]]
+            case _:
+                return getCandidatesFromOllama(
+                    prompt,
+                    model_name,
+                    n,
+                    is_correct,
+                    cancel,
+                    temperature=temperature,
+                    top_p=top_p,
+                    top_k=top_k,
+                    max_tokens=max_tokens
+                )
+
     # Choose model-specific logic
     match vendor:
         case vendors.OpenAI:
@@ -41,35 +1111,129 @@ def getSuggestion(
                 temperature=temperature,
                 top_p=top_p,
                 top_k=top_k,
-                max_tokens=max_tokens
+                max_tokens=max_tokens,
+                cancel=cancel,
+                is_correct=is_correct
             )
+        case vendors.Google:
+            # Gemini answers with both variants at once
+            return getSuggestionFromGoogle(prompt, cancel=cancel)[0 if is_correct else 1]
         case vendors.Ollama:
             return getSuggestionFromOllama(
                 prompt,
                 model_name=model_name,
-                is_correct=is_correct
+                is_correct=is_correct,
+                cancel=cancel,
+                temperature=temperature,
+                top_p=top_p,
+                top_k=top_k,
+                max_tokens=max_tokens,
+                session=session
             )
         case _:
             return getSuggestionFromOllama(
                 prompt,
                 model_name=model_name,
-                is_correct=is_correct
+                is_correct=is_correct,
+                cancel=cancel,
+                temperature=temperature,
+                top_p=top_p,
+                top_k=top_k,
+                max_tokens=max_tokens,
+                session=session
             )
 
+def streamSuggestion(
+    prompt: str,
+    vendor: str = vendors.Ollama,
+    model_name: str = "codellama",
+    temperature: float = 0.2,
+    top_p: float = 1,
+    top_k: int = 0,
+    max_tokens: int = 256,
+    is_correct: bool = True,
+    client_id: str = None,
+    cancel: CancelToken = None,
+    document_id: str = None
+):
+    """
+    Streams a suggestion from the chosen vendor, yielding text as soon as the model produces it.
+
+    Takes the same arguments as getSuggestion. The concurrency slot of the model is taken before
+    this returns, so a full queue is reported before the response headers are sent, and it is held
+    until the stream ends or is closed.
+
+    Returns:
+        Iterator[str]: The pieces of generated text.
+
+    Raises:
+        QueueFullError: If the request cannot be queued.
+        QueueTimeoutError: If no slot became free in time.
+        ModelError: If there is an error with the model API, while iterating.
+    """
+    prompt = shapePrompt(prompt, model_name)
+
+    def stream():
+        with admission_scheduler.slot(vendor, model_name, client_id, cancel=cancel):
+            # Admitted, the first next() returns here
+            yield None
+            match vendor:
+                case vendors.OpenAI:
+                    yield from streamSuggestionFromOpenAI(
+                        prompt,
+                        model=model_name,
+                        temperature=temperature,
+                        top_p=top_p,
+                        top_k=top_k,
+                        max_tokens=max_tokens,
+                        cancel=cancel,
+                        is_correct=is_correct
+                    )
+                case _:
+                    yield from streamSuggestionFromOllama(
+                        prompt,
+                        model_name=model_name,
+                        is_correct=is_correct,
+                        cancel=cancel,
+                        temperature=temperature,
+                        top_p=top_p,
+                        top_k=top_k,
+                        max_tokens=max_tokens,
+                        session=(client_id, document_id) if document_id else None
+                    )
+
+    tokens = stream()
+    next(tokens)
+    return tokens
+
+def openAIMessages(prompt: str, is_correct: bool = True) -> list:
+    """
+    Chat messages asking OpenAI for a correct completion, or for one with a small mistake.
+    """
+    return [{"role": "system", "content": good_command if is_correct else bad_command}, {"role": "user", "content": prompt}]
+
 def getSuggestionFromOpenAI(
     prompt: str,
     model: str = "gpt-4o-mini",
     temperature: float = 0.2,
     top_p: float = 1,
     top_k: float = 1,
-    max_tokens: int = 256
+    max_tokens: int = 256,
+    cancel: CancelToken = None,
+    is_correct: bool = True
 ):
     """
     Completes a code suggestion using OpenAI's API.
+
+    With a cancel token the completion is streamed, so cancelling can stop it early. With
+    is_correct False the model is asked for a completion with a small mistake.
     """
+    if cancel is not None:
+        return "".join(streamSuggestionFromOpenAI(prompt, model, temperature, top_p, top_k, max_tokens, cancel, is_correct))
+
     try:
         # Send the prompt and system messages to OpenAI API
-        messages = [{"role": "system", "content": "SYSTEM: Complete the following code:"}, {"role": "user", "content": prompt}]
+        messages = openAIMessages(prompt, is_correct)
         
         completion = client.chat.completions.create(
             temperature=temperature,
@@ -85,40 +1249,253 @@ def getSuggestionFromOpenAI(
         print(f"Error generating suggestion using OpenAI's API: {e}")
         raise ModelError(f"Error generating suggestion using OpenAI's API: {e}")
 
-def getSuggestionFromOllama(prompt: str, model_name: str, is_correct: bool):
+def getCandidatesFromOpenAI(
+    prompt: str,
+    model: str = "gpt-4o-mini",
+    n: int = 3,
+    temperature: float = 0.2,
+    top_p: float = 1,
+    max_tokens: int = 256,
+    cancel: CancelToken = None,
+    is_correct: bool = True
+):
+    """
+    Asks OpenAI for n choices of a completion in one request.
+
+    With a cancel token the choices are streamed, so cancelling can stop them early.
+    """
+    messages = openAIMessages(prompt, is_correct)
+    params = dict(temperature=temperature, top_p=top_p, max_tokens=max_tokens, model=model, messages=messages, n=n)
+
+    try:
+        if cancel is None:
+            completion = client.chat.completions.create(**params)
+            return [choice.message.content or "" for choice in completion.choices]
+
+        if cancel.deadline is not None:
+            params["timeout"] = cancel.remaining()
+        stream = client.chat.completions.create(stream=True, **params)
+        cancel.on_cancel(stream.close)
+
+        # Deltas of all choices arrive interleaved, each tagged with its index
+        parts = [[] for _ in range(n)]
+        with closing(stream):
+            for chunk in stream:
+                cancel.raise_if_cancelled()
+                for choice in chunk.choices:
+                    if choice.delta.content and choice.index < n:
+                        parts[choice.index].append(choice.delta.content)
+        return ["".join(part) for part in parts]
+
+    except Exception as e:
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        print(f"Error generating suggestions using OpenAI's API: {e}")
+        raise ModelError(f"Error generating suggestions using OpenAI's API: {e}")
+
+def streamSuggestionFromOpenAI(
+    prompt: str,
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.2,
+    top_p: float = 1,
+    top_k: float = 1,
+    max_tokens: int = 256,
+    cancel: CancelToken = None,
+    is_correct: bool = True
+):
+    """
+    Streams a code suggestion from OpenAI's API, one delta at a time.
+    """
+    try:
+        messages = openAIMessages(prompt, is_correct)
+
+        stream = client.chat.completions.create(
+            temperature=temperature,
+            top_p=top_p,
+            max_tokens=max_tokens,
+            model=model,
+            messages=messages,
+            stream=True,
+            **({} if cancel is None or cancel.deadline is None else {"timeout": cancel.remaining()})
+        )
+
+        # Closing the stream drops the connection, which stops the generation
+        # if the client goes away before it finishes
+        if cancel is not None:
+            cancel.on_cancel(stream.close)
+
+        with closing(stream):
+            for chunk in stream:
+                if cancel is not None:
+                    cancel.raise_if_cancelled()
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    except Exception as e:
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        print(f"Error streaming suggestion using OpenAI's API: {e}")
+        raise ModelError(f"Error streaming suggestion using OpenAI's API: {e}")
+
+def getSuggestionFromOllama(prompt: str, model_name: str, is_correct: bool, cancel: CancelToken = None, **options):
     """
     Generates a suggestion from Ollama.
+
+    The response is streamed and joined so the generation can be cancelled or stopped early
+    while it runs. Takes the same options as streamSuggestionFromOllama.
     """
-    
+    return "".join(streamSuggestionFromOllama(prompt, model_name, is_correct, cancel, **options))
+
+def getCandidatesFromOllama(prompt: str, model_name: str, n: int, is_correct: bool, cancel: CancelToken = None, **options):
+    """
+    Samples n completions from Ollama at the same time, each with its own seed.
+
+    Ollama answers them in parallel up to its OLLAMA_NUM_PARALLEL setting. Candidates that fail
+    are left out, the call only fails if all of them do.
+    """
+    futures = [
+        submit(getSuggestionFromOllama, prompt, model_name, is_correct, CancelToken(parent=cancel), seed=seed, **options)
+        for seed in range(n)
+    ]
+
+    candidates = []
+    errors = []
+    for future in futures:
+        try:
+            candidates.append(future.result())
+        except Exception as e:
+            errors.append(e)
+
+    if not candidates:
+        raise errors[0]
+    return candidates
+
+def ollamaOptions(temperature: float = 0.2, top_p: float = 1, top_k: int = 0, max_tokens: int = 256, seed: int = None):
+    """
+    Returns the Ollama generation options for the sampling parameters of a request.
+    """
+    options = {
+        "temperature": temperature,
+        "top_p": top_p,
+        "num_predict": max_tokens,
+    }
+    if seed is not None:
+        options["seed"] = seed
+    # 0 means no top_k limit for the other vendors, Ollama would read it as its default of 40
+    if top_k:
+        options["top_k"] = top_k
+    if current_app.config["OLLAMA_STOP_SEQUENCES"]:
+        options["stop"] = current_app.config["OLLAMA_STOP_SEQUENCES"]
+    return options
+
+def streamSuggestionFromOllama(
+    prompt: str,
+    model_name: str,
+    is_correct: bool,
+    cancel: CancelToken = None,
+    temperature: float = 0.2,
+    top_p: float = 1,
+    top_k: int = 0,
+    max_tokens: int = 256,
+    session: tuple = None,
+    seed: int = None
+):
+    """
+    Streams a suggestion from Ollama, yielding each token as it is generated.
+
+    Cancelling the token closes the connection, which makes Ollama stop generating. The time left
+    until its deadline is used as the read timeout. With SUGGESTION_BLOCK_STOP the generation is
+    also stopped once the completion closes the block the cursor is in.
+
+    With a (client, document) session and OLLAMA_CONTEXT_REUSE the prompt is sent raw, and when it
+    extends the text of the session's stored context only the new part is sent along with it.
+    """
+    detector = BlockStopDetector(prompt) if current_app.config["SUGGESTION_BLOCK_STOP"] else None
+
     full_prompt = (
         good_command if is_correct else bad_command
     ) + prompt
 
+    if current_app.config["OLLAMA_RESIDENCY"]:
+        model_residency.ensure(model_name)
+
+    body = {
+        "model": model_name,
+        "prompt": full_prompt,
+        "keep_alive": current_app.config["OLLAMA_MODEL_KEEP_ALIVE"],
+        "options": ollamaOptions(temperature, top_p, top_k, max_tokens, seed),
+        "stream": True
+    }
+
+    context_key = None
+    if session is not None and current_app.config["OLLAMA_CONTEXT_REUSE"]:
+        # Without the prompt template the context holds exactly the text sent and generated
+        context_key = tuple(session) + (model_name, is_correct)
+        body["raw"] = True
+        reused = ollama_contexts.lookup(context_key, full_prompt)
+        if reused is not None:
+            body["context"], body["prompt"] = reused
+    generated = []
+
     try:
-        response = requests.post(
+        response = ollama_client.post(
             OLLAMA_URL,
-            json={
-                "model": model_name,
-                "prompt": full_prompt,
-                "keep_alive": "1h",
-                "stream": False
-            }
+            json=body,
+            stream=True,
+            timeout=ollama_client.timeout if cancel is None else tuple(cancel.remaining(limit) for limit in ollama_client.timeout)
         )
-        response.raise_for_status()  # Raise exception for HTTP errors
-        result = response.json()
-        return result["response"]
-    
+        response.raise_for_status()
+        if cancel is not None:
+            cancel.on_cancel(response.close)
+
+        # Ollama sends one JSON object per line until "done" is set
+        with closing(response):
+            for line in response.iter_lines():
+                if cancel is not None:
+                    cancel.raise_if_cancelled()
+                if not line:
+                    continue
+
+                chunk = json.loads(line)
+                if "error" in chunk:
+                    raise ModelError(chunk["error"])
+
+                text = chunk.get("response", "")
+                generated.append(text)
+                if detector is not None:
+                    text = detector.feed(text)
+                if text:
+                    yield text
+
+                if chunk.get("done") and context_key is not None and chunk.get("context"):
+                    ollama_contexts.store(context_key, full_prompt + "".join(generated), chunk["context"])
+
+                # Leaving the loop closes the response, which stops the generation
+                if chunk.get("done") or (detector is not None and detector.stopped):
+                    break
+
+            # Whitespace held back in case the next line ended the block
+            held = detector.flush() if detector is not None else ""
+            if held:
+                yield held
+
     except Exception as e:
-        print(f"Error fetching Ollama suggestion: {e}")
-        raise ModelError(f"Error fetching Ollama suggestion: {e}")
-    
-def getSuggestionFromGoogle(prompt: str):
+        if cancel is not None:
+            cancel.raise_if_cancelled()
+        if context_key is not None:
+            # The stored context may be what Ollama rejected
+            ollama_contexts.discard(context_key)
+        print(f"Error streaming Ollama suggestion: {e}")
+        raise ModelError(f"Error streaming Ollama suggestion: {e}")
+
+def getSuggestionFromGoogle(prompt: str, cancel: CancelToken = None):
     """
     Sends the prompt to the model and returns an array of two code snippets:
     one correct and one with a small logic error.
 
     Args:
         prompt (str): The code snippet to complete (e.g., "function add").
+        cancel (CancelToken): Its deadline is used as the request timeout.
 
     Returns:
         list[str]: An array containing two code snippets.
@@ -126,8 +1503,11 @@ def getSuggestionFromGoogle(prompt: str):
     # Combine the predefined instructions with the user's prompt
     full_prompt = f"You are an AI that suggests code snippets in an array, one correct and one with a small logic error, without any explanations, comments, or markdown formatting. Only return the missing part, and do not repeat existing code. The snippets should not generate syntax errors.\n\n{prompt}"
 
-    # Send the prompt to the model
-    response = gemini_client.chat_session.send_message(full_prompt)
+    # Send the prompt to the model as a single turn so no history is carried between requests
+    if cancel is not None and cancel.deadline is not None:
+        response = gemini_client.generate_content(full_prompt, request_options={"timeout": cancel.remaining()})
+    else:
+        response = gemini_client.generate_content(full_prompt)
 
     # Process the response to ensure it's in the correct format
     suggestions = response.text.strip().split("\n\n")  # Split into correct and incorrect snippets
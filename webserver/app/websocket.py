@@ -0,0 +1,267 @@
+"""
+WebSocket entry point for suggestions.
+
+An editor sends every prompt update over one connection instead of opening an HTTP request per
+suggestion. A new request on a connection cancels the generation of the one it replaces, so
+the model stops working on completions nobody will see and the client needs no debounce timer.
+The server runs in its own process, which run.py starts next to the Flask server when
+WEBSOCKET_PORT is set, or by hand with:
+
+    flask --app app websocket --port 8003
+
+Each message is a JSON object with the fields of POST /suggestion and an "id" the answer
+repeats. A message without a prompt but with a documentId and a cursor suggests at the cursor
+of a document opened with /document/open, its edits are applied in the order they arrive.
+{"type": "cancel"} cancels the current request without sending a new one. Answers have the
+shape of the HTTP responses with the "id" of the request and the HTTP status as "code".
+Superseded requests are not answered.
+"""
+import json
+import threading
+
+from websockets.exceptions import ConnectionClosed
+from websockets.sync.server import serve
+
+from app.controllers.deadlines import request_deadline
+from app.controllers.executor import submit
+from app.models.cancellation import CancelToken
+from app.models.errors import BaseError
+from app.models.status_codes import StatusCodes
+from app.services.document_service import editDocument, getDocumentSuggestion
+from app.services.suggestion_service import getBuggySuggestion, getSuggestion
+
+
+
+SUPERSEDED = "Superseded by a newer request"
+DISCONNECTED = "Client disconnected"
+
+
+def _body(request_id, status: str, message: str, data=None, code: StatusCodes = StatusCodes.OK):
+    return {
+        "id": request_id,
+        "status": status,
+        "message": message,
+        "data": data,
+        "code": code.value,
+    }
+
+
+class _Request:
+    def __init__(self, request_id, token: CancelToken):
+        self.id = request_id
+        self.token = token
+        self.future = None
+
+
+class SuggestionSocketServer:
+    """
+    WebSocket server where each new suggestion request of a connection cancels the previous one.
+
+    Every connection is served by its own thread that reads the messages in order. Generations
+    run on the shared suggestion thread pool, and their answers are sent from there.
+
+    Args:
+        app (Flask): The app whose config, caches and vendor clients are used.
+        host (str): The interface to listen on.
+        port (int): The port to listen on, 0 picks a free one.
+    """
+    def __init__(self, app, host: str = "127.0.0.1", port: int = 8003):
+        self.app = app
+        self.host = host
+        self.port = port
+
+        self._server = None
+        self._lock = threading.Lock()
+        self._connections = 0
+        self._accepted = 0
+        self._requests = 0
+        self._answered = 0
+        self._superseded = 0
+        self._errors = 0
+
+    def serve_forever(self):
+        """
+        Serves until shutdown() is called, in the calling thread.
+        """
+        with serve(self.handle, self.host, self.port) as server:
+            self._server = server
+            self.port = server.socket.getsockname()[1]
+            server.serve_forever()
+
+    def start(self) -> threading.Thread:
+        """
+        Starts listening, then serves in a daemon thread.
+
+        Raises:
+            OSError: If the port cannot be bound.
+        """
+        self._server = serve(self.handle, self.host, self.port)
+        self.port = self._server.socket.getsockname()[1]
+        thread = threading.Thread(target=self._server.serve_forever, name="websocket-server", daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+    def handle(self, connection):
+        """
+        Reads the requests of one connection until it closes.
+        """
+        with self._lock:
+            self._connections += 1
+            self._accepted += 1
+
+        send_lock = threading.Lock()
+        current = None
+        with self.app.app_context():
+            try:
+                for message in connection:
+                    try:
+                        data = json.loads(message)
+                        if not isinstance(data, dict):
+                            raise ValueError
+                    except ValueError:
+                        self.send(connection, send_lock, _body(None, "Error", "Invalid JSON message", code=StatusCodes.BAD_REQUEST))
+                        continue
+
+                    self.supersede(current, SUPERSEDED)
+                    current = None
+                    if data.get("type") == "cancel":
+                        continue
+                    try:
+                        current = self.dispatch(connection, send_lock, data)
+                    except Exception as e:
+                        # One bad request must not close the connection of the others
+                        self.send(connection, send_lock, _body(data.get("id"), "Error", str(e), code=StatusCodes.SERVER_ERROR))
+            except ConnectionClosed:
+                pass
+            finally:
+                self.supersede(current, DISCONNECTED)
+                with self._lock:
+                    self._connections -= 1
+
+    def dispatch(self, connection, send_lock, data: dict) -> _Request:
+        """
+        Starts the generation of a request on the thread pool.
+        """
+        with self._lock:
+            self._requests += 1
+
+        deadline = data.get("deadlineMs")
+        if deadline is not None and (isinstance(deadline, bool) or not isinstance(deadline, (int, float)) or deadline < 0):
+            with self._lock:
+                self._errors += 1
+            self.send(connection, send_lock, _body(data.get("id"), "Error", "deadlineMs must be a number of milliseconds", code=StatusCodes.BAD_REQUEST))
+            return None
+
+        request = _Request(data.get("id"), CancelToken(timeout=request_deadline(deadline)))
+        client_id = str(data.get("userId") or connection.remote_address[0])
+
+        # Edits are applied here, in the order they arrive, even if their request is superseded later
+        if not data.get("prompt") and data.get("edits"):
+            try:
+                data["version"] = editDocument(client_id, data.get("documentId"), data["edits"], data.get("version"))
+                data["edits"] = None
+            except BaseError as e:
+                self.send(connection, send_lock, _body(request.id, "Error", e.message, code=e.status_code))
+                request.token.close()
+                return None
+
+        request.future = submit(self.answer, connection, send_lock, data, client_id, request)
+        return request
+
+    def answer(self, connection, send_lock, data: dict, client_id: str, request: _Request):
+        """
+        Generates the suggestion of a request and sends it, unless the request was superseded.
+        """
+        try:
+            result = self.suggest(data, client_id, request.token)
+            body = _body(request.id, "Success", "AI Suggestions", result)
+        except BaseError as e:
+            body = _body(request.id, "Error", e.message, code=e.status_code)
+        except Exception as e:
+            body = _body(request.id, "Error", str(e), code=StatusCodes.SERVER_ERROR)
+        finally:
+            request.token.close()
+
+        # A generation that finished just as it was superseded is stale as well
+        if request.token.cancelled and request.token.reason in (SUPERSEDED, DISCONNECTED):
+            return
+
+        with self._lock:
+            if body["status"] == "Success":
+                self._answered += 1
+            else:
+                self._errors += 1
+        self.send(connection, send_lock, body)
+
+    def suggest(self, data: dict, client_id: str, cancel: CancelToken) -> dict:
+        params = dict(
+            model_name=data.get("model", "codellama"),
+            temperature=data.get("temperature", 0.2),
+            top_p=data.get("top_p", 1),
+            top_k=data.get("top_k", 0),
+            max_tokens=data.get("max_tokens", 256),
+            hedge=data.get("hedge"),
+            cascade=data.get("cascade"),
+            quality=data.get("quality"),
+            cancel=cancel
+        )
+        prompt = data.get("prompt")
+
+        if not prompt and data.get("documentId") and data.get("cursor") is not None:
+            suggestion, bug, version = getDocumentSuggestion(
+                client_id=client_id,
+                document_id=data["documentId"],
+                cursor=data["cursor"],
+                version=data.get("version"),
+                is_correct=data.get("isCorrect", True),
+                **params
+            )
+            result = {"suggestions": [suggestion], "version": version}
+        elif not prompt:
+            raise BaseError("No prompt provided")
+        elif not data.get("isCorrect", True):
+            suggestion, bug = getBuggySuggestion(prompt, data.get("language"), client_id=client_id, document_id=data.get("documentId"), **params)
+            result = {"suggestions": [suggestion]}
+        else:
+            trace = {}
+            suggestion, bug = getSuggestion(prompt, client_id=client_id, document_id=data.get("documentId"), trace=trace, **params), None
+            result = {"suggestions": [suggestion]}
+            if "tier" in trace:
+                result["tier"] = trace["tier"]
+
+        if bug is not None:
+            result["bug"] = bug
+        return result
+
+    def supersede(self, request: _Request, reason: str):
+        """
+        Cancels a request that is still generating.
+        """
+        if request is None or request.future is None or request.future.done():
+            return
+        request.token.cancel(reason)
+        with self._lock:
+            self._superseded += 1
+
+    def send(self, connection, send_lock, body: dict):
+        try:
+            with send_lock:
+                connection.send(json.dumps(body))
+        except ConnectionClosed:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "port": self.port,
+                "connections": self._connections,
+                "accepted": self._accepted,
+                "requests": self._requests,
+                "answered": self._answered,
+                "superseded": self._superseded,
+                "errors": self._errors,
+            }
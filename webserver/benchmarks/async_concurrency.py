@@ -0,0 +1,134 @@
+"""
+Compares how many suggestion requests one process can keep in flight on the Flask (WSGI)
+route and on the ASGI entry point.
+
+Ollama is replaced by a fake that answers after a fixed delay, so the numbers show the
+concurrency of the server itself rather than model speed. Both paths run suggestions through the
+same pipeline, the ASGI one on its ASGI_WORKERS threads; both runs get the same thread count and
+the same admission scheduler limit (off by default). Run from the webserver directory:
+
+    python benchmarks/async_concurrency.py --requests 200 --threads 16 --latency 0.25 --concurrency 0
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock, patch
+
+import httpx
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__) + "/.."))
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+
+from app import create_app
+from app.asgi import AsyncApplication
+from app.controllers.async_clients import AsyncClients
+
+
+def benchmark_config(requests: int, threads: int, concurrency: int) -> dict:
+    """Pins the worker threads and the admission scheduler the same way for both runs so neither decides the result."""
+    return {
+        "ASGI_WORKERS": threads,
+        # Only the fake Ollama answers, so a broken fake shows up as failed requests instead of a fallback
+        "ROUTING_CANDIDATES": ["ollama"],
+        # 0 leaves Ollama without a limit, which turns the scheduler off
+        "SCHEDULER_CONCURRENCY": {"ollama": concurrency} if concurrency else {},
+        "SCHEDULER_MAX_QUEUE": requests,
+        "SCHEDULER_MAX_QUEUED_PER_CLIENT": requests,
+    }
+
+
+class Upstream:
+    """Counts how many fake Ollama calls are open at the same time."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.open = 0
+        self.peak = 0
+
+    def enter(self):
+        with self.lock:
+            self.open += 1
+            self.peak = max(self.peak, self.open)
+
+    def exit(self):
+        with self.lock:
+            self.open -= 1
+
+
+def fake_ollama(upstream: Upstream, latency: float):
+    def fake_post(*args, **kwargs):
+        upstream.enter()
+        time.sleep(latency)
+        upstream.exit()
+        # Ollama streams one JSON object per line
+        lines = [json.dumps({"response": "return a + b", "done": True}).encode()]
+        return Mock(status_code=200, iter_lines=lambda: iter(lines))
+    return fake_post
+
+
+def bench_wsgi(requests: int, threads: int, latency: float, config: dict):
+    app = create_app(config)
+    upstream = Upstream()
+
+    def send(i):
+        client = app.test_client()
+        body = json.dumps({"prompt": f"def add_{i}(a, b):"})
+        return client.post("/suggestion", data=body, content_type="application/json").status_code
+
+    with patch("requests.Session.post", side_effect=fake_ollama(upstream, latency)):
+        start = time.perf_counter()
+        # A WSGI server handles one request per worker thread
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            statuses = list(pool.map(send, range(requests)))
+        elapsed = time.perf_counter() - start
+
+    return elapsed, upstream.peak, statuses.count(200)
+
+
+def bench_asgi(requests: int, latency: float, config: dict):
+    upstream = Upstream()
+
+    async def run():
+        flask_app = create_app(config)
+        clients = AsyncClients(flask_app.config)
+        application = AsyncApplication(flask_app, clients)
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=application), base_url="http://asgi") as client:
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[
+                client.post("/suggestion", json={"prompt": f"def add_{i}(a, b):"})
+                for i in range(requests)
+            ])
+            elapsed = time.perf_counter() - start
+
+        await clients.aclose()
+        return elapsed, upstream.peak, [r.status_code for r in responses].count(200)
+
+    with patch("requests.Session.post", side_effect=fake_ollama(upstream, latency)):
+        return asyncio.run(run())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=200, help="concurrent suggestion requests")
+    parser.add_argument("--threads", type=int, default=16, help="WSGI worker threads and ASGI_WORKERS")
+    parser.add_argument("--latency", type=float, default=0.25, help="seconds the fake Ollama takes to answer")
+    parser.add_argument("--concurrency", type=int, default=0, help="Ollama slots in the admission scheduler for both runs (0 disables it)")
+    args = parser.parse_args()
+
+    config = benchmark_config(args.requests, args.threads, args.concurrency)
+    scheduler = f"scheduler pinned to {args.concurrency} Ollama slots" if args.concurrency else "scheduler disabled"
+    print(f"{args.requests} requests, fake Ollama latency {args.latency}s, {scheduler} for both runs\n")
+    print(f"{'path':<22}{'wall time':>12}{'req/s':>10}{'peak in flight':>16}{'ok':>6}")
+
+    for name, result in [
+        (f"wsgi ({args.threads} threads)", bench_wsgi(args.requests, args.threads, args.latency, config)),
+        (f"asgi ({args.threads} workers)", bench_asgi(args.requests, args.latency, config)),
+    ]:
+        elapsed, peak, ok = result
+        print(f"{name:<22}{elapsed:>11.2f}s{args.requests / elapsed:>10.1f}{peak:>16}{ok:>6}")
@@ -45,6 +45,19 @@ def run_tests():
     else:
         print("Tests directory not found.")
 
+def run_websocket():
+    """Start the WebSocket server in the background if WEBSOCKET_PORT is set."""
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+    if not os.getenv("WEBSOCKET_PORT"):
+        return None
+
+    flask_loc = os.path.join(VENV_DIR, "Scripts" if os.name == "nt" else "bin", "flask.exe" if os.name == "nt" else "flask")
+    return subprocess.Popen([flask_loc, "--app", "app", "websocket"])
+
 def run_flask():
     """Run the Flask application."""
     flask_loc = os.path.join(VENV_DIR, "Scripts" if os.name == "nt" else "bin", "flask.exe" if os.name == "nt" else "flask")
@@ -64,4 +77,9 @@ if __name__ == "__main__":
     except:
         print("Tests failed")
 
-    run_flask()
+    websocket = run_websocket()
+    try:
+        run_flask()
+    finally:
+        if websocket is not None:
+            websocket.terminate()
@@ -44,6 +44,11 @@ def test_logging_route(client):
     assert response.status_code == 201
     assert response.json.get("status") == "Success"
 
+def ollama_response(text):
+    """Mocked Ollama reply, readable both as one JSON body and as a stream of lines."""
+    lines = [json.dumps({"response": text, "done": True}).encode()]
+    return Mock(status_code=200, json=lambda: {"response": text}, iter_lines=lambda: iter(lines))
+
 @pytest.fixture
 def mock_requests_post(mocker):
     mock_response = {
@@ -52,8 +57,13 @@ def mock_requests_post(mocker):
     
     return mocker.patch("requests.post", return_value=Mock(status_code=200, json=lambda: mock_response))
 
+@pytest.fixture
+def mock_ollama_session(mocker):
+    """Ollama calls go through the shared session of the vendor clients and are streamed."""
+    return mocker.patch("requests.Session.post", return_value=ollama_response("Mocked response for: Hello"))
+
 
-def test_suggestions_route_prompt(mock_requests_post, client):
+def test_suggestions_route_prompt(mock_requests_post, mock_ollama_session, client):
     response = client.post(
         "/suggestion",
         data=json.dumps({"prompt": "Hello"}),
@@ -72,4 +82,994 @@ def test_suggestions_route_no_prompt(client):
     )
 
     assert response.status_code == 400
-    assert response.json.get("message") == "No prompt provided"
\ No newline at end of file
+    assert response.json.get("message") == "No prompt provided"
+
+@pytest.fixture
+def mock_requests_stream(mocker):
+    lines = [
+        json.dumps({"response": "return", "done": False}).encode(),
+        json.dumps({"response": " a + b", "done": False}).encode(),
+        json.dumps({"response": "", "done": True}).encode(),
+    ]
+
+    return mocker.patch("requests.Session.post", return_value=Mock(status_code=200, iter_lines=lambda: iter(lines)))
+
+
+def test_suggestions_stream_route(mock_requests_stream, client):
+    response = client.post(
+        "/suggestion/stream",
+        data=json.dumps({"prompt": "def add(a, b):"}),
+        content_type="application/json"
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines == [{"token": "return"}, {"token": " a + b"}, {"done": True}]
+    assert mock_requests_stream.call_args.kwargs["json"]["stream"] is True
+
+
+def test_suggestions_stream_route_no_prompt(client):
+    response = client.post(
+        "/suggestion/stream",
+        data=json.dumps({}),
+        content_type="application/json"
+    )
+
+    assert response.status_code == 400
+    assert response.json.get("message") == "No prompt provided"
+
+
+def test_suggestions_route_uses_ollama_pool(mock_ollama_session, client):
+    client.post(
+        "/suggestion",
+        data=json.dumps({"prompt": "Hello"}),
+        content_type="application/json"
+    )
+
+    # Every Ollama call gets a timeout from the pool configuration
+    assert mock_ollama_session.call_args.kwargs["timeout"] == (3.05, 120)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.json["data"]["ollama_pool"]["requests"] == 1
+
+
+def test_suggestions_route_cache(mock_ollama_session, client):
+    body = json.dumps({"prompt": "Hello"})
+    for _ in range(2):
+        response = client.post("/suggestion", data=body, content_type="application/json")
+        assert response.json.get("data") == {"suggestions": ["Mocked response for: Hello"]}
+
+    assert mock_ollama_session.call_count == 1
+
+    # High temperature sampling should not be served from the cache
+    hot = json.dumps({"prompt": "Hello", "temperature": 0.9})
+    client.post("/suggestion", data=hot, content_type="application/json")
+    client.post("/suggestion", data=hot, content_type="application/json")
+    assert mock_ollama_session.call_count == 3
+
+    stats = client.get("/metrics").json["data"]["suggestion_cache"]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_suggestions_route_reuses_completion_while_typing(mocker, client):
+    mock_post = mocker.patch(
+        "requests.Session.post",
+        return_value=ollama_response("return a + b")
+    )
+
+    client.post("/suggestion", data=json.dumps({"prompt": "def add(a, b):\n    "}), content_type="application/json")
+    response = client.post("/suggestion", data=json.dumps({"prompt": "def add(a, b):\n    retu"}), content_type="application/json")
+
+    assert response.json.get("data") == {"suggestions": ["rn a + b"]}
+    assert mock_post.call_count == 1
+
+
+def test_suggestions_route_coalesces_identical_requests(mocker, app):
+    import threading
+    import time
+
+    release = threading.Event()
+
+    def slow_post(*args, **kwargs):
+        release.wait(5)
+        return ollama_response("return a + b")
+
+    mock_post = mocker.patch("requests.Session.post", side_effect=slow_post)
+    results = []
+
+    def send():
+        response = app.test_client().post("/suggestion", data=json.dumps({"prompt": "def add(a, b):"}), content_type="application/json")
+        results.append(response.json.get("data"))
+
+    threads = [threading.Thread(target=send) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+
+    with app.app_context():
+        from app.controllers.singleflight import suggestion_flights
+        deadline = time.monotonic() + 5
+        while suggestion_flights.stats()["coalesced"] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [{"suggestions": ["return a + b"]}] * 3
+    assert mock_post.call_count == 1
+
+
+def test_coalesced_request_keeps_its_own_deadline(mocker, app):
+    import threading
+    import time
+
+    release = threading.Event()
+
+    def slow_post(*args, **kwargs):
+        release.wait(5)
+        return ollama_response("return a + b")
+
+    mock_post = mocker.patch("requests.Session.post", side_effect=slow_post)
+    app.config.update(OPENAI_API_KEY=None)
+    leader = []
+
+    def send(headers=None):
+        return app.test_client().post(
+            "/suggestion",
+            data=json.dumps({"prompt": "def add(a, b):"}),
+            headers=headers or {},
+            content_type="application/json"
+        )
+
+    thread = threading.Thread(target=lambda: leader.append(send()))
+    thread.start()
+    while mock_post.call_count == 0:
+        time.sleep(0.01)
+
+    # The follower gives up at its deadline while the leader is still generating
+    start = time.monotonic()
+    follower = send({"X-Deadline-Ms": "200"})
+    assert follower.status_code == 504
+    assert time.monotonic() - start < 1
+
+    release.set()
+    thread.join(5)
+    assert leader[0].json["data"] == {"suggestions": ["return a + b"]}
+    assert mock_post.call_count == 1
+    assert app.test_client().get("/metrics").json["data"]["coalescing"]["abandoned"] == 1
+
+
+def test_suggestions_route_paired(mocker, client):
+    def post(url, json=None, **kwargs):
+        buggy = "mistake" in json["prompt"]
+        return ollama_response("return a - b" if buggy else "return a + b")
+
+    mock_post = mocker.patch("requests.Session.post", side_effect=post)
+    client.application.config.update(BUG_INJECTION="model")
+
+    response = client.post(
+        "/suggestion",
+        data=json.dumps({"prompt": "def add(a, b):", "paired": True}),
+        content_type="application/json"
+    )
+
+    assert response.status_code == 200
+    assert response.json.get("data") == {"suggestions": ["return a + b", "return a - b"]}
+    assert mock_post.call_count == 2
+
+
+def test_asgi_suggestion_route(mocker, app):
+    import asyncio
+    import threading
+    import httpx
+    from app.asgi import AsyncApplication
+    from app.controllers.async_clients import AsyncClients
+
+    release = threading.Event()
+
+    def ollama(url, **kwargs):
+        if "slow" in kwargs["json"]["prompt"]:
+            release.wait(5)
+        return ollama_response("return a + b")
+
+    ollama_post = mocker.patch("requests.Session.post", side_effect=ollama)
+    app.config.update(OPENAI_API_KEY=None, SCHEDULER_CONCURRENCY={"ollama": 1}, SCHEDULER_MAX_QUEUE=0)
+
+    async def run():
+        clients = AsyncClients(app.config)
+        transport = httpx.ASGITransport(app=AsyncApplication(app, clients))
+        async with httpx.AsyncClient(transport=transport, base_url="http://asgi") as http:
+            ok = await http.post("/suggestion", json={"prompt": "def add(a, b):"})
+            missing = await http.post("/suggestion", json={})
+
+            late = await http.post("/suggestion", json={"prompt": "def slow():"}, headers={"X-Deadline-Ms": "100"})
+            # The slow generation still holds the only slot of the admission scheduler the Flask routes use
+            busy = await http.post("/suggestion", json={"prompt": "def sub(a, b):"})
+            release.set()
+        await clients.aclose()
+        return ok, missing, late, busy
+
+    ok, missing, late, busy = asyncio.run(run())
+
+    assert ok.status_code == 200
+    assert ok.json().get("data") == {"suggestions": ["return a + b"]}
+    assert missing.status_code == 400
+    assert missing.json().get("message") == "No prompt provided"
+    assert late.status_code == 504
+    assert busy.status_code == 503
+    assert busy.headers["retry-after"]
+    assert ollama_post.call_count == 2
+
+
+def test_vendor_clients_are_shared_between_requests(app):
+    from app.controllers.ai import get_ai, get_ollama
+
+    app.config["OPENAI_API_KEY"] = app.config["OPENAI_API_KEY"] or "test-key"
+
+    with app.test_request_context():
+        openai, ollama = get_ai(), get_ollama()
+
+    with app.test_request_context():
+        assert get_ai() is openai
+        assert get_ollama() is ollama
+
+
+def test_suggestions_route_hedges_slow_vendor(mocker, client):
+    import threading
+
+    cancelled = threading.Event()
+
+    def slow_ollama(*args, **kwargs):
+        def lines():
+            cancelled.wait(5)
+            yield json.dumps({"response": "too late", "done": True}).encode()
+        return Mock(status_code=200, iter_lines=lines, close=cancelled.set)
+
+    mocker.patch("requests.Session.post", side_effect=slow_ollama)
+    openai = mocker.patch("app.services.suggestion_service.getSuggestionFromOpenAI", return_value="return a + b")
+
+    client.application.config.update(HEDGE_DELAY=None, HEDGE_DEFAULT_DELAY=0.05)
+    response = client.post(
+        "/suggestion",
+        data=json.dumps({"prompt": "def add(a, b):", "hedge": True}),
+        content_type="application/json"
+    )
+
+    assert response.json.get("data") == {"suggestions": ["return a + b"]}
+    assert openai.call_args.kwargs["model"] == "gpt-4o-mini"
+    # The slow Ollama connection is closed once the backup has answered
+    assert cancelled.wait(1)
+
+    stats = client.get("/metrics").json["data"]["hedging"]
+    assert stats["wins"] == {"openai": 1}
+    assert stats["hedged"] == 1
+
+
+def test_suggestions_route_hedged_request_keeps_its_deadline(mocker, client):
+    import threading
+
+    closed = threading.Event()
+
+    def slow_ollama(*args, **kwargs):
+        def lines():
+            closed.wait(5)
+            yield json.dumps({"response": "too late", "done": True}).encode()
+        return Mock(status_code=200, iter_lines=lines, close=closed.set)
+
+    mocker.patch("requests.Session.post", side_effect=slow_ollama)
+    openai = mocker.patch("app.services.suggestion_service.getSuggestionFromOpenAI", return_value="return a + b")
+
+    # The deadline passes before the hedging delay, so no backup is ever started
+    client.application.config.update(HEDGE_DELAY=5)
+    response = client.post(
+        "/suggestion",
+        data=json.dumps({"prompt": "def add(a, b):", "hedge": True}),
+        headers={"X-Deadline-Ms": "100"},
+        content_type="application/json"
+    )
+
+    assert response.status_code == 504
+    assert closed.is_set()
+    assert openai.call_count == 0
+
+
+def test_suggestions_route_routes_around_failing_vendor(mocker, client):
+    import requests
+
+    ollama = mocker.patch("requests.Session.post", side_effect=requests.ConnectionError("Ollama is down"))
+    openai = mocker.patch("app.services.suggestion_service.getSuggestionFromOpenAI", return_value="return a + b")
+    client.application.config.update(OPENAI_API_KEY="test-key", ROUTING_FAILURE_THRESHOLD=2)
+
+    for i in range(4):
+        response = client.post(
+            "/suggestion",
+            data=json.dumps({"prompt": f"def add_{i}(a, b):"}),
+            content_type="application/json"
+        )
+        assert response.json.get("data") == {"suggestions": ["return a + b"]}
+
+    # Once the circuit is open Ollama is not called anymore
+    assert ollama.call_count == 2
+    assert openai.call_count == 4
+
+    stats = client.get("/metrics/routing").json["data"]
+    assert stats["ollama/codellama"]["state"] == "open"
+    assert stats["ollama/codellama"]["consecutive_failures"] == 2
+    assert stats["openai/gpt-4o-mini"]["state"] == "closed"
+
+
+def test_suggestions_route_asks_fallback_vendor_for_buggy_code(mocker, client):
+    import requests
+
+    mocker.patch("requests.Session.post", side_effect=requests.ConnectionError("Ollama is down"))
+    openai = mocker.patch("app.services.suggestion_service.getSuggestionFromOpenAI", return_value="return a - b")
+    client.application.config.update(OPENAI_API_KEY="test-key", BUG_INJECTION="model")
+
+    response = client.post(
+        "/suggestion",
+        data=json.dumps({"prompt": "def add(a, b):", "isCorrect": False}),
+        content_type="application/json"
+    )
+
+    assert response.json.get("data")["suggestions"] == ["return a - b"]
+    assert openai.call_args.kwargs["is_correct"] is False
+
+    from app.services.suggestion_service import openAIMessages
+    assert "mistake" in openAIMessages("def add(a, b):", is_correct=False)[0]["content"]
+
+
+def test_suggestions_route_closes_circuit_when_vendor_recovers(mocker, client):
+    import time
+    import requests
+
+    down = {"value": True}
+
+    def ollama(url, **kwargs):
+        if down["value"]:
+            raise requests.ConnectionError("Ollama is down")
+        return ollama_response("return a + b")
+
+    mocker.patch("requests.Session.post", side_effect=ollama)
+    openai = mocker.patch("app.services.suggestion_service.getSuggestionFromOpenAI", return_value="return a + b")
+    client.application.config.update(OPENAI_API_KEY="test-key", ROUTING_FAILURE_THRESHOLD=1, ROUTING_COOLDOWN=0.05)
+
+    def suggest(i):
+        return client.post(
+            "/suggestion",
+            data=json.dumps({"prompt": f"def add_{i}(a, b):"}),
+            content_type="application/json"
+        )
+
+    suggest(0)
+    assert client.get("/metrics/routing").json["data"]["ollama/codellama"]["state"] == "open"
+
+    down["value"] = False
+    time.sleep(0.1)
+    for i in range(1, 5):
+        suggest(i)
+
+    # The probe after the cooldown closed the circuit, and the traffic went back to Ollama
+    stats = client.get("/metrics/routing").json["data"]["ollama/codellama"]
+    assert stats["state"] == "closed"
+    assert stats["requests"] == 5
+    assert openai.call_count == 1
+
+
+def test_suggestions_route_refuses_cold_model(mocker, client):
+    import time
+    from app.controllers.residency import model_residency
+
+    loaded = set()
+    installed = {"codellama:latest", "starcoder2:latest"}
+
+    def ps(url, **kwargs):
+        models = installed if url.endswith("/api/tags") else loaded
+        return Mock(status_code=200, json=lambda: {"models": [{"name": name} for name in sorted(models)]})
+
+    def generate(url, json=None, **kwargs):
+        if "prompt" not in json:
+            loaded.add(json["model"])
+            return Mock(status_code=200)
+        return ollama_response("return a + b")
+
+    mocker.patch("requests.Session.get", side_effect=ps)
+    mocker.patch("requests.Session.post", side_effect=generate)
+    client.application.config.update(OPENAI_API_KEY=None, OLLAMA_RESIDENCY=True, OLLAMA_COLD_MODEL_POLICY="refuse")
+
+    with client.application.app_context():
+        assert model_residency.sync()
+
+    # A model Ollama does not have is passed through, neither refused nor kept loaded
+    unknown = client.post("/suggestion", data=json.dumps({"prompt": "def add(a, b):", "model": "gemini"}), content_type="application/json")
+    assert unknown.status_code == 200
+
+    request = {"prompt": "def add(a, b):", "model": "starcoder2"}
+    cold = client.post("/suggestion", data=json.dumps(request), content_type="application/json")
+    assert cold.status_code == 503
+    assert cold.headers["Retry-After"] == "10"
+
+    # The model is loaded in the background while the client waits
+    with client.application.app_context():
+        for _ in range(100):
+            if model_residency.is_resident("starcoder2"):
+                break
+            time.sleep(0.01)
+
+    warm = client.post("/suggestion", data=json.dumps(request), content_type="application/json")
+    assert warm.json.get("data") == {"suggestions": ["return a + b"]}
+    assert "starcoder2:latest" in loaded
+
+    stats = client.get("/metrics").json["data"]["ollama_models"]
+    assert stats["refused"] == 1
+    assert stats["hot"] == ["starcoder2:latest"]
+    assert "gemini:latest" not in loaded
+
+
+def test_suggestions_route_trims_prompt_to_budget(mock_ollama_session, client):
+    header = "import os\nimport sys\n\n"
+    body = "".join(f"value_{i} = compute({i})\n" for i in range(200))
+    prompt = header + body + "def add(a, b):"
+
+    client.application.config.update(PROMPT_TOKEN_BUDGETS={"codellama": 100})
+    response = client.post(
+        "/suggestion",
+        data=json.dumps({"prompt": prompt}),
+        content_type="application/json"
+    )
+    assert response.status_code == 200
+
+    sent = mock_ollama_session.call_args.kwargs["json"]["prompt"]
+    assert sent.endswith("value_199 = compute(199)\ndef add(a, b):")
+    assert "import os\nimport sys\n" in sent
+    assert "value_0 =" not in sent
+    assert len(sent) <= 100 * 3.2 + len("SYSTEM: Complete the following code:")
+
+
+def test_suggestions_route_queues_fairly_per_model(mocker, app):
+    import threading
+    import time
+    from app.controllers.scheduler import admission_scheduler
+
+    gate = threading.Event()
+    served = []
+
+    def ollama(url, json=None, **kwargs):
+        served.append(json["prompt"].rsplit(":", 1)[-1])
+        gate.wait(5)
+        return ollama_response("pass")
+
+    mocker.patch("requests.Session.post", side_effect=ollama)
+    app.config.update(
+        OPENAI_API_KEY=None,
+        SCHEDULER_CONCURRENCY={"ollama": 1},
+        SCHEDULER_MAX_QUEUE=3,
+        SCHEDULER_MAX_QUEUED_PER_CLIENT=2
+    )
+
+    def send(user, name):
+        return app.test_client().post(
+            "/suggestion",
+            data=json.dumps({"prompt": f"def f():{name}", "userId": user}),
+            content_type="application/json"
+        )
+
+    def queued():
+        with app.app_context():
+            return admission_scheduler.stats()["models"].get("ollama/codellama", {}).get("queued", 0)
+
+    responses = {}
+    threads = []
+    for user, name, expected_queue in [("a", "a1", 0), ("a", "a2", 1), ("a", "a3", 2), ("b", "b1", 3)]:
+        thread = threading.Thread(target=lambda u=user, n=name: responses.__setitem__(n, send(u, n)))
+        thread.start()
+        threads.append(thread)
+        for _ in range(200):
+            if len(served) == 1 and queued() == expected_queue:
+                break
+            time.sleep(0.01)
+
+    # User a has reached its share of the queue, and the queue itself is full
+    too_many = send("a", "a4")
+    assert too_many.status_code == 429
+    assert too_many.headers["Retry-After"]
+    busy = send("c", "c1")
+    assert busy.status_code == 503
+    # Streams are admitted before their headers are sent
+    busy_stream = app.test_client().post(
+        "/suggestion/stream",
+        data=json.dumps({"prompt": "def f():c2", "userId": "c"}),
+        content_type="application/json"
+    )
+    assert busy_stream.status_code == 503
+    assert busy_stream.headers["Retry-After"]
+
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert all(response.status_code == 200 for response in responses.values())
+    # b does not wait behind every request of a
+    assert served == ["a1", "a2", "b1", "a3"]
+
+    with app.app_context():
+        stats = admission_scheduler.stats()
+    assert stats["rejected_client_limit"] == 1
+    assert stats["rejected_queue_full"] == 2
+    assert stats["waited"] == 3
+
+
+def test_suggestions_route_injects_bug_locally(mocker, client):
+    mock_post = mocker.patch("requests.Session.post", return_value=ollama_response("\n    return a + b"))
+
+    response = client.post(
+        "/suggestion",
+        data=json.dumps({"prompt": "def add(a, b):", "paired": True}),
+        content_type="application/json"
+    )
+
+    assert response.json.get("data") == {
+        "suggestions": ["\n    return a + b", "\n    return a - b"],
+        "bug": {"mutation": "wrong_operator", "language": "python", "line": 2, "original": "+", "replacement": "-"},
+    }
+    # The buggy variant reuses the correct generation
+    assert mock_post.call_count == 1
+    assert "mistake" not in mock_post.call_args.kwargs["json"]["prompt"]
+
+    buggy = client.post(
+        "/suggestion",
+        data=json.dumps({"prompt": "def add(a, b):", "isCorrect": False}),
+        content_type="application/json"
+    )
+    assert buggy.json["data"]["suggestions"] == ["\n    return a - b"]
+    assert mock_post.call_count == 1
+
+
+def test_injected_bug_leaves_javascript_regex_literals_alone():
+    from app.services.bug_service import injectBug
+
+    code = "x = a / b / c; y = /ab+c/.test(s);"
+    for seed in range(20):
+        buggy, bug = injectBug(code, "javascript", seed=seed)
+        assert buggy.endswith("y = /ab+c/.test(s);")
+        assert bug["original"] == "/"
+
+
+def test_suggestions_route_uses_prefetched_completion(mock_ollama_session, client):
+    import time
+
+    prefetch = client.post(
+        "/suggestion/prefetch",
+        data=json.dumps({"prompt": "def add(a, b):"}),
+        content_type="application/json"
+    )
+    assert prefetch.status_code == 202
+    assert prefetch.json["data"] == {"started": 2}
+
+    for _ in range(100):
+        if client.get("/metrics").json["data"]["prefetch"]["completed"] == 2:
+            break
+        time.sleep(0.01)
+    assert mock_ollama_session.call_count == 2
+
+    response = client.post(
+        "/suggestion",
+        data=json.dumps({"prompt": "def add(a, b):"}),
+        content_type="application/json"
+    )
+    assert response.json["data"] == {"suggestions": ["Mocked response for: Hello"]}
+    assert mock_ollama_session.call_count == 2
+    # Speculative generations are not counted as traffic of the backend
+    assert client.get("/metrics/routing").json["data"]["ollama/codellama"]["requests"] == 0
+
+    # Nothing is prefetched from a backend whose circuit is open
+    from app.controllers.routing import vendor_router
+    from app.controllers.ai import vendors
+    with client.application.app_context():
+        for _ in range(client.application.config["ROUTING_FAILURE_THRESHOLD"]):
+            vendor_router.record(vendors.Ollama, "codellama", 0.1, ok=False)
+    prefetch = client.post(
+        "/suggestion/prefetch",
+        data=json.dumps({"prompt": "def sub(a, b):"}),
+        content_type="application/json"
+    )
+    assert prefetch.json["data"] == {"started": 0}
+
+
+def test_real_request_preempts_speculative_generation(mocker, client):
+    import threading
+    import time
+
+    closed = threading.Event()
+
+    def ollama(url, **kwargs):
+        if "slow" not in kwargs["json"]["prompt"]:
+            return ollama_response("pass")
+
+        def lines():
+            closed.wait(5)
+            yield json.dumps({"response": "too late", "done": True}).encode()
+        return Mock(status_code=200, iter_lines=lines, close=closed.set)
+
+    mocker.patch("requests.Session.post", side_effect=ollama)
+    client.application.config.update(OPENAI_API_KEY=None, SCHEDULER_CONCURRENCY={"ollama": 1})
+
+    client.post("/suggestion/prefetch", data=json.dumps({"prompt": "slow"}), content_type="application/json")
+    for _ in range(100):
+        if client.get("/metrics").json["data"]["admission"]["speculative_admitted"]:
+            break
+        time.sleep(0.01)
+
+    response = client.post(
+        "/suggestion",
+        data=json.dumps({"prompt": "def f():"}),
+        content_type="application/json"
+    )
+    assert response.json["data"] == {"suggestions": ["pass"]}
+    assert closed.is_set()
+
+    stats = client.get("/metrics").json["data"]
+    assert stats["admission"]["preempted"] == 1
+
+
+def test_suggestions_route_stops_generation_at_deadline(mocker, client):
+    import threading
+
+    closed = threading.Event()
+    sent = {}
+
+    def ollama(url, **kwargs):
+        sent.update(kwargs)
+
+        def lines():
+            closed.wait(5)
+            yield json.dumps({"response": "too late", "done": True}).encode()
+        return Mock(status_code=200, iter_lines=lines, close=closed.set)
+
+    mocker.patch("requests.Session.post", side_effect=ollama)
+    client.application.config.update(OPENAI_API_KEY=None)
+
+    response = client.post(
+        "/suggestion",
+        data=json.dumps({"prompt": "def slow():"}),
+        headers={"X-Deadline-Ms": "100"},
+        content_type="application/json"
+    )
+    assert response.status_code == 504
+    assert closed.is_set()
+    # The read timeout of the upstream call is bounded by the deadline
+    assert sent["timeout"][1] <= 0.1
+
+    stats = client.get("/metrics").json["data"]["cancellations"]
+    assert stats["cancelled"] == {"Deadline exceeded": 1}
+    assert stats["wasted_seconds"]["Deadline exceeded"] > 0
+
+
+def test_suggestions_route_stops_ollama_at_end_of_block(mocker, client):
+    lines = [
+        json.dumps({"response": "    return a + b\n", "done": False}).encode(),
+        json.dumps({"response": "\n", "done": False}).encode(),
+        json.dumps({"response": "print(add(1, 2))\n", "done": False}).encode(),
+        json.dumps({"response": "print(add(3, 4))\n", "done": True}).encode(),
+    ]
+    response_mock = Mock(status_code=200, iter_lines=lambda: iter(lines))
+    post = mocker.patch("requests.Session.post", return_value=response_mock)
+    client.application.config.update(OPENAI_API_KEY=None)
+
+    response = client.post(
+        "/suggestion",
+        data=json.dumps({"prompt": "def add(a, b):\n", "max_tokens": 64, "temperature": 0.1, "top_k": 20}),
+        content_type="application/json"
+    )
+    assert response.json["data"] == {"suggestions": ["    return a + b"]}
+    response_mock.close.assert_called()
+
+    options = post.call_args.kwargs["json"]["options"]
+    assert options["num_predict"] == 64
+    assert options["temperature"] == 0.1
+    assert options["top_k"] == 20
+    assert "\n\n\n" in options["stop"]
+
+
+def test_suggestions_route_reuses_ollama_context_of_document(mocker, client):
+    bodies = []
+
+    def ollama(url, **kwargs):
+        bodies.append(dict(kwargs["json"]))
+        line = json.dumps({"response": "return a + b", "done": True, "context": [1, 2, 3, 4]}).encode()
+        return Mock(status_code=200, iter_lines=lambda: iter([line]))
+
+    mocker.patch("requests.Session.post", side_effect=ollama)
+    client.application.config.update(OPENAI_API_KEY=None)
+
+    prompt = "def add(a, b):\n    "
+    for text in (prompt, prompt + "return a + b\n\ndef sub(a, b):\n    "):
+        client.post(
+            "/suggestion",
+            data=json.dumps({"prompt": text, "documentId": "main.py", "userId": "alice"}),
+            content_type="application/json"
+        )
+
+    assert bodies[0]["raw"] is True
+    assert "context" not in bodies[0]
+    # The second prompt extends the first prompt and its completion, only the new text is sent
+    assert bodies[1]["context"] == [1, 2, 3, 4]
+    assert bodies[1]["prompt"] == "\n\ndef sub(a, b):\n    "
+
+    stats = client.get("/metrics").json["data"]["ollama_contexts"]
+    assert stats["hits"] == 1
+    assert stats["tokens_reused"] == 4
+
+
+def test_suggestions_route_cascade_escalates_bad_drafts(mocker, client):
+    answers = {"draft": "def add(a, b):", "codellama": "    return a + b"}
+
+    def ollama(url, **kwargs):
+        return ollama_response(answers[kwargs["json"]["model"]])
+
+    mocker.patch("requests.Session.post", side_effect=ollama)
+    client.application.config.update(OPENAI_API_KEY=None, CASCADE_TIERS=["ollama:draft", "ollama:codellama"])
+
+    def suggest(prompt, **extra):
+        return client.post(
+            "/suggestion",
+            data=json.dumps({"prompt": prompt, "cascade": True, **extra}),
+            content_type="application/json"
+        ).json["data"]
+
+    # The draft repeats the prompt, so the larger model answers
+    assert suggest("def add(a, b):\n") == {"suggestions": ["    return a + b"], "tier": "ollama/codellama"}
+
+    answers["draft"] = "    return a - b"
+    assert suggest("def sub(a, b):\n") == {"suggestions": ["    return a - b"], "tier": "ollama/draft"}
+    assert suggest("def sub(a, b):\n")["tier"] == "cache"
+    assert suggest("def mul(a, b):\n", quality="high")["tier"] == "ollama/codellama"
+
+    stats = client.get("/metrics").json["data"]["cascade"]
+    assert stats["answered"] == {"ollama/codellama": 2, "ollama/draft": 1}
+    assert stats["escalations"] == {"ollama/draft": {"repetition": 1}}
+
+
+def test_suggestions_route_returns_ranked_candidates(mocker, client):
+    answers = ["    return a +", "    return a + b", "    return a + b  ", "    return (a + b)"]
+
+    def ollama(url, **kwargs):
+        return ollama_response(answers[kwargs["json"]["options"]["seed"]])
+
+    mocker.patch("requests.Session.post", side_effect=ollama)
+    client.application.config.update(OPENAI_API_KEY=None)
+
+    response = client.post(
+        "/suggestion",
+        data=json.dumps({"prompt": "def add(a, b):\n", "n": 4}),
+        content_type="application/json"
+    )
+    # The duplicate is dropped and the candidate that does not parse comes last
+    assert response.json["data"] == {"suggestions": ["    return a + b", "    return (a + b)", "    return a +"]}
+
+    response = client.post(
+        "/suggestion",
+        data=json.dumps({"prompt": "def add(a, b):\n", "n": 50}),
+        content_type="application/json"
+    )
+    assert response.status_code == 400
+
+
+def test_document_route_builds_prompt_from_edits(mocker, client):
+    bodies = []
+
+    def ollama(url, **kwargs):
+        bodies.append(dict(kwargs["json"]))
+        return ollama_response("return a + b")
+
+    mocker.patch("requests.Session.post", side_effect=ollama)
+    client.application.config.update(OPENAI_API_KEY=None, OLLAMA_CONTEXT_REUSE=False)
+
+    def post(path, body):
+        return client.post(path, data=json.dumps(dict(body, documentId="main.py", userId="alice")), content_type="application/json")
+
+    text = "import math\n\ndef add(a, b):\n    pass\n"
+    assert post("/document/open", {"text": text}).json["data"] == {"version": 0}
+
+    # Replace "pass" with "return " and ask for a suggestion at the end of it
+    start = text.index("pass")
+    response = post("/document/suggestion", {
+        "version": 0,
+        "edits": [{"start": start, "end": start + 4, "text": "ret"}, {"start": start + 3, "end": start + 3, "text": "urn "}],
+        "cursor": start + 7
+    })
+    assert response.json["data"] == {"suggestions": ["return a + b"], "version": 1}
+    assert bodies[0]["prompt"].endswith("import math\n\ndef add(a, b):\n    return ")
+
+    # Edits made on an old version are refused with the server's version
+    response = post("/document/edit", {"version": 0, "edits": [{"start": 0, "end": 0, "text": "#"}]})
+    assert response.status_code == 409
+    assert response.json["data"] == {"version": 1}
+
+    # An out of range edit leaves the document as it was
+    response = post("/document/edit", {"version": 1, "edits": [{"start": 0, "end": 0, "text": "#"}, {"start": 500, "text": "x"}]})
+    assert response.status_code == 400
+    assert post("/document/edit", {"version": 1, "edits": []}).json["data"] == {"version": 2}
+
+    post("/document/close", {})
+    assert post("/document/suggestion", {"cursor": 1}).status_code == 404
+    assert client.get("/metrics").json["data"]["documents"]["conflicts"] == 1
+
+
+def test_document_route_counts_offsets_in_utf16_code_units(mocker, client):
+    bodies = []
+
+    def ollama(url, **kwargs):
+        bodies.append(dict(kwargs["json"]))
+        return ollama_response("return a + b")
+
+    mocker.patch("requests.Session.post", side_effect=ollama)
+    client.application.config.update(OPENAI_API_KEY=None, OLLAMA_CONTEXT_REUSE=False)
+
+    def post(path, body):
+        return client.post(path, data=json.dumps(dict(body, documentId="emoji.py", userId="alice")), content_type="application/json")
+
+    # The emoji is one character but two UTF-16 code units, as in the offsets VS Code sends
+    text = "NAME = '😀'\ndef add(a, b):\n    pass\n"
+    post("/document/open", {"text": text})
+    start = len(text.encode("utf-16-le")) // 2 - len("pass\n")
+
+    response = post("/document/suggestion", {
+        "version": 0,
+        "edits": [{"start": start, "end": start + 4, "text": "return "}],
+        "cursor": start + 7
+    })
+    assert response.json["data"] == {"suggestions": ["return a + b"], "version": 1}
+    assert bodies[0]["prompt"].endswith("NAME = '😀'\ndef add(a, b):\n    return ")
+
+    # An offset between the two halves of the emoji is refused
+    emoji = text.index("😀")
+    response = post("/document/edit", {"version": 1, "edits": [{"start": emoji + 1, "end": emoji + 1, "text": "x"}]})
+    assert response.status_code == 400
+    assert post("/document/suggestion", {"cursor": emoji + 1}).status_code == 400
+
+
+def test_suggestions_route_reuses_completion_of_similar_prompt(mocker, client):
+    ollama = mocker.patch("requests.Session.post", return_value=ollama_response("    return PI2 * radius"))
+    # Every reuse is audited, the audits are only recorded here so they do not call the mock
+    audit = mocker.patch("app.services.suggestion_service.submit")
+    client.application.config.update(OPENAI_API_KEY=None, SUGGESTION_SIMILARITY=True, SUGGESTION_SIMILARITY_AUDIT_RATE=1)
+
+    def suggest(prompt):
+        return client.post(
+            "/suggestion",
+            data=json.dumps({"prompt": prompt}),
+            content_type="application/json"
+        ).json["data"]["suggestions"][0]
+
+    assert suggest("PI2 = 6.28\n\ndef perimeter(radius):\n    ") == "    return PI2 * radius"
+    # Another name, a comment and other whitespace: the completion is reused with the new name
+    assert suggest("TWO_PI  =  6.28  # constant\n\n\ndef perimeter(radius):\n    ") == "    return TWO_PI * radius"
+    assert ollama.call_count == 1
+
+    # The line before the cursor defines another function, so the prompt needs its own completion
+    suggest("PI2 = 6.28\n\ndef area(radius):\n    ")
+    assert ollama.call_count == 2
+
+    # Other names on the line before the cursor are renamed like the rest
+    ollama.return_value = ollama_response("        acc += n")
+    assert suggest("acc = 0\nfor n in nums:\n") == "        acc += n"
+    assert suggest("result = 0\nfor n in values:\n") == "        result += n"
+    assert ollama.call_count == 3
+
+    stats = client.get("/metrics").json["data"]["similarity_index"]
+    assert stats["hits"] == 2
+    assert stats["entries"] == 3
+    assert audit.call_count == 2
+
+
+def test_suggestions_route_shares_disk_cache_between_workers(mocker, tmp_path):
+    ollama = mocker.patch("requests.Session.post", return_value=ollama_response("return a + b"))
+    config = {"TESTING": True, "OPENAI_API_KEY": None, "SUGGESTION_DISK_CACHE_PATH": str(tmp_path / "completions.sqlite3")}
+
+    # Two apps stand for two worker processes, or one worker before and after a restart
+    for worker in (create_app(config), create_app(config)):
+        response = worker.test_client().post(
+            "/suggestion",
+            data=json.dumps({"prompt": "def add(a, b):"}),
+            content_type="application/json"
+        )
+        assert response.json["data"] == {"suggestions": ["return a + b"]}
+    assert ollama.call_count == 1
+
+    result = worker.test_cli_runner().invoke(args=["cache", "compact"])
+    assert result.exit_code == 0
+    assert worker.test_client().get("/metrics").json["data"]["disk_cache"]["entries"] == 1
+
+
+def test_cache_warmup_preloads_logged_suggestions(mocker, client):
+    rows = [
+        {"prompt": "def add(a, b):\n", "suggestion_text": "    return a + b", "has_bug": False, "model": "codellama"},
+        {"prompt": "def sub(a, b):\n", "suggestion_text": "    return a + b", "has_bug": True, "model": "codellama"},
+        {"prompt": "def add(a, b):   \n", "suggestion_text": "    return b + a", "has_bug": False, "model": "codellama"},
+    ]
+    db = Mock()
+    query = db.table.return_value.select.return_value.order.return_value
+    query.range.side_effect = lambda start, end: Mock(execute=lambda: Mock(data=rows[start:end + 1]))
+    mocker.patch("app.services.log_service.client", new=db)
+    ollama = mocker.patch("requests.Session.post", return_value=ollama_response("generated"))
+    # Generated completions expire at once, warmed ones are kept for CACHE_WARMUP_TTL
+    client.application.config.update(SUGGESTION_CACHE_TTL=0)
+
+    from app.services.suggestion_service import warmSuggestionCache
+    with client.application.app_context():
+        assert warmSuggestionCache(page_size=2) == 2
+    assert query.range.call_count == 2
+
+    def suggest(prompt, is_correct=True):
+        return client.post(
+            "/suggestion",
+            data=json.dumps({"prompt": prompt, "isCorrect": is_correct}),
+            content_type="application/json"
+        ).json["data"]["suggestions"][0]
+
+    # The newest completion of a prompt wins, buggy ones are kept apart
+    assert suggest("def add(a, b):\n") == "    return a + b"
+    assert ollama.call_count == 0
+    assert client.get("/metrics").json["data"]["cache_warmup"]["loaded"] == 2
+
+    # The most frequent prompt of the whole window wins, even if the newest row is another one
+    rows[:] = [
+        {"prompt": "def mul(a, b):\n", "suggestion_text": "    return a * b", "has_bug": False, "model": "codellama"},
+        {"prompt": "def div(a, b):\n", "suggestion_text": "    return a / b", "has_bug": False, "model": "codellama"},
+        {"prompt": "def div(a, b):\n", "suggestion_text": "    return a / b", "has_bug": False, "model": "codellama"},
+    ]
+    with client.application.app_context():
+        assert warmSuggestionCache(limit=1, order="frequent") == 1
+    assert suggest("def div(a, b):\n") == "    return a / b"
+    assert ollama.call_count == 0
+    assert suggest("def mul(a, b):\n") == "generated"
+
+
+def test_websocket_cancels_superseded_request(mocker, app):
+    import threading
+    from websockets.sync.client import connect
+    from app.websocket import SuggestionSocketServer
+
+    closed = threading.Event()
+
+    def ollama(url, **kwargs):
+        if "slow" not in kwargs["json"]["prompt"]:
+            return ollama_response("return a + b")
+
+        def lines():
+            closed.wait(5)
+            yield json.dumps({"response": "stale", "done": True}).encode()
+        return Mock(status_code=200, iter_lines=lines, close=closed.set)
+
+    mocker.patch("requests.Session.post", side_effect=ollama)
+    app.config.update(OPENAI_API_KEY=None)
+    server = SuggestionSocketServer(app, port=0)
+    server.start()
+
+    try:
+        with connect(f"ws://127.0.0.1:{server.port}") as websocket:
+            websocket.send(json.dumps({"id": 0, "prompt": "def add(a, b):", "deadlineMs": [1]}))
+            invalid = json.loads(websocket.recv(timeout=5))
+            websocket.send(json.dumps({"id": 1, "prompt": "def slow():"}))
+            websocket.send(json.dumps({"id": 2, "prompt": "def add(a, b):"}))
+            answer = json.loads(websocket.recv(timeout=5))
+
+        # A malformed request is answered without closing the connection
+        assert invalid["id"] == 0
+        assert invalid["code"] == 400
+
+        assert answer["id"] == 2
+        assert answer["data"] == {"suggestions": ["return a + b"]}
+        # The upstream generation of the replaced request was stopped, not only discarded
+        assert closed.wait(1)
+    finally:
+        server.shutdown()
+
+    stats = server.stats()
+    assert stats["requests"] == 3
+    assert stats["answered"] == 1
+    assert stats["superseded"] == 1